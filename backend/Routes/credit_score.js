@@ -2,6 +2,7 @@ import express from "express";
 import verifyToken from "../Middleware/auth.js";
 import User from '../Models/user.model.js';
 import Driver from '../Models/driver.model.js';
+import syncPopulation from '../services/populationSync.js';
 
 const router = express.Router();
 
@@ -15,8 +16,7 @@ router.get("/", verifyToken, async (req, res) => {
         const role = user.role;
 
         let payload = {};
-        let otherDriversDetails = []; // define in higher scope
-        let population = [];
+        let loadPeers = null;
 
         if (role === 'driver') {
             const driver = await Driver.findOne({ userId: id });
@@ -41,51 +41,51 @@ router.get("/", verifyToken, async (req, res) => {
                 tier
             };
 
-            // --- Find other users with same role ---
-            const others = await User.find({ role: role, _id: { $ne: id } });
-
-            // Fetch their driver details
-            otherDriversDetails = await Promise.all(
-                others.map(async otherUser => {
-                    const otherDriver = await Driver.findOne({ userId: otherUser._id });
-                    if (!otherDriver) return null;
-                    return {
-                        id: otherUser._id,
-                        role: otherUser.role,
-                        username: otherUser.username,
-                        rides_completed: otherDriver.rides_30d,
-                        avg_rating: otherDriver.rating,
-                        on_time_ratio: otherDriver.on_time_rate,
-                        complaints: otherDriver.customer_complaints,
-                        behavior_score: otherDriver.behavior_score ?? 0.5,
-                        loyalty_score: otherDriver.streak_days / 60,
-                        demand_score: otherDriver.demand_score ?? 0.5,
-                        tier: otherUser.mlScores?.tier ?? "Bronze"
-                    };
-                })
-            );
-
-            // Build population array
-            population = otherDriversDetails
-                .filter(d => d !== null)
-                .map(d => ({
-                    role: d.role,
-                    rides_completed: d.rides_completed,
-                    avg_rating: d.avg_rating,
-                    on_time_ratio: d.on_time_ratio,
-                    complaints: d.complaints
-                }));
+            // --- Every user with the same role, this one included; loaded only when the
+            // ML population index is due a refresh or could not be updated ---
+            loadPeers = async () => {
+                const others = await User.find({ role: role });
+                const drivers = await Driver.find({ userId: { $in: others.map(u => u._id) } });
+                const byUser = new Map(drivers.map(d => [String(d.userId), d]));
+                return others
+                    .filter(u => byUser.has(String(u._id)))
+                    .map(u => {
+                        const otherDriver = byUser.get(String(u._id));
+                        return {
+                            id: String(u._id),
+                            role: u.role,
+                            rides_completed: otherDriver.rides_30d,
+                            avg_rating: otherDriver.rating,
+                            on_time_ratio: otherDriver.on_time_rate,
+                            complaints: otherDriver.customer_complaints
+                        };
+                    });
+            };
         }
         
+        // Rank against the ML service's population index, which leaves the user out of
+        // their own rank; only if it could not be updated send the peers (self excluded)
+        // with the request, as a population-sized bulk call
+        let population_samples = [];
+        if (loadPeers) {
+            try {
+                await syncPopulation(role, loadPeers);
+            } catch (err) {
+                console.error("Population sync failed, sending peers with the request:", err.message);
+                population_samples = (await loadPeers()).filter(p => p.id !== String(id));
+            }
+        }
+
         const apiurlpy = process.env.API_URL_PY || "http://localhost:5000";
         const response = await fetch(`${apiurlpy}/get-credit-score`, {
             method: "POST",
             headers: {
-                "Content-Type": "application/json"
+                "Content-Type": "application/json",
+                "X-Request-Class": population_samples.length ? "bulk" : "interactive"
             },
             body: JSON.stringify({
                 user_profile: payload,
-                population_samples: population
+                population_samples
             })
         });
 
@@ -0,0 +1,57 @@
+// Keeps the ML service's population index in step with the peers credit scores
+// are ranked against. Peers are reloaded from the database at most every
+// POPULATION_SYNC_SECONDS per role and only those that changed are sent, so a
+// credit score request neither carries nor loads the whole population.
+
+const apiUrl = () => process.env.API_URL_PY || "http://localhost:5000";
+const syncSeconds = () => Number(process.env.POPULATION_SYNC_SECONDS || 300);
+
+// role -> { peers: Map(peer id -> JSON of the peer as last upserted), at: ms of the last load }
+const synced = new Map();
+// role -> the sync in progress, so concurrent requests share one
+const running = new Map();
+
+async function request(path, body) {
+    const response = await fetch(`${apiUrl()}${path}`, body === undefined ? {} : {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "X-Request-Class": "bulk" },
+        body: JSON.stringify(body)
+    });
+    if (!response.ok) throw new Error(`ML service ${path} returned ${response.status}`);
+    return response.json();
+}
+
+async function sync(role, loadPeers) {
+    const known = synced.get(role);
+    if (known && Date.now() - known.at < syncSeconds() * 1000) {
+        // Fresh: only check the service still holds them, e.g. it has not restarted
+        const indexed = await request("/population");
+        if ((indexed.roles?.[role] ?? 0) >= known.peers.size) return;
+    }
+
+    const peers = await loadPeers();
+    const current = new Map(peers.map(p => [String(p.id), JSON.stringify(p)]));
+    const indexed = known ? await request("/population") : null;
+    // After a restart (fewer peers indexed than we sent) everyone is sent again
+    const previous = known && (indexed.roles?.[role] ?? 0) >= known.peers.size ? known.peers : new Map();
+
+    const changed = peers.filter(p => previous.get(String(p.id)) !== current.get(String(p.id)));
+    const removed = [...previous.keys()].filter(id => !current.has(id));
+    if (removed.length) await request("/population/delete", { peer_ids: removed });
+    if (changed.length) await request("/population/upsert", { peers: changed });
+
+    synced.set(role, { peers: current, at: Date.now() });
+}
+
+// loadPeers() resolves to every user of role, each with an id; it is only called when
+// the synced copy is stale. Throws if the ML service could not be updated.
+export async function syncPopulation(role, loadPeers) {
+    let pending = running.get(role);
+    if (!pending) {
+        pending = sync(role, loadPeers).finally(() => running.delete(role));
+        running.set(role, pending);
+    }
+    return pending;
+}
+
+export default syncPopulation;
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from settings import ACTIVITY_DB
+
+
+class ActivityState:
+    """
+    Running summary of one user's daily activity log.
+
+    Holds the day count, the inactive-day count and the inactive-streak
+    statistics, so appending days is O(new days) and reading the stats is
+    O(1). The days themselves are kept as a bitset (bit set = active) so a
+    state can always be audited against the log it came from.
+    """
+
+    __slots__ = ("days", "inactive_days", "closed_streaks", "closed_total", "closed_max",
+                 "open_streak", "history")
+
+    def __init__(self, days=0, inactive_days=0, closed_streaks=0, closed_total=0, closed_max=0,
+                 open_streak=0, history=b""):
+        self.days = days
+        self.inactive_days = inactive_days
+        self.closed_streaks = closed_streaks  # finished runs of inactive days
+        self.closed_total = closed_total
+        self.closed_max = closed_max
+        self.open_streak = open_streak        # inactive days at the end of the log so far
+        self.history = bytearray(history)
+
+    @classmethod
+    def from_log(cls, activity_log):
+        state = cls()
+        state.extend(activity_log)
+        return state
+
+    def extend(self, activity_log):
+        """Append days given as {"active": bool} dicts, oldest first."""
+        for day in activity_log:
+            self.append(day["active"])
+        return self
+
+    def append(self, active):
+        index = self.days
+        if index % 8 == 0:
+            self.history.append(0)
+        self.days += 1
+        if active:
+            self.history[index // 8] |= 1 << (index % 8)
+            if self.open_streak:
+                self.closed_streaks += 1
+                self.closed_total += self.open_streak
+                self.closed_max = max(self.closed_max, self.open_streak)
+                self.open_streak = 0
+        else:
+            self.inactive_days += 1
+            self.open_streak += 1
+
+    def day_active(self, index):
+        return bool(self.history[index // 8] >> (index % 8) & 1)
+
+    def counts(self):
+        """(inconsistent_days, inactivity_days), as utils.compute_days returns them."""
+        return self.inactive_days, self.inactive_days
+
+    def streak_stats(self):
+        """(avg_inactive_streak, max_inactive_streak), as utils.detailed_activity_analysis returns them."""
+        streaks = self.closed_streaks + (1 if self.open_streak else 0)
+        if not streaks:
+            return 0, 0
+        total = self.closed_total + self.open_streak
+        return np.float64(total) / streaks, max(self.closed_max, self.open_streak)
+
+    def to_row(self):
+        return (self.days, self.inactive_days, self.closed_streaks, self.closed_total,
+                self.closed_max, self.open_streak, bytes(self.history))
+
+    def to_dict(self):
+        avg_streak, max_streak = self.streak_stats()
+        return {
+            "days": self.days,
+            "inactivity_days": self.inactive_days,
+            "avg_inactive_streak": float(avg_streak),
+            "max_inactive_streak": max_streak,
+            "current_inactive_streak": self.open_streak
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, ActivityState) and self.to_row() == other.to_row()
+
+    def __repr__(self):
+        # Score cache keys hash this, so it must cover everything the scores depend on
+        return ("ActivityState(days=%d, inactive=%d, closed=%d/%d/%d, open=%d)"
+                % (self.days, self.inactive_days, self.closed_streaks, self.closed_total,
+                   self.closed_max, self.open_streak))
+
+
+class ActivityGap(ValueError):
+    """Raised when appended days would leave a hole in a user's history."""
+
+
+class ActivityStore:
+    """
+    Per-user ActivityState persisted in SQLite. Without a path the database
+    lives in memory and is lost on restart.
+    """
+
+    def __init__(self, path=ACTIVITY_DB):
+        self.path = path or ":memory:"
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS activity_state (user_id TEXT PRIMARY KEY, days INTEGER, "
+                "inactive_days INTEGER, closed_streaks INTEGER, closed_total INTEGER, closed_max INTEGER, "
+                "open_streak INTEGER, history BLOB)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _get(self, conn, user_id):
+        row = conn.execute(
+            "SELECT days, inactive_days, closed_streaks, closed_total, closed_max, open_streak, history "
+            "FROM activity_state WHERE user_id = ?", (str(user_id),)
+        ).fetchone()
+        return ActivityState(*row) if row else None
+
+    def _put(self, conn, user_id, state):
+        conn.execute("INSERT OR REPLACE INTO activity_state VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (str(user_id), *state.to_row()))
+
+    def get(self, user_id):
+        with self._lock:
+            return self._get(self._connect(), user_id)
+
+    def append(self, user_id, days, start_day=None):
+        """
+        Append new days to a user's state and return it. With start_day (the
+        index of days[0] in the user's history) days already recorded are
+        skipped, so a retried request is not counted twice.
+        """
+        return self.append_many([(user_id, days, start_day)])[0]
+
+    def append_many(self, updates):
+        """append() for several (user_id, days, start_day) updates in one transaction."""
+        with self._lock:
+            conn = self._connect()
+            # Take the write lock before reading: worker processes sharing the file
+            # then wait their turn (sqlite's busy timeout) instead of two deferred
+            # transactions both reading the old state and one failing to commit
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                states = []
+                for user_id, days, start_day in updates:
+                    state = self._get(conn, user_id) or ActivityState()
+                    if start_day is not None:
+                        if start_day > state.days:
+                            raise ActivityGap(
+                                f"User {user_id} has {state.days} days of activity, cannot append from day {start_day}"
+                            )
+                        days = days[state.days - start_day:]
+                    state.extend(days)
+                    self._put(conn, user_id, state)
+                    states.append(state)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return states
+
+    def replace(self, user_id, activity_log):
+        """Rebuild a user's state from their full log."""
+        state = ActivityState.from_log(activity_log)
+        with self._lock:
+            self._put(self._connect(), user_id, state)
+        return state
+
+    def delete(self, user_id):
+        with self._lock:
+            return self._connect().execute(
+                "DELETE FROM activity_state WHERE user_id = ?", (str(user_id),)
+            ).rowcount > 0
+
+
+# Single store for the service
+activity_store = ActivityStore()
+
+__all__ = ["ActivityState", "ActivityStore", "ActivityGap", "activity_store"]
@@ -0,0 +1,433 @@
+"""
+Time every scoring stage on seeded synthetic data and write the results as JSON.
+
+    python benchmark.py --scale 1k --output bench-1k.json
+    python benchmark.py --scale 100k --output new.json --baseline old.json
+    python benchmark.py --scale 1m --only population_upsert compute_global_score
+
+The scale (1k, 100k, 1m or a number) is the size of the indexed peer
+population and of the user stream the stages draw from. Single-call stages
+time one call per user and batch stages one call per --batch-size users; each
+stage stops after --max-calls calls or --max-seconds, whichever comes first,
+so large scales stay bounded. HTTP stages go through the FastAPI app in
+process, with the score cache off.
+
+With --baseline the run is compared stage by stage on median call time and
+the exit status is 1 if any stage got slower by more than --tolerance.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from itertools import chain
+
+import numpy as np
+
+from synthetic import population_chunks, profile_chunks, spam_training_frame
+from tracing import configure_logging
+
+logger = logging.getLogger("benchmark")
+
+SCALES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+
+
+def parse_scale(value):
+    try:
+        return SCALES[value.lower()] if value.lower() in SCALES else int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Unknown scale '{value}', expected one of {', '.join(SCALES)} or a number")
+
+
+# ---------------- Timing ---------------- #
+def summarize(samples_ns, items):
+    """Call latency percentiles in ms, plus throughput in items per second."""
+    samples = np.array(samples_ns, dtype=np.float64) / 1e6
+    total = samples.sum() / 1000
+    return {
+        "calls": len(samples),
+        "items": items,
+        "total_s": round(total, 4),
+        "mean_ms": round(samples.mean(), 4),
+        "p50_ms": round(np.percentile(samples, 50), 4),
+        "p95_ms": round(np.percentile(samples, 95), 4),
+        "p99_ms": round(np.percentile(samples, 99), 4),
+        "min_ms": round(samples.min(), 4),
+        "max_ms": round(samples.max(), 4),
+        "items_per_s": round(items / total, 1) if total else None
+    }
+
+
+class Runner:
+    def __init__(self, max_calls, max_seconds, warmup):
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.warmup = warmup
+
+    def run(self, fn, inputs, size=None):
+        """
+        Time fn(x) for each x in inputs until the call or time budget runs out.
+        size(x) is the number of items one call handles; 1 by default.
+        """
+        inputs = iter(inputs)
+        first = next(inputs, None)
+        if first is None:
+            return None
+        for _ in range(self.warmup):
+            fn(first)
+        gc.collect()
+        samples, items = [], 0
+        deadline = time.perf_counter() + self.max_seconds
+        for x in chain([first], inputs):
+            start = time.perf_counter_ns()
+            fn(x)
+            samples.append(time.perf_counter_ns() - start)
+            items += size(x) if size else 1
+            if len(samples) >= self.max_calls or time.perf_counter() >= deadline:
+                break
+        return summarize(samples, items)
+
+
+# ---------------- Stages ---------------- #
+class Context:
+    """Inputs shared by the stages; every stream restarts from the seed."""
+
+    def __init__(self, n, seed, batch_size):
+        self.n = n
+        self.seed = seed
+        self.batch_size = batch_size
+
+    def profiles(self):
+        return chain.from_iterable(self.batches())
+
+    def batches(self):
+        return profile_chunks(self.n, self.seed, chunk_size=self.batch_size)
+
+
+STAGES = {}
+
+
+def stage(name):
+    def register(fn):
+        STAGES[name] = fn
+        return fn
+    return register
+
+
+@stage("population_upsert")
+def bench_population_upsert(ctx, runner):
+    from final_credit_score import upsert_population_peers
+    from population_index import population_index
+    # Always indexes the whole population, since the global score stages rank against it
+    samples, items = [], 0
+    for peers in population_chunks(ctx.n, ctx.seed, chunk_size=min(ctx.n, 100000)):
+        start = time.perf_counter_ns()
+        upsert_population_peers(peers)
+        samples.append(time.perf_counter_ns() - start)
+        items += len(peers)
+    logger.info("Population index holds %d peers", population_index.size())
+    return summarize(samples, items)
+
+
+@stage("compute_role_score")
+def bench_role_score(ctx, runner):
+    from final_credit_score import compute_role_score
+    return runner.run(compute_role_score, ctx.profiles())
+
+
+@stage("compute_global_score")
+def bench_global_score(ctx, runner):
+    from final_credit_score import compute_global_score
+    return runner.run(compute_global_score, ctx.profiles())
+
+
+@stage("predict_with_error")
+def bench_predict(ctx, runner):
+    from feature_schema import ROLE_SCHEMAS
+    from ml_model_module import predict_with_error
+    rows = (ROLE_SCHEMAS[p["role"]].extract(p["features"]) for p in ctx.profiles())
+    return runner.run(predict_with_error, rows)
+
+
+@stage("predict_with_error_batch")
+def bench_predict_batch(ctx, runner):
+    from feature_schema import ROLE_SCHEMAS
+    from ml_model_module import predict_with_error_batch
+    matrices = (
+        np.vstack([ROLE_SCHEMAS[p["role"]].extract(p["features"]) for p in batch])
+        for batch in ctx.batches()
+    )
+    return runner.run(predict_with_error_batch, matrices, len)
+
+
+@stage("level_model_xgboost")
+def bench_level_xgboost(ctx, runner):
+    # The booster alone, one row per call: the baseline for level_model_flat
+    from feature_schema import ROLE_SCHEMAS
+    from ml_model_module import current_level_model
+    model = current_level_model().model
+    rows = (ROLE_SCHEMAS[p["role"]].extract(p["features"]) for p in ctx.profiles())
+    return runner.run(model.predict, rows)
+
+
+@stage("level_model_flat")
+def bench_level_flat(ctx, runner):
+    from feature_schema import ROLE_SCHEMAS
+    from ml_model_module import current_level_model
+    from tree_predictor import FlatTreeEnsemble
+    model = current_level_model().model
+    predictor = FlatTreeEnsemble.from_booster(model.get_booster())
+    rows = (ROLE_SCHEMAS[p["role"]].extract(p["features"]) for p in ctx.profiles())
+    return runner.run(predictor.predict, rows)
+
+
+@stage("spam_score")
+def bench_spam(ctx, runner):
+    from level_score import spam_detector
+    return runner.run(spam_detector.predict_hybrid_score, (p["features"] for p in ctx.profiles()))
+
+
+@stage("spam_score_batch")
+def bench_spam_batch(ctx, runner):
+    from level_score import spam_detector
+    feature_batches = ([p["features"] for p in batch] for batch in ctx.batches())
+    return runner.run(spam_detector.predict_hybrid_scores, feature_batches, len)
+
+
+@stage("compute_level_score_backend")
+def bench_level(ctx, runner):
+    from level_score import compute_level_score_backend
+    return runner.run(
+        lambda p: compute_level_score_backend(p, {}, 30, p["history_scores"]),
+        ctx.profiles()
+    )
+
+
+@stage("compute_level_scores_batch")
+def bench_level_batch(ctx, runner):
+    from level_score import compute_level_scores_batch
+    return runner.run(
+        lambda batch: compute_level_scores_batch(
+            batch, {}, 30, [p["history_scores"] for p in batch]
+        ),
+        ctx.batches(), len
+    )
+
+
+@stage("compute_final_credit_score")
+def bench_credit(ctx, runner):
+    from final_credit_score import compute_final_credit_score
+    return runner.run(compute_final_credit_score, ctx.profiles())
+
+
+@stage("compute_scores")
+def bench_scores(ctx, runner):
+    # Level and credit score in one pass, as /score computes them
+    from final_credit_score import compute_scores
+    return runner.run(compute_scores, ctx.profiles())
+
+
+@contextlib.contextmanager
+def _http_client():
+    from fastapi.testclient import TestClient
+    import server
+    import wire_format
+    from score_cache import score_cache
+    from score_history import ScoreHistoryStore
+    # Every request should do the work it would on a cache miss
+    max_bytes, score_cache.max_bytes = score_cache.max_bytes, 0
+    # Scores are recorded in a throwaway history, not the service's
+    history = server.score_history
+    server.score_history = wire_format.score_history = ScoreHistoryStore(":memory:")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    try:
+        # Not entered as a context manager: the shutdown event would stop the scoring executor
+        yield TestClient(server.app)
+    finally:
+        score_cache.max_bytes = max_bytes
+        server.score_history = wire_format.score_history = history
+
+
+def _level_request(profile):
+    return {key: profile[key] for key in ("user_id", "role", "features", "activity_log", "history_scores")}
+
+
+def _post(client, path, body, content_type="application/json"):
+    response = client.post(path, content=body, headers={"content-type": content_type})
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+
+
+@stage("http_calculate_score")
+def bench_http_score(ctx, runner):
+    with _http_client() as client:
+        # Bodies are encoded before timing starts, as a client would send them
+        bodies = (json.dumps(_level_request(p)).encode() for p in ctx.profiles())
+        return runner.run(lambda body: _post(client, "/calculate-score", body), bodies)
+
+
+@stage("http_calculate_scores_batch")
+def bench_http_batch(ctx, runner):
+    with _http_client() as client:
+        bodies = (
+            (len(batch), json.dumps({"users": [_level_request(p) for p in batch]}).encode())
+            for batch in ctx.batches()
+        )
+        return runner.run(lambda b: _post(client, "/calculate-scores/batch", b[1]), bodies, lambda b: b[0])
+
+
+@stage("http_calculate_scores_batch_binary")
+def bench_http_batch_binary(ctx, runner):
+    import wire_format
+    with _http_client() as client:
+        bodies = (
+            (len(batch), wire_format.encode_level_batch(batch, [p["history_scores"] for p in batch]))
+            for batch in ctx.batches()
+        )
+        return runner.run(
+            lambda b: _post(client, "/calculate-scores/batch", b[1], wire_format.MEDIA_TYPE),
+            bodies, lambda b: b[0]
+        )
+
+
+@stage("http_get_credit_score")
+def bench_http_credit(ctx, runner):
+    with _http_client() as client:
+        bodies = (json.dumps({"user_profile": p}).encode() for p in ctx.profiles())
+        return runner.run(lambda body: _post(client, "/get-credit-score", body), bodies)
+
+
+@stage("http_score")
+def bench_http_unified(ctx, runner):
+    with _http_client() as client:
+        bodies = (json.dumps({"user_profile": p}).encode() for p in ctx.profiles())
+        return runner.run(lambda body: _post(client, "/score", body), bodies)
+
+
+# ---------------- Setup and reporting ---------------- #
+def prepare_models(seed):
+    """Train spam models on synthetic data when none are published, so spam stages do real work."""
+    from level_score import spam_detector
+    from hybridspamdetector import HybridSpamDetector
+    if spam_detector.supervised_model is not None and spam_detector.iso_model is not None:
+        return "published"
+    detector = HybridSpamDetector()
+    frame = spam_training_frame(seed=seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        detector.train_supervised(frame)
+    detector.fit_anomaly(frame)
+    spam_detector.swap_models(detector.models)
+    return "synthetic"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(args, spam_source):
+    import sklearn
+    import xgboost
+    from model_registry import loaded_models
+    import settings
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "xgboost": xgboost.__version__,
+        "sklearn": sklearn.__version__,
+        "models": {name: meta.get("version") for name, meta in loaded_models.items()},
+        "spam_models": spam_source,
+        "coalesce_window_ms": settings.COALESCE_WINDOW_MS,
+        "executor": settings.EXECUTOR_KIND,
+        "scale": args.scale,
+        "seed": args.seed,
+        "batch_size": args.batch_size,
+        "max_calls": args.max_calls,
+        "max_seconds": args.max_seconds
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each stage against the baseline and return the stages that regressed."""
+    regressions = []
+    print(f"\n{'stage':40} {'baseline p50':>14} {'current p50':>14} {'ratio':>7}")
+    for name, current in results["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not current or not before:
+            continue
+        ratio = current["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:40} {before['p50_ms']:>12.4f}ms {current['p50_ms']:>12.4f}ms {ratio:>7.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def run(args):
+    spam_source = prepare_models(args.seed)
+    results = {"environment": environment(args, spam_source), "stages": {}}
+    ctx = Context(args.scale, args.seed, args.batch_size)
+    runner = Runner(args.max_calls, args.max_seconds, args.warmup)
+    names = args.only or list(STAGES)
+    if any(name.startswith(("compute_global", "compute_final", "http_get_credit")) for name in names) \
+            and "population_upsert" not in names:
+        # Global scores rank against the indexed population, so it has to be there
+        names = ["population_upsert"] + names
+    for name in names:
+        logger.info("Running %s", name)
+        results["stages"][name] = stats = STAGES[name](ctx, runner)
+        if stats:
+            print(f"{name:40} {stats['calls']:>7} calls  p50 {stats['p50_ms']:>10.4f}ms  "
+                  f"p99 {stats['p99_ms']:>10.4f}ms  {stats['items_per_s'] or 0:>12.1f} items/s")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scoring stages on synthetic data")
+    parser.add_argument("--scale", type=parse_scale, default=SCALES["1k"],
+                        help="population and user stream size: 1k, 100k, 1m or a number")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=1000, help="users per batch call")
+    parser.add_argument("--max-calls", type=int, default=1000, help="timed calls per stage at most")
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="time spent per stage at most")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed calls before each stage")
+    parser.add_argument("--only", nargs="+", choices=list(STAGES), help="run only these stages")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown of a stage's median before it counts as a regression")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
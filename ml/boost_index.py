@@ -0,0 +1,145 @@
+import threading
+
+import numpy as np
+
+
+def _sorted_unique(keys, boosts):
+    """Sort by key, keeping the first row of any duplicated id like the old row filter did."""
+    keys, first = np.unique(keys, return_index=True)
+    return keys, np.asarray(boosts, dtype=float)[first]
+
+
+def _int_key(key):
+    """The integer a string id stands for, or None if str(int) would not give the same string back."""
+    try:
+        value = int(key)
+    except ValueError:
+        return None
+    if str(value) != key or not -2**63 <= value < 2**63:
+        return None
+    return value
+
+
+class BoostIndex:
+    """
+    Initial boosts keyed by user id.
+
+    The bulk of the table is a sorted key array and a matching boost array,
+    which can be memory-mapped straight from a published artifact, so a
+    lookup is one binary search. Ids are matched on str(user_id), as the old
+    DataFrame filter did. Users added after the table was built go into a
+    small overlay dict, which is merged into the arrays once it passes
+    compact_at entries.
+    """
+
+    def __init__(self, compact_at=10000):
+        self._lock = threading.Lock()
+        self.compact_at = compact_at
+        # (sorted keys, boosts, keys are integers); replaced as one tuple
+        self._table = (np.empty(0, dtype=np.int64), np.empty(0, dtype=float), True)
+        self._overlay = {}  # str(user_id) -> boost
+        self.generation = 0
+
+    @staticmethod
+    def build(user_ids, boosts):
+        """Sorted key and boost arrays for load_sorted(), e.g. to publish alongside a boost table."""
+        user_ids = np.asarray(user_ids)
+        if user_ids.dtype.kind in "iu":
+            user_ids = user_ids.astype(np.int64)
+        else:
+            user_ids = user_ids.astype(str)
+        return _sorted_unique(user_ids, boosts)
+
+    def load(self, user_ids, boosts):
+        self.load_sorted(*self.build(user_ids, boosts))
+
+    def load_sorted(self, keys, boosts):
+        """Replace the whole table with already sorted, de-duplicated arrays."""
+        with self._lock:
+            self._table = (keys, boosts, keys.dtype.kind == "i")
+            self._overlay = {}
+            self.generation += 1
+
+    @staticmethod
+    def _search(table, key):
+        keys, boosts, is_int = table
+        if is_int:
+            key = _int_key(key)
+            if key is None:
+                return None
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return boosts[i]
+        return None
+
+    def get(self, user_id, default=0):
+        key = str(user_id)
+        boost = self._overlay.get(key)
+        if boost is None:
+            boost = self._search(self._table, key)
+        return default if boost is None else boost
+
+    def get_many(self, user_ids):
+        """Boosts for a list of ids (0 where missing) and a mask of the ids that were found."""
+        queries = [str(u) for u in user_ids]
+        keys, boosts, is_int = self._table
+        values = np.zeros(len(queries))
+        found = np.zeros(len(queries), dtype=bool)
+        if len(keys) and queries:
+            if is_int:
+                ints = [_int_key(q) for q in queries]
+                valid = np.array([i is not None for i in ints])
+                probe = np.array([i if i is not None else 0 for i in ints], dtype=keys.dtype)
+            else:
+                valid = np.ones(len(queries), dtype=bool)
+                probe = np.array(queries, dtype=str)
+            pos = np.minimum(np.searchsorted(keys, probe), len(keys) - 1)
+            hit = valid & (keys[pos] == probe)
+            values[hit] = boosts[pos[hit]]
+            found |= hit
+        overlay = self._overlay
+        if overlay:
+            for i, key in enumerate(queries):
+                boost = overlay.get(key)
+                if boost is not None:
+                    values[i] = boost
+                    found[i] = True
+        return values, found
+
+    def upsert_many(self, entries):
+        """Insert or replace several (user_id, boost) entries."""
+        with self._lock:
+            for user_id, boost in entries:
+                self._overlay[str(user_id)] = np.float64(boost)
+            self.generation += 1
+            if len(self._overlay) >= self.compact_at:
+                self._compact()
+
+    def _compact(self):
+        keys, boosts, is_int = self._table
+        overlay = self._overlay
+        new_keys = list(overlay)
+        if is_int and all(_int_key(k) is not None for k in new_keys):
+            extra = np.array([int(k) for k in new_keys], dtype=np.int64)
+        else:
+            keys = keys.astype(str)
+            extra = np.array(new_keys, dtype=str)
+        keep = ~np.isin(keys, extra)
+        merged_keys = np.concatenate([keys[keep], extra])
+        merged_boosts = np.concatenate([boosts[keep], np.array(list(overlay.values()), dtype=float)])
+        order = np.argsort(merged_keys, kind="stable")
+        # Swap the table before clearing the overlay so readers always find each id somewhere
+        self._table = (merged_keys[order], merged_boosts[order], merged_keys.dtype.kind == "i")
+        self._overlay = {}
+
+    def stats(self):
+        keys, _, is_int = self._table
+        return {
+            "generation": self.generation,
+            "indexed": len(keys),
+            "pending": len(self._overlay),
+            "integer_ids": is_int
+        }
+
+
+__all__ = ["BoostIndex"]
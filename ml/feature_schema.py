@@ -0,0 +1,98 @@
+import threading
+from itertools import chain
+
+import numpy as np
+
+from utils import ROLE_FEATURE_KEYS, ROLE_FEATURE_WEIGHTS
+
+
+class FeatureSchema:
+    """
+    Ordered, weighted model inputs for one role.
+
+    The schema is checked once when it is built. After that, extraction reads
+    each feature and converts it with float(), so a bad value raises exactly as
+    the old list-based code did. The weights are applied as the values are
+    written into the output array.
+    """
+
+    def __init__(self, role, keys, weights):
+        keys = tuple(keys)
+        if not keys or not all(isinstance(k, str) for k in keys):
+            raise ValueError(f"Feature schema for '{role}' needs a non-empty list of feature names")
+        if len(set(keys)) != len(keys):
+            raise ValueError(f"Feature schema for '{role}' repeats a feature name")
+        if len(weights) != len(keys):
+            raise ValueError(f"Feature schema for '{role}' has {len(keys)} features but {len(weights)} weights")
+        self.role = role
+        self.keys = keys
+        self.width = len(keys)
+        self.weights = np.array([float(w) for w in weights], dtype=float)
+        self._defaults = (0,) * self.width
+        self._local = threading.local()
+
+    def _values(self, features):
+        return map(float, map(features.get, self.keys, self._defaults))
+
+    def _buffers(self):
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            flat = np.empty(self.width, dtype=float)
+            buffers = self._local.buffers = (flat, flat.reshape(1, self.width))
+        return buffers
+
+    def extract_into(self, features, out):
+        """Write the weighted features of one feature dict into the 1-D array out."""
+        raw = np.fromiter(self._values(features), dtype=float, count=self.width)
+        np.multiply(raw, self.weights, out=out)
+        return out
+
+    def extract_row(self, features):
+        """
+        Weighted features as a (1, width) view of this thread's reusable buffer.
+        The view is overwritten by the thread's next call, so callers must be done with it by then.
+        """
+        flat, row = self._buffers()
+        self.extract_into(features, flat)
+        return row
+
+    def extract(self, features):
+        """Weighted features as a new (1, width) array."""
+        out = np.empty(self.width, dtype=float)
+        return self.extract_into(features, out).reshape(1, self.width)
+
+    def extract_batch(self, feature_dicts, out=None):
+        """Weighted (N, width) matrix for a list of feature dicts."""
+        n = len(feature_dicts)
+        raw = np.fromiter(
+            chain.from_iterable(map(self._values, feature_dicts)),
+            dtype=float, count=n * self.width
+        ).reshape(n, self.width)
+        if out is None:
+            out = raw
+        np.multiply(raw, self.weights, out=out)
+        return out
+
+
+def compile_role_schemas(feature_keys=ROLE_FEATURE_KEYS, feature_weights=ROLE_FEATURE_WEIGHTS):
+    """Build one FeatureSchema per role. Roles without weights get 1.0 for every feature."""
+    return {
+        role: FeatureSchema(role, keys, feature_weights.get(role, [1]*len(keys)))
+        for role, keys in feature_keys.items()
+    }
+
+
+def generic_weighted_features(features, role, feature_weights=ROLE_FEATURE_WEIGHTS):
+    """
+    Fallback for roles with no schema: every feature in dict order, weighted by
+    the role's weights if it has any. zip() drops features beyond the weights.
+    """
+    values = list(features.values())
+    weights = feature_weights.get(role, [1]*len(values))
+    return np.array([float(f)*float(w) for f, w in zip(values, weights)], dtype=float).reshape(1, -1)
+
+
+# Compiled at import; adding a role only needs entries in utils.ROLE_FEATURE_KEYS/WEIGHTS
+ROLE_SCHEMAS = compile_role_schemas()
+
+__all__ = ["FeatureSchema", "ROLE_SCHEMAS", "compile_role_schemas", "generic_weighted_features"]
@@ -1,19 +1,17 @@
 import numpy as np
 import logging
-from level_score import compute_level_score_backend
+from level_score import LEVEL_MONTH_ACTIVE, level_result  # importing it registers the level stages
+from stage_graph import scoring_stages
+from population_index import population_index
+from quantile_sketch import population_sketches
+from tracing import configure_logging, span
 
 
 # ---------------- Logging Setup ---------------- #
-# Sets up logging to capture warnings and errors, saving them to a file
-# and also printing them to the console for immediate visibility.
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("credit_score_warnings.log"),  # logs to file
-        logging.StreamHandler()  # logs to console
-    ]
-)
+# Warnings and errors go to the console and credit_score_warnings.log through
+# a queue, so scoring threads never wait on log I/O.
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # ---------------- Model Configuration ---------------- #
  
@@ -69,7 +67,7 @@ def normalize_feature(value, feature_name):
     """
     try:
         if not isinstance(value, (int, float)):
-            logging.warning(f"Feature '{feature_name}' has invalid type '{type(value).__name__}', using default 0")
+            logger.warning("Feature '%s' has invalid type '%s', using default 0", feature_name, type(value).__name__)
             value = 0
 
         # Note: In a production system, these normalization ceilings (e.g., 100.0) would
@@ -88,7 +86,7 @@ def normalize_feature(value, feature_name):
         else:
             return 0.5
     except Exception as e:
-        logging.warning(f"Failed to normalize feature '{feature_name}' with value '{value}': {e}")
+        logger.warning("Failed to normalize feature '%s' with value '%s': %s", feature_name, value, e)
         return 0.5
 
 # ---------------- Core Score Calculation Logic ---------------- #
@@ -109,26 +107,61 @@ def compute_role_score(user_profile):
         role_score = numerator / denominator if denominator != 0 else 0.5
         return role_score * 100
     except Exception as e:
-        logging.error(f"Error in compute_role_score for user {user_profile.get('id', 'N/A')}: {e}")
+        logger.error("Error in compute_role_score for user %s: %s", user_profile.get('id', 'N/A'), e)
         return 50
 
-def compute_global_score(user_profile, population_samples):
-    """Compute the global percentile score by comparing a user against their peers."""
+def compute_global_score(user_profile, population_samples=None):
+    """
+    Compute the global percentile score by comparing a user against their peers.
+    When no population_samples are passed, the user is ranked against the
+    server-side population index instead, or failing that against the sketch
+    of role scores the service has computed.
+    """
     try:
-        if not population_samples or not isinstance(population_samples, list):
-            raise ValueError("Population samples must be a non-empty list")
-        
         role = user_profile.get("role")
+        user_id = user_profile.get("id", user_profile.get("user_id"))
         raw_score = compute_role_score(user_profile)
-        population_scores = [compute_role_score(p) for p in population_samples if p.get("role") == role]
-        
-        rank = percentile_rank(raw_score, population_scores)
+
+        if population_samples:
+            if not isinstance(population_samples, list):
+                raise ValueError("Population samples must be a list")
+            population_scores = [compute_role_score(p) for p in population_samples if p.get("role") == role]
+            rank = percentile_rank(raw_score, population_scores)
+        elif population_index.size(role, exclude=user_id):
+            # The user may be indexed as everyone else's peer; they are not their own
+            rank = population_index.percentile_rank(role, raw_score, exclude=user_id)
+        else:
+            # No peers indexed: rank against the role scores of users scored so far
+            rank = population_sketches.percentile_rank("role_score", role, raw_score)
+        if rank is None:
+            raise ValueError(f"No population indexed for role '{role}' and too few scores sketched")
+        # Only scores that were ranked join the sketch, so failed requests leave it and its generation alone
+        population_sketches.add("role_score", role, raw_score)
+
         # Scale rank to a score between 40 and 100
         return 40 + 60 * rank
     except Exception as e:
-        logging.error(f"Error in compute_global_score for user {user_profile.get('id', 'N/A')}: {e}")
+        logger.error("Error in compute_global_score for user %s: %s", user_profile.get('id', 'N/A'), e)
         return 50
 
+def upsert_population_peers(peer_profiles):
+    """Score peers once and store them in the population index, keyed by their id."""
+    entries = []
+    for peer in peer_profiles:
+        peer_id = peer.get("id")
+        role = peer.get("role")
+        if peer_id is None:
+            raise ValueError("Population peers must have an 'id'")
+        if role not in ROLE_WEIGHTS:
+            raise ValueError(f"Invalid role '{role}' for peer {peer_id}")
+        entries.append((str(peer_id), role, compute_role_score(peer)))
+    population_index.upsert_many(entries)
+    return len(entries)
+
+def delete_population_peers(peer_ids):
+    """Remove peers from the population index, returning how many were present."""
+    return population_index.delete_many([str(peer_id) for peer_id in peer_ids])
+
 def fairness_adjustment(global_score, accept_rate=0.6, target_accept=0.7, eta=0.1):
     """
     Apply a post-processing fairness adjustment to correct for group-level disparities
@@ -139,65 +172,92 @@ def fairness_adjustment(global_score, accept_rate=0.6, target_accept=0.7, eta=0.
         adjusted_score = np.clip(global_score + adj, 0, 100)
         return adjusted_score, adj
     except Exception as e:
-        logging.error(f"Error in fairness_adjustment: {e}")
+        logger.error("Error in fairness_adjustment: %s", e)
         return global_score, 0
 
-def compute_final_credit_score(user_profile, population_samples,
-                               delta_base=2.0, lambda_r=0.7,
-                               accept_rate=0.6, target_accept=0.7, eta=0.1):
-    """
-    Compute the final credit score by combining the role-specific performance,
-    global peer ranking, fairness adjustments, and loyalty tier bonuses.
-    """
+# ---------------- Scoring stages ----------------
+# compute_final_credit_score as stages of scoring_stages, on top of the level
+# stages registered in level_score.py. Run params: user_profile,
+# population_samples, delta_base, lambda_r, accept_rate, target_accept, eta,
+# credit_month_active, and the level stages' level_population, month_active
+# and history_scores.
+
+def _check_role(user_profile):
+    role = user_profile.get("role")
+    if role not in ROLE_WEIGHTS:
+        raise ValueError(f"Invalid role '{role}'")
+    return role
+
+@scoring_stages.stage("credit_level")
+def _credit_level_stage(run):
+    # The level score the credit score builds on: the profile's month_active
+    # (default 1, so first-time boosts apply) rather than the level endpoints'
+    month_active = run.params["credit_month_active"]
+    if month_active == run.params["month_active"]:
+        return run.get("level")
+    return level_result(run, month_active)
+
+@scoring_stages.stage("role", view=lambda role_component: {"role_component": round(role_component, 2)})
+def _role_stage(run):
+    user_profile = run.params["user_profile"]
+    role = _check_role(user_profile)
+
+    # --- 1. Role Component (Individual Performance) ---
+    with span("level"):
+        role_score = run.get("credit_level")["final_score"]
+
+    # Add extra behavioral factors
+    B = user_profile.get("behavior_score", 0.5)
+    L = user_profile.get("loyalty_score", 0.5)  
+    D = user_profile.get("demand_score", 0.5)
+
+    # Validate extra factors are between 0 and 1
+    for factor_name, factor_value in [("behavior_score", B), ("loyalty_score", L), ("demand_score", D)]:
+        if not isinstance(factor_value, (int, float)) or not (0 <= factor_value <= 1):
+            logger.warning("Extra factor '%s' invalid value '%s', defaulting to 0.5", factor_name, factor_value)
+            if factor_name == "behavior_score": B = 0.5
+            elif factor_name == "loyalty_score": L = 0.5
+            elif factor_name == "demand_score": D = 0.5
+
+    numerator = role_score + EXTRA_WEIGHTS["behavior_score"] * B * 100 + EXTRA_WEIGHTS["loyalty_score"] * L * 100 + EXTRA_WEIGHTS["demand_score"] * D * 100
+    denominator = (sum(abs(w) for w in ROLE_WEIGHTS[role]["weights"])+ sum(v * 100 for v in EXTRA_WEIGHTS.values()))
+    return numerator / denominator if denominator != 0 else 50
+
+@scoring_stages.stage("global", view=lambda global_score: {"global_score": round(global_score, 2)})
+def _global_stage(run):
+    # --- 2. Global Component (Peer Performance) ---
+    with span("global"):
+        return compute_global_score(run.params["user_profile"], run.params["population_samples"])
+
+@scoring_stages.stage("fairness", view=lambda f: {"fairness_score": round(f[0], 2), "fairness_adj": round(f[1], 2)})
+def _fairness_stage(run):
+    # --- 3. Fairness Adjustment ---
+    params = run.params
+    with span("fairness_adjustment"):
+        return fairness_adjustment(run.get("global"), params["accept_rate"], params["target_accept"], params["eta"])
+
+@scoring_stages.stage("credit")
+def _credit_stage(run):
+    user_profile = run.params["user_profile"]
     try:
-        role = user_profile.get("role")
-        if role not in ROLE_WEIGHTS:
-            raise ValueError(f"Invalid role '{role}'")
+        _check_role(user_profile)
 
         tier = user_profile.get("tier", "Bronze")
         if tier not in TIER_MULTIPLIERS:
             raise ValueError(f"Invalid tier '{tier}'")
 
-        # --- 1. Role Component (Individual Performance) ---
-        level_result = compute_level_score_backend(
-        user_profile,
-        population_samples={"R_raw_values": []},  # pass real samples if available
-        month_active=user_profile.get("month_active", 1),
-        history_scores=user_profile.get("history_scores", [])
-        )
-
-        role_score = level_result["final_score"]
-
-        # Add extra behavioral factors
-        B = user_profile.get("behavior_score", 0.5)
-        L = user_profile.get("loyalty_score", 0.5)  
-        D = user_profile.get("demand_score", 0.5)
-
-        # Validate extra factors are between 0 and 1
-        for factor_name, factor_value in [("behavior_score", B), ("loyalty_score", L), ("demand_score", D)]:
-            if not isinstance(factor_value, (int, float)) or not (0 <= factor_value <= 1):
-                logging.warning(f"Extra factor '{factor_name}' invalid value '{factor_value}', defaulting to 0.5")
-                if factor_name == "behavior_score": B = 0.5
-                elif factor_name == "loyalty_score": L = 0.5
-                elif factor_name == "demand_score": D = 0.5
-
-        numerator = role_score + EXTRA_WEIGHTS["behavior_score"] * B * 100 + EXTRA_WEIGHTS["loyalty_score"] * L * 100 + EXTRA_WEIGHTS["demand_score"] * D * 100
-        denominator = (sum(abs(w) for w in ROLE_WEIGHTS[role]["weights"])+ sum(v * 100 for v in EXTRA_WEIGHTS.values()))
-        role_component = numerator / denominator if denominator != 0 else 50
-
-        # --- 2. Global Component (Peer Performance) ---
-        global_score = compute_global_score(user_profile, population_samples)
-
-        # --- 3. Fairness Adjustment ---
-        fairness_score, adj_r = fairness_adjustment(global_score, accept_rate, target_accept, eta)
+        role_component = run.get("role")
+        global_score = run.get("global")
+        fairness_score, adj_r = run.get("fairness")
 
         # --- 4. Combine Scores ---
         # lambda_r balances the weight between individual performance and peer-ranked performance
+        lambda_r = run.params["lambda_r"]
         combined_score = lambda_r * role_component + (1 - lambda_r) * fairness_score
 
         # --- 5. Delta Adjustment (Loyalty Bonus) ---
         delta_multiplier = TIER_MULTIPLIERS.get(tier, 1.0)
-        delta_adj = delta_base * delta_multiplier
+        delta_adj = run.params["delta_base"] * delta_multiplier
 
         # --- 6. Final Score ---
         final_score = np.clip(combined_score + delta_adj, 0, 100)
@@ -214,9 +274,52 @@ def compute_final_credit_score(user_profile, population_samples,
         }
 
     except Exception as e:
-        logging.error(f"Critical error in compute_final_credit_score for user {user_profile.get('id', 'N/A')}: {e}")
+        logger.error("Critical error in compute_final_credit_score for user %s: %s", user_profile.get('id', 'N/A'), e)
         return {"final_score": 0, "error": str(e)}
 
+# Stages /score returns when the caller names none
+DEFAULT_STAGES = ("level", "credit")
+
+def scoring_run(user_profile, population_samples=None, delta_base=2.0, lambda_r=0.7,
+                accept_rate=0.6, target_accept=0.7, eta=0.1):
+    """A StageRun for one user's level and credit scores, with the credit score's parameters."""
+    return scoring_stages.run(
+        user_profile=user_profile,
+        population_samples=population_samples,
+        delta_base=delta_base,
+        lambda_r=lambda_r,
+        accept_rate=accept_rate,
+        target_accept=target_accept,
+        eta=eta,
+        # The level score with /calculate-score's parameters, ranked against the service's score sketches
+        level_population={},
+        month_active=LEVEL_MONTH_ACTIVE,
+        history_scores=user_profile.get("history_scores") or [],
+        credit_month_active=user_profile.get("month_active", 1)
+    )
+
+def compute_final_credit_score(user_profile, population_samples=None,
+                               delta_base=2.0, lambda_r=0.7,
+                               accept_rate=0.6, target_accept=0.7, eta=0.1):
+    """
+    Compute the final credit score by combining the role-specific performance,
+    global peer ranking, fairness adjustments, and loyalty tier bonuses.
+    """
+    return scoring_run(user_profile, population_samples, delta_base, lambda_r,
+                       accept_rate, target_accept, eta).get("credit")
+
+def compute_scores(user_profile, stages=DEFAULT_STAGES, population_samples=None,
+                   delta_base=2.0, lambda_r=0.7, accept_rate=0.6, target_accept=0.7, eta=0.1):
+    """
+    {stage: result} for the named stages of one user's scoring, computing
+    each stage they need once: "level" and "credit" together cost one level
+    score, not the two that compute_level_score_backend and
+    compute_final_credit_score would. Raises UnknownStage for a bad name.
+    """
+    scoring_stages.check(stages)
+    return scoring_run(user_profile, population_samples, delta_base, lambda_r,
+                       accept_rate, target_accept, eta).outputs(stages)
+
 # ---------------- Example Usage ---------------- #
 if __name__ == "__main__":
     # Example user profile
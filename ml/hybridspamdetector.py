@@ -1,18 +1,73 @@
+import numbers
+import os
+import threading
+import joblib
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest
 import xgboost as xgb
+import model_registry
+from packed_forest import packed_forest
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
 
+SPAM_MODEL_NAME = "spam_models"
+SUPERVISED_FILE = "supervised.ubj"
+ISO_FILE = "isolation_forest.joblib"
+
+
+def _supervised_probs(model, X):
+    """predict_proba(X)[:, 1] for a binary XGBClassifier, straight from the booster."""
+    try:
+        iteration_range = (0, model.best_iteration + 1)
+    except AttributeError:
+        iteration_range = (0, 0)
+    return model.get_booster().inplace_predict(
+        X, iteration_range=iteration_range, missing=model.missing, validate_features=False
+    )
+
+
+def _anomaly_decision(iso_model, X):
+    """IsolationForest.decision_function(X) without re-validating X, so an ndarray is fine even
+    though the forest was fitted on a DataFrame. NaN and inf are still rejected. Uses the packed
+    forest when it has one, which gives the same values."""
+    packed = packed_forest(iso_model)
+    if packed is not None:
+        return packed.decision_function(X)
+    compute = getattr(iso_model, "_compute_chunked_score_samples", None)
+    if compute is None:
+        return iso_model.decision_function(X)
+    return -compute(X) - iso_model.offset_
+
 class HybridSpamDetector:
     def __init__(self):
-        self.supervised_model = None
-        self.iso_model = None
+        # (supervised_model, iso_model), replaced as one pair so scorers never mix versions
+        self.models = (None, None)
+        self._local = threading.local()
         self.required_features = [
             "review_count","rating_variance","avg_review_length",
             "logins_per_day","std_login_time","account_age_days"
         ]
 
+    @property
+    def supervised_model(self):
+        return self.models[0]
+
+    @supervised_model.setter
+    def supervised_model(self, model):
+        self.models = (model, self.models[1])
+
+    @property
+    def iso_model(self):
+        return self.models[1]
+
+    @iso_model.setter
+    def iso_model(self, model):
+        self.models = (self.models[0], model)
+
+    def swap_models(self, models):
+        self.models = models
+
     def validate_features(self, df):
         for col in self.required_features:
             if col not in df.columns:
@@ -21,36 +76,121 @@ class HybridSpamDetector:
                 df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
         return True
  
-    def train_supervised(self, df):
+    def train_supervised(self, df, n_estimators=200):
+        """Fit the classifier on an in-memory frame; training_pipeline.train_spam_models streams large ones."""
         self.validate_features(df)
         X = df[self.required_features]
         y = df["is_spam"]
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.25, random_state=42)
         self.supervised_model = xgb.XGBClassifier(
-            n_estimators=200, max_depth=5, learning_rate=0.1, random_state=42
+            n_estimators=n_estimators, max_depth=5, learning_rate=0.1, random_state=42, n_jobs=-1
         )
         self.supervised_model.fit(X_train, y_train)
         y_pred = self.supervised_model.predict(X_test)
         print("Supervised ML Report:\n", classification_report(y_test, y_pred))
 
-    def fit_anomaly(self, df):
+    def fit_anomaly(self, df, n_estimators=200):
         X = df[self.required_features]
-        self.iso_model = IsolationForest(n_estimators=200, contamination=0.2, random_state=42)
+        # Trees are built on every core; the fitted forest is the same as with one
+        self.iso_model = IsolationForest(n_estimators=n_estimators, contamination=0.2, random_state=42, n_jobs=-1)
         self.iso_model.fit(X)
 
-    def compute_hybrid_score(self, df):
-        print('in here in hybrid',df)
+    def compute_hybrid_score(self, df, models=None):
         self.validate_features(df)
-        if self.supervised_model is None or self.iso_model is None:
+        supervised_model, iso_model = models or self.models
+        if supervised_model is None or iso_model is None:
             return pd.Series([0]*len(df), index=df.index)
-        supervised_probs = self.supervised_model.predict_proba(df[self.required_features])[:,1]
-        anomaly_label = self.iso_model.predict(df[self.required_features])
+        supervised_probs = supervised_model.predict_proba(df[self.required_features])[:,1]
+        anomaly_label = iso_model.predict(df[self.required_features])
         hybrid_score = 0.7*supervised_probs + 0.3*((anomaly_label==-1)*1)
-        print('hybrid_score is here ',hybrid_score)
         return pd.Series(hybrid_score, index=df.index)
  
-    def predict_hybrid_score(self, user_features: dict) -> float:
+    def score_matrix(self, X, models=None) -> np.ndarray:
+        """
+        Fast path for the service: hybrid scores for a prevalidated float32 vector
+        or (N, features) matrix in required_features order, with no pandas. Both
+        models read the same buffer; the scores equal compute_hybrid_score's.
+        """
+        supervised_model, iso_model = models or self.models
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if supervised_model is None or iso_model is None:
+            return np.zeros(len(X), dtype=int)
+        supervised_probs = _supervised_probs(supervised_model, X)
+        anomaly_label = np.where(_anomaly_decision(iso_model, X) < 0, -1, 1)
+        return 0.7*supervised_probs + 0.3*((anomaly_label==-1)*1)
+
+    def anomaly_scores(self, X, models=None) -> np.ndarray:
+        """
+        Graded IsolationForest decision values for a float32 matrix as score_matrix
+        takes it: negative for anomalies, lower is more abnormal. score_matrix only
+        uses their sign. None when no models are loaded.
+        """
+        _, iso_model = models or self.models
+        if iso_model is None:
+            return None
+        X = np.asarray(X, dtype=np.float32)
+        return _anomaly_decision(iso_model, X.reshape(1, -1) if X.ndim == 1 else X)
+
+    def feature_row(self, user_features: dict) -> np.ndarray:
+        """
+        One user's required features as a (1, features) float32 row, coerced the
+        way validate_features would. The row is this thread's reusable buffer.
+        """
+        row = getattr(self._local, "row", None)
+        if row is None:
+            row = self._local.row = np.empty((1, len(self.required_features)), dtype=np.float32)
+        row[0] = [self._coerce_value(user_features.get(col, 0)) for col in self.required_features]
+        return row
+
+    def feature_matrix(self, feature_dicts) -> np.ndarray:
+        """feature_row for a list of feature dicts, as a new (N, features) float32 matrix."""
+        return np.array([
+            [self._coerce_value(features.get(col, 0)) for col in self.required_features]
+            for features in feature_dicts
+        ], dtype=np.float32).reshape(len(feature_dicts), len(self.required_features))
+
+    def predict_hybrid_score(self, user_features: dict, models=None) -> float:
         """Takes a dict of user features and returns a spam score [0,1]."""
-        print('user_features are here ',user_features)
-        df = pd.DataFrame([user_features])
-        return self.compute_hybrid_score(df).iloc[0]
+        return self.score_matrix(self.feature_row(user_features), models)[0]
+
+    def predict_hybrid_scores(self, feature_dicts, models=None) -> pd.Series:
+        """Batch form of predict_hybrid_score: one model pass over a list of feature dicts."""
+        return pd.Series(self.score_matrix(self.feature_matrix(feature_dicts), models))
+
+    @staticmethod
+    def _coerce_value(value):
+        # Same outcome validate_features gives this value in a one-row frame
+        if isinstance(value, numbers.Number):
+            return float(value)
+        value = pd.to_numeric(value, errors="coerce")
+        return 0.0 if pd.isna(value) else float(value)
+
+    # ---------------- Artifacts ---------------- #
+    def publish(self, version=None, **kwargs):
+        if self.supervised_model is None or self.iso_model is None:
+            raise ValueError("Both spam models must be trained before publishing")
+        def write(directory):
+            self.supervised_model.save_model(os.path.join(directory, SUPERVISED_FILE))
+            joblib.dump(self.iso_model, os.path.join(directory, ISO_FILE))
+        return model_registry.publish(
+            SPAM_MODEL_NAME, version or model_registry.new_version(), write,
+            self.required_features, **kwargs
+        )
+
+    def load_models(self, version=None, **kwargs):
+        """Load a published (supervised_model, iso_model) pair without installing it."""
+        def read(directory, meta):
+            supervised = xgb.XGBClassifier()
+            supervised.load_model(os.path.join(directory, SUPERVISED_FILE))
+            iso = joblib.load(os.path.join(directory, ISO_FILE), mmap_mode="r")
+            # Pack it now rather than on the first request
+            packed_forest(iso)
+            return supervised, iso
+        return model_registry.load(SPAM_MODEL_NAME, read, self.required_features, version, **kwargs)
+
+    def load(self, version=None, **kwargs):
+        models, meta = self.load_models(version, **kwargs)
+        self.swap_models(models)
+        return meta
@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+
+
+class _Pending:
+    __slots__ = ("item", "result", "error", "done")
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceCoalescer:
+    """
+    Micro-batches single-row inference calls made from concurrent scoring threads.
+
+    The first waiting call opens a batch. The batch closes when max_batch calls
+    are waiting or window_ms has passed, whichever comes first. batch_fn then
+    gets the list of items and must return one result per item, in order.
+    Each caller blocks in submit() until its own result is ready.
+    """
+
+    def __init__(self, batch_fn, window_ms, max_batch, name="inference"):
+        self.name = name
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._batch_fn = batch_fn
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def submit(self, item):
+        if self._thread is None:
+            self._start()
+        pending = _Pending(item)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"coalescer-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        try:
+            results = self._batch_fn([p.item for p in batch])
+            for pending, result in zip(batch, results):
+                pending.result = result
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        self.batches += 1
+        self.items += len(batch)
+        for pending in batch:
+            pending.done.set()
+
+    def stats(self):
+        batches, items = self.batches, self.items
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "fill_rate": items / (batches * self.max_batch) if batches else 0.0
+        }
+
+
+__all__ = ["InferenceCoalescer"]
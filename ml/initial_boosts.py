@@ -1,4 +1,12 @@
+import logging
+import os
+import numpy as np
 import pandas as pd
+import model_registry
+from boost_index import BoostIndex
+from model_registry import SchemaMismatchError
+
+logger = logging.getLogger(__name__)
 
 MAX_INITIAL_BOOST = 20
 ERROR_THRESHOLD = 5
@@ -24,27 +32,46 @@ def normalize_preferences(preference_factors):
     total = sum(preference_factors.values())
     return {k: v / total for k, v in preference_factors.items()}
 
-def calculate_initial_boosts(df, preference_factors):
+def _raw_boosts(df, preference_factors):
     weights = normalize_preferences(preference_factors)
-    def compute_boost(row):
-        score = 0
-        for factor, weight in weights.items():
-            score += row[factor] * weight
-        return round((score / 100) * MAX_INITIAL_BOOST, 2)
-
-    df["InitialBoost"] = df.apply(compute_boost, axis=1)
+    # Column arithmetic in the same order as the old per-row loop, so results match exactly
+    score = 0
+    for factor, weight in weights.items():
+        score = score + df[factor].to_numpy(dtype=float) * weight
+    return np.round((score / 100) * MAX_INITIAL_BOOST, 2)
 
-    mean_boost = df["InitialBoost"].mean()
-    df["ErrorFactor"] = df["InitialBoost"].apply(lambda x: round(abs(x - mean_boost), 2))
+def boost_reference(df, preference_factors):
+    """
+    The normalisation calculate_initial_boosts applies to a whole table: the raw
+    boost bounds it rescales by (None when it does not rescale) and the mean
+    boost ErrorFactor is measured from. Users added later are scored against it.
+    """
+    return _reference(_raw_boosts(df, preference_factors))
 
-    if df["ErrorFactor"].max() > ERROR_THRESHOLD:
-        min_boost, max_boost = df["InitialBoost"].min(), df["InitialBoost"].max()
-        df["InitialBoost"] = df["InitialBoost"].apply(
-            lambda x: round(((x - min_boost) / (max_boost - min_boost)) * MAX_INITIAL_BOOST, 2)
-        )
-        mean_boost = df["InitialBoost"].mean()
-        df["ErrorFactor"] = df["InitialBoost"].apply(lambda x: round(abs(x - mean_boost), 2))
+def _reference(raw):
+    mean_boost = raw.mean()
+    if np.round(np.abs(raw - mean_boost), 2).max() > ERROR_THRESHOLD:
+        min_boost, max_boost = raw.min(), raw.max()
+        scaled = np.round(((raw - min_boost) / (max_boost - min_boost)) * MAX_INITIAL_BOOST, 2)
+        return {"bounds": [float(min_boost), float(max_boost)], "mean": float(scaled.mean())}
+    return {"bounds": None, "mean": float(mean_boost)}
 
+def calculate_initial_boosts(df, preference_factors, reference=None):
+    """
+    Boosts for the users in df. Without a reference they are normalised
+    against each other; with one (from boost_reference) against that table,
+    clipped to [0, MAX_INITIAL_BOOST] for users outside its bounds.
+    """
+    raw = _raw_boosts(df, preference_factors)
+    own = reference is None
+    if own:
+        reference = _reference(raw)
+    bounds = reference["bounds"]
+    if bounds is not None:
+        min_boost, max_boost = bounds
+        raw = np.round(((raw - min_boost) / (max_boost - min_boost)) * MAX_INITIAL_BOOST, 2)
+    df["InitialBoost"] = raw if own else np.clip(raw, 0, MAX_INITIAL_BOOST)
+    df["ErrorFactor"] = np.round(np.abs(df["InitialBoost"].to_numpy() - reference["mean"]), 2)
     return df[["UserID", "InitialBoost", "ErrorFactor"]]
 
 # ---------------- Example Run ---------------- #
@@ -55,12 +82,94 @@ company_preferences = {
     "JobEngagement": 0.7
 }
 
-boost_results = calculate_initial_boosts(df, company_preferences)
+# ---------------- Artifacts ---------------- #
+BOOST_TABLE_NAME = "boost_table"
+BOOST_COLUMNS = ["UserID", "InitialBoost", "ErrorFactor"]
+BOOST_FEATURE_SCHEMA = {"engagement_factors": sorted(company_preferences), "columns": BOOST_COLUMNS}
+
+BOOST_INDEX_FILES = ("index_keys.npy", "index_boosts.npy")
+
+def publish_boost_table(results, version=None, reference=None, **kwargs):
+    """Publish a boost table; reference (boost_reference of its engagement data) is kept for upserts."""
+    def write(directory):
+        for col in BOOST_COLUMNS:
+            values = results[col].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)  # fixed-width so the column can be memory-mapped
+            np.save(os.path.join(directory, f"{col}.npy"), values)
+        # Pre-sorted lookup arrays so workers memory-map the index instead of sorting at startup
+        for filename, values in zip(BOOST_INDEX_FILES, BoostIndex.build(results["UserID"], results["InitialBoost"])):
+            np.save(os.path.join(directory, filename), values)
+    return model_registry.publish(
+        BOOST_TABLE_NAME, version or model_registry.new_version(), write,
+        BOOST_FEATURE_SCHEMA, {"rows": len(results), "reference": reference}, **kwargs
+    )
+
+def load_boost_table(version=None, **kwargs):
+    def read(directory, meta):
+        return pd.DataFrame({
+            col: np.load(os.path.join(directory, f"{col}.npy"), mmap_mode="r") for col in BOOST_COLUMNS
+        })
+    return model_registry.load(BOOST_TABLE_NAME, read, BOOST_FEATURE_SCHEMA, version, **kwargs)
+
+def load_boost_index_arrays(version=None, **kwargs):
+    """The published sorted (keys, boosts) arrays, or None for tables published before they existed."""
+    def read(directory, meta):
+        paths = [os.path.join(directory, filename) for filename in BOOST_INDEX_FILES]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return tuple(np.load(path, mmap_mode="r") for path in paths)
+    return model_registry.load(BOOST_TABLE_NAME, read, BOOST_FEATURE_SCHEMA, version, record=False, **kwargs)[0]
+
+def _startup_boost_table():
+    """(table, reference) the service starts with."""
+    try:
+        results, meta = load_boost_table()
+    except (FileNotFoundError, SchemaMismatchError) as e:
+        logger.warning("%s; computing the example boost table in-process, run train_models.py to publish one", e)
+        results = calculate_initial_boosts(df, company_preferences)
+        model_registry.register_untracked(BOOST_TABLE_NAME, BOOST_FEATURE_SCHEMA, rows=len(results))
+        boost_index.load(results["UserID"], results["InitialBoost"])
+        return results, boost_reference(df, company_preferences)
+    arrays = load_boost_index_arrays(meta["version"])
+    if arrays is None:
+        boost_index.load(results["UserID"], results["InitialBoost"])
+    else:
+        boost_index.load_sorted(*arrays)
+    if meta.get("reference") is None:
+        logger.warning("Boost table %s has no normalisation reference; upserted users are normalised "
+                       "as their own cohort until train_models.py republishes it", meta["version"])
+    return results, meta.get("reference")
+
+# Single boost index for the service; boost_results keeps the published table as loaded and
+# boost_table_reference its normalisation, which upserted users are scored against
+boost_index = BoostIndex()
+boost_results, boost_table_reference = _startup_boost_table()
+
 def get_boost_for_user(user_id):
-    row = boost_results[boost_results["UserID"].astype(str) == str(user_id)]
-    if not row.empty:
-        return row.iloc[0]["InitialBoost"]
-    return 0
+    return boost_index.get(user_id)
+
+def get_boosts_for_users(user_ids):
+    """
+    Batch form of get_boost_for_user. Returns the boosts and a mask of which
+    users had an entry, since missing users get a plain 0.
+    """
+    return boost_index.get_many(user_ids)
+
+def upsert_engaged_users(engagement, preference_factors=company_preferences):
+    """
+    Add boosts for newly engaged users without rebuilding the table.
+    engagement is a DataFrame with UserID and the engagement factor columns.
+    The new users are normalised against the loaded table's bounds and mean,
+    so a user's boost does not depend on who else is in the cohort.
+    """
+    reference = boost_table_reference if preference_factors is company_preferences else None
+    results = calculate_initial_boosts(engagement.copy(), preference_factors, reference)
+    boost_index.upsert_many(zip(results["UserID"], results["InitialBoost"]))
+    return results
 
 
-__all__ = ["boost_results", "get_boost_for_user"]
\ No newline at end of file
+__all__ = [
+    "boost_results", "boost_index", "get_boost_for_user", "get_boosts_for_users", "upsert_engaged_users",
+    "calculate_initial_boosts", "boost_reference", "boost_table_reference", "publish_boost_table", "load_boost_table", "load_boost_index_arrays"
+]
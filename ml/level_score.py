@@ -1,118 +1,145 @@
-from ml_model_module import predict_with_error
+import logging
+import math
+from ml_model_module import predict_with_error, predict_with_error_batch, current_level_model
 from utils import (   
     percentile_rank, get_tier, apply_fairness,
     compute_days, detailed_activity_analysis,
-    ROLE_FEATURE_WEIGHTS, ROLE_BOOSTS
+    ROLE_TIERS, ROLE_BOOSTS
 )
-from initial_boosts import get_boost_for_user
+from feature_schema import ROLE_SCHEMAS, generic_weighted_features
+from initial_boosts import get_boost_for_user, get_boosts_for_users
 from hybridspamdetector import HybridSpamDetector
+from model_registry import SchemaMismatchError
+from model_reload import ModelReloader
+from inference_coalescer import InferenceCoalescer
+from settings import COALESCE_WINDOW_MS, COALESCE_MAX_BATCH
+from tracing import span
+from quantile_sketch import population_sketches
+from stage_graph import scoring_stages
 import pandas as pd
 import numpy as np
+
+logger = logging.getLogger(__name__)
+
 # Single instance of spam detector
 spam_detector = HybridSpamDetector()
+try:
+    spam_detector.load()
+except (FileNotFoundError, SchemaMismatchError) as e:
+    # Without trained spam models every spam score is 0, as before artifacts existed
+    logger.warning("%s; spam scoring disabled", e)
 
-def compute_level_score_backend(user_profile, population_samples, month_active, history_scores=[]):
-    print('user_profile',user_profile)
+# Swaps models in behind the scoring functions, see model_reload.py
+model_reloader = ModelReloader(spam_detector)
+
+# ---------------- Inference coalescing ----------------
+def _predict_level_rows(items):
+    """Coalescer batch of (level_model, 1-row features): one predict per model and width."""
+    results = [None] * len(items)
+    groups = {}
+    for i, (level_model, row) in enumerate(items):
+        groups.setdefault((id(level_model), row.shape[1]), (level_model, []))[1].append(i)
+    for level_model, index in groups.values():
+        preds, margins = predict_with_error_batch(np.vstack([items[i][1] for i in index]), level_model)
+        for k, i in enumerate(index):
+            results[i] = (preds[k], margins[k])
+    return results
+
+def _score_spam_rows(items):
+    """Coalescer batch of (spam_models, (1, n) spam feature row): one spam pass per model pair."""
+    results = [None] * len(items)
+    groups = {}
+    for i, (models, row) in enumerate(items):
+        groups.setdefault(id(models), (models, []))[1].append(i)
+    for models, index in groups.values():
+        scores = spam_detector.score_matrix(np.vstack([items[i][1] for i in index]), models)
+        for k, i in enumerate(index):
+            results[i] = scores[k]
+    return results
+
+level_coalescer = InferenceCoalescer(_predict_level_rows, COALESCE_WINDOW_MS, COALESCE_MAX_BATCH, "level_model")
+spam_coalescer = InferenceCoalescer(_score_spam_rows, COALESCE_WINDOW_MS, COALESCE_MAX_BATCH, "spam_models")
+
+def activity_summary(user_profile):
+    """
+    (inconsistent_days, inactivity_days, avg_streak, max_streak) for a profile.
+    Uses the stored ActivityState the server attached, if any, instead of walking activity_log.
+    """
+    state = user_profile.get("activity_state")
+    if state is not None:
+        return (*state.counts(), *state.streak_stats())
+    activity_log = user_profile.get("activity_log", [])
+    return (*compute_days(activity_log), *detailed_activity_analysis(activity_log))
+
+# ---------------- Scoring stages ----------------
+# compute_level_score_backend split into stages of scoring_stages, so a request
+# that also wants the credit score (see final_credit_score.py) computes each once.
+# Run params: user_profile, level_population, month_active, history_scores.
+
+# month_active the service's level endpoints score with
+LEVEL_MONTH_ACTIVE = 30
+
+@scoring_stages.stage("models", public=False)
+def _models_stage(run):
+    # Pin the models for this request; a hot reload only affects later requests
+    return current_level_model(), spam_detector.models
+
+@scoring_stages.stage("features", view=lambda row: {"weighted_features": row[0].tolist()})
+def _features_stage(run):
+    user_profile = run.params["user_profile"]
     role = user_profile.get("role", "driver")
     features = user_profile.get("features", {})
+    with span("features"):
+        schema = ROLE_SCHEMAS.get(role)
+        if schema is not None:
+            # Per-thread buffer: read by the predict stage and the view within this run
+            return schema.extract_row(features)
+        return generic_weighted_features(features, role)
 
-    # ---------------- Role-specific features ----------------
-    if role == "driver":
-        features_list = [
-            features.get("login_rate", 0),
-            features.get("streak_days", 0),
-            features.get("rides_30d", 0),
-            features.get("on_time_rate", 0),
-            features.get("cancellation_rate", 0),
-            features.get("rating", 0),
-            features.get("avg_ride_distance", 0),
-            features.get("peak_hour_rides", 0),
-            features.get("late_pickup_rate", 0),
-            features.get("customer_complaints", 0),
-            features.get("ratings_std", 0),
-            features.get("total_hours_worked", 0)
-        ]
-    elif role == "merchant":
-        features_list = [
-            features.get("login_rate", 0),
-            features.get("streak_days", 0),
-            features.get("sales_30d", 0),
-            features.get("order_fulfillment_rate", 0),
-            features.get("return_rate", 0),
-            features.get("rating", 0),
-            features.get("avg_order_value", 0),
-            features.get("peak_hour_sales", 0),
-            features.get("complaints_received", 0),
-            features.get("new_customers_acquired", 0),
-            features.get("repeat_customer_rate", 0),
-            features.get("total_hours_operated", 0)
-        ]
-    elif role == "delivery":
-        features_list = [
-            features.get("login_rate", 0),
-            features.get("streak_days", 0),
-            features.get("deliveries_30d", 0),
-            features.get("on_time_delivery_rate", 0),
-            features.get("cancellation_rate", 0),
-            features.get("rating", 0),
-            features.get("avg_delivery_distance", 0),
-            features.get("peak_hour_deliveries", 0),
-            features.get("late_delivery_rate", 0),
-            features.get("customer_complaints", 0),
-            features.get("ratings_std", 0),
-            features.get("total_hours_worked", 0)
-        ]
-    else:
-        features_list = [features.get(k, 0) for k in features]
-
-    # ---------------- Weighted features ----------------
-    weights = ROLE_FEATURE_WEIGHTS.get(role, [1]*len(features_list))
-    weighted_features = [float(f)*float(w) for f, w in zip(features_list, weights)]
-    weighted_features = np.array(weighted_features,dtype=float).reshape(1,-1)
-    # ---------------- ML prediction ----------------
-    R_raw, pred_error = predict_with_error(weighted_features)
-    print('here it is we ave got the result',R_raw,pred_error)
+@scoring_stages.stage("predict", view=lambda p: {"R_raw": p[0], "ml_prediction_error_margin": p[1]})
+def _predict_stage(run):
+    level_model, _ = run.get("models")
+    weighted_features = run.get("features")
+    with span("predict"):
+        if level_coalescer.enabled:
+            R_raw, pred_error = level_coalescer.submit((level_model, weighted_features))
+        else:
+            R_raw, pred_error = predict_with_error(weighted_features, level_model)
+        model_reloader.shadow_level(weighted_features, [R_raw])
     R_raw /= 1000
-    percentile = percentile_rank(R_raw, population_samples.get("R_raw_values", []))
-    print('here got the percentile',percentile)
-    base_gain = 1000 * percentile * 0.15
-    gain = min(base_gain * (0.5 + 0.05 * month_active), 80)
+    return R_raw, pred_error
 
-    prev_score = history_scores[-1] if history_scores else 0
-    trend_penalty = 0
-    if len(history_scores) > 1 and (prev_score - history_scores[-2]) < -20:
-        trend_penalty = 10
-    initial_score = prev_score + gain - trend_penalty
- 
-    # ---------------- Activity analysis ----------------
-    tier = get_tier(initial_score, role)
-    print('here got the tier',tier)
-    activity_log = user_profile.get("activity_log", [])
-    inconsistent_days, inactivity_days = compute_days(activity_log)
-    print('here got the inconsistent_days',inconsistent_days)
-    print('here got the inactivity_days',inactivity_days)
-    avg_streak, max_streak = detailed_activity_analysis(activity_log)
-    print('here got the avg_streak',avg_streak)
-    print('here got the max_streak',max_streak)
-    score_after, penalty, consistency_bonus = apply_fairness(initial_score, tier, inactivity_days, inconsistent_days)
-    print('here got the score_after',score_after)
-    print('here got the penalty',penalty)
-    print('here got the consistency_bonus',consistency_bonus)
+@scoring_stages.stage("activity", view=lambda a: dict(zip(
+    ("inconsistent_days", "inactivity_days", "avg_inactive_streak", "max_inactive_streak"), a)))
+def _activity_stage(run):
+    with span("activity"):
+        return activity_summary(run.params["user_profile"])
 
-    # ---------------- Initial Boost ----------------
-    boost = get_boost_for_user(user_profile.get("user_id", 0))
-    print('here got the boost',boost)
-    if month_active == 1 and user_profile.get("first_time_account", True):
-        boost += ROLE_BOOSTS[role]["first_time"]
-    if role == "driver" and features.get("rides_30d", 0) > 100:
-        boost += ROLE_BOOSTS[role]["milestone_rides"]
-    elif role == "merchant" and features.get("sales_30d", 0) > 100:
-        boost += ROLE_BOOSTS[role]["high_sales"]
-    elif role == "delivery_partner" and features.get("deliveries_30d", 0) > 100:
-        boost += ROLE_BOOSTS[role]["milestone_deliveries"]
-    print('here got the boost',boost)
+def level_boost(run, month_active):
+    """The user's boost for a level score with month_active."""
+    user_profile = run.params["user_profile"]
+    role = user_profile.get("role", "driver")
+    features = user_profile.get("features", {})
+    with span("boost"):
+        boost = get_boost_for_user(user_profile.get("user_id", 0))
+        if month_active == 1 and user_profile.get("first_time_account", True):
+            boost += ROLE_BOOSTS[role]["first_time"]
+        if role == "driver" and features.get("rides_30d", 0) > 100:
+            boost += ROLE_BOOSTS[role]["milestone_rides"]
+        elif role == "merchant" and features.get("sales_30d", 0) > 100:
+            boost += ROLE_BOOSTS[role]["high_sales"]
+        elif role == "delivery_partner" and features.get("deliveries_30d", 0) > 100:
+            boost += ROLE_BOOSTS[role]["milestone_deliveries"]
+    return boost
 
-    # ---------------- Spam Detection ----------------
+@scoring_stages.stage("boost", view=lambda boost: {"boost": boost})
+def _boost_stage(run):
+    return level_boost(run, run.params["month_active"])
+
+@scoring_stages.stage("spam", view=lambda spam_score: {"spam_score": spam_score})
+def _spam_stage(run):
+    _, spam_models = run.get("models")
+    features = run.params["user_profile"].get("features", {})
     # Ensure all required columns exist
     spam_defaults = {
         "review_count": 0,
@@ -124,17 +151,66 @@ def compute_level_score_backend(user_profile, population_samples, month_active,
     }
     for k, v in spam_defaults.items():
         features.setdefault(k, v)
-    print('abover spam',features)
-    spam_score = spam_detector.predict_hybrid_score(features)
-    print('spam score',spam_score)
+    with span("spam"):
+        spam_row = spam_detector.feature_row(features)
+        if spam_coalescer.enabled:
+            spam_score = spam_coalescer.submit((spam_models, spam_row.copy()))
+        else:
+            spam_score = spam_detector.score_matrix(spam_row, spam_models)[0]
+        model_reloader.shadow_spam(spam_row, [spam_score])
+    return spam_score
+
+@scoring_stages.stage("percentile", public=False)
+def _percentile_stage(run):
+    R_raw, _ = run.get("predict")
+    role = run.params["user_profile"].get("role", "driver")
+    population = run.params["level_population"].get("R_raw_values")
+    if population is None:
+        # No samples given: rank against the sketch of scores seen so far, then join it
+        percentile = population_sketches.percentile_rank("R_raw", role, R_raw) or 0
+        population_sketches.add("R_raw", role, R_raw)
+        return percentile
+    return percentile_rank(R_raw, population)
+
+def level_result(run, month_active):
+    """
+    The level score from run's shared stages with month_active, so level
+    scores differing only in it reuse one prediction and percentile.
+    """
+    user_profile = run.params["user_profile"]
+    history_scores = run.params["history_scores"]
+    role = user_profile.get("role", "driver")
+
+    # ---------------- ML prediction ----------------
+    R_raw, pred_error = run.get("predict")
+    percentile = run.get("percentile")
+    base_gain = 1000 * percentile * 0.15
+    gain = min(base_gain * (0.5 + 0.05 * month_active), 80)
+
+    prev_score = history_scores[-1] if history_scores else 0
+    trend_penalty = 0
+    if len(history_scores) > 1 and (prev_score - history_scores[-2]) < -20:
+        trend_penalty = 10
+    initial_score = prev_score + gain - trend_penalty
+ 
+    # ---------------- Activity analysis ----------------
+    tier = get_tier(initial_score, role)
+    inconsistent_days, inactivity_days, avg_streak, max_streak = run.get("activity")
+    with span("fairness"):
+        score_after, penalty, consistency_bonus = apply_fairness(initial_score, tier, inactivity_days, inconsistent_days)
+
+    # ---------------- Initial Boost and Spam Detection ----------------
+    boost = run.get("boost") if month_active == run.params["month_active"] else level_boost(run, month_active)
+    spam_score = run.get("spam")
 
     # ---------------- Final Score ----------------
     final_score = min(1000, score_after + boost)
-    print('here got the final_score',final_score)
     reason_log = (
         f"+{round(gain,2)} gain, -{penalty} penalty, +{consistency_bonus} consistency, "
         f"+{boost} boost, ±{pred_error} model error"
     )
+    logger.debug("level score user=%s role=%s R_raw=%s tier=%s final=%s spam=%s",
+                 user_profile.get("user_id"), role, R_raw, tier, final_score, spam_score)
 # final score is the level score
     return {
         "final_score": round(final_score, 2),
@@ -150,3 +226,258 @@ def compute_level_score_backend(user_profile, population_samples, month_active,
         "spam_score": spam_score,
         "reason_log": reason_log
     }
+
+@scoring_stages.stage("level")
+def _level_stage(run):
+    return level_result(run, run.params["month_active"])
+
+def compute_level_score_backend(user_profile, population_samples, month_active, history_scores=[]):
+    run = scoring_stages.run(
+        user_profile=user_profile,
+        level_population=population_samples,
+        month_active=month_active,
+        history_scores=history_scores
+    )
+    return run.get("level")
+
+
+# ---------------- Batch scoring ----------------
+TIER_NAMES = np.array(["Bronze", "Amber", "Ruby", "Gold"])
+FAIRNESS_TIER_FACTORS = np.array([0.5, 0.75, 1.0, 1.0])  # apply_fairness factors, by tier index
+
+# role -> (feature checked against 100, ROLE_BOOSTS key), as in compute_level_score_backend
+ROLE_MILESTONES = {
+    "driver": ("rides_30d", "milestone_rides"),
+    "merchant": ("sales_30d", "high_sales"),
+    "delivery_partner": ("deliveries_30d", "milestone_deliveries"),
+}
+
+def _tier_indices(scores, roles):
+    """Vectorised get_tier, returning indices into TIER_NAMES."""
+    indices = np.empty(len(scores), dtype=int)
+    for role in set(roles.tolist()):
+        mask = roles == role
+        thresholds = np.array(ROLE_TIERS.get(role, [250, 500, 750]), dtype=float)
+        indices[mask] = (scores[mask][:, None] > thresholds).sum(axis=1)
+    return indices
+
+def _inactivity_penalties(inactivity_days):
+    # apply_fairness uses math.exp; evaluate it once per distinct day count so values match exactly
+    distinct, inverse = np.unique(inactivity_days, return_inverse=True)
+    table = np.array([int(100*(1-math.exp(-d/30))) if d else 0 for d in distinct.tolist()], dtype=int)
+    return table[inverse]
+
+# Fields of a level score result, in output order
+LEVEL_RESULT_FIELDS = (
+    "final_score", "tier", "penalty", "consistency_bonus", "boost", "inconsistent_days",
+    "inactivity_days", "avg_inactive_streak", "max_inactive_streak", "ml_prediction_error_margin",
+    "spam_score", "reason_log"
+)
+
+class LevelInputs:
+    """
+    A batch of level-score inputs already in array form. from_profiles builds
+    it from profile dicts; wire_format.decode_level_batch builds it straight
+    from the binary request body.
+    """
+    __slots__ = ("user_ids", "roles", "groups", "milestone_counts", "first_time", "spam_matrix", "activity")
+
+    def __init__(self, user_ids, roles, groups, milestone_counts, first_time, spam_matrix, activity):
+        self.user_ids = user_ids                  # boost lookup keys, one per user
+        self.roles = roles                        # object array of role names
+        self.groups = groups                      # [(weighted (k, width) matrix, row indices)] per model input layout
+        self.milestone_counts = milestone_counts  # role -> ROLE_MILESTONES feature of that role's rows, in row order
+        self.first_time = first_time              # bool array, first_time_account
+        self.spam_matrix = spam_matrix            # (N, spam features) float32
+        self.activity = activity                  # per user (inconsistent_days, inactivity_days, avg_streak, max_streak)
+
+    def __len__(self):
+        return len(self.roles)
+
+    @classmethod
+    def from_profiles(cls, user_profiles):
+        roles = np.array([p.get("role", "driver") for p in user_profiles], dtype=object)
+        feature_dicts = [p.get("features", {}) for p in user_profiles]
+
+        layouts = {}
+        for i, role in enumerate(roles):
+            layouts.setdefault(role, []).append(i)
+        groups = []
+        for role, index in layouts.items():
+            schema = ROLE_SCHEMAS.get(role)
+            if schema is not None:
+                groups.append((schema.extract_batch([feature_dicts[i] for i in index]), index))
+                continue
+            # Without a schema the row width depends on each user's feature count
+            rows = {}
+            for i in index:
+                row = generic_weighted_features(feature_dicts[i], role)
+                widths = rows.setdefault(row.shape[1], ([], []))
+                widths[0].append(row)
+                widths[1].append(i)
+            groups.extend((np.vstack(r), idx) for r, idx in rows.values())
+
+        milestone_counts = {}
+        for role, (feature, _) in ROLE_MILESTONES.items():
+            index = np.flatnonzero(roles == role)
+            if len(index):
+                milestone_counts[role] = np.array([float(feature_dicts[i].get(feature, 0)) for i in index])
+
+        return cls(
+            user_ids=[p.get("user_id", 0) for p in user_profiles],
+            roles=roles,
+            groups=groups,
+            milestone_counts=milestone_counts,
+            first_time=np.array([bool(p.get("first_time_account", True)) for p in user_profiles], dtype=bool),
+            spam_matrix=spam_detector.feature_matrix(feature_dicts),
+            activity=[activity_summary(p) for p in user_profiles]
+        )
+
+
+def compute_level_scores_batch(user_profiles, population_samples, month_active, history_scores=None,
+                               columnar=False):
+    """
+    Batch form of compute_level_score_backend. Each role's features are written
+    into one (N, 12) matrix so the model runs once per role and the spam
+    detector once per batch. Every returned dict equals the single-user result.
+    """
+    if not user_profiles:
+        return {field: [] for field in LEVEL_RESULT_FIELDS} if columnar else []
+    with span("features"):
+        inputs = LevelInputs.from_profiles(user_profiles)
+    return score_level_inputs(inputs, population_samples, month_active, history_scores, columnar)
+
+
+def score_level_inputs(inputs, population_samples, month_active, history_scores=None, columnar=False):
+    """
+    Level scores for a LevelInputs batch; the work behind compute_level_scores_batch.
+    With columnar=True the result is one list or array per field instead of one dict per user.
+    """
+    n = len(inputs)
+    if n == 0:
+        return {field: [] for field in LEVEL_RESULT_FIELDS} if columnar else []
+    if history_scores is None:
+        history_scores = [[] for _ in range(n)]
+    roles = inputs.roles
+    level_model, spam_models = current_level_model(), spam_detector.models
+
+    # ---------------- ML prediction, one call per feature layout ----------------
+    with span("predict"):
+        R_raw = np.empty(n)
+        pred_error = np.empty(n)
+        for weighted, group_index in inputs.groups:
+            preds, margins = predict_with_error_batch(weighted, level_model)
+            model_reloader.shadow_level(weighted, preds)
+            R_raw[group_index] = preds.astype(np.float64) / 1000
+            pred_error[group_index] = margins
+
+    population = population_samples.get("R_raw_values")
+    if population is None:
+        # Every user ranks against the sketch as it was before this batch, which then takes the batch
+        percentile = np.zeros(n)
+        for role in set(roles.tolist()):
+            mask = roles == role
+            ranks = population_sketches.percentile_rank("R_raw", role, R_raw[mask])
+            if ranks is not None:
+                percentile[mask] = ranks
+        population_sketches.add_many("R_raw", roles, R_raw)
+    elif len(population):
+        population = np.sort(np.asarray(population, dtype=float))
+        less = np.searchsorted(population, R_raw, side="left")
+        equal = np.searchsorted(population, R_raw, side="right") - less
+        percentile = (less + 0.5 * equal) / len(population)
+    else:
+        percentile = np.zeros(n)
+    base_gain = 1000 * percentile * 0.15
+    gain = base_gain * (0.5 + 0.05 * month_active)
+    gain_capped = gain > 80  # min(..., 80) hands back the int 80
+    gain = np.where(gain_capped, 80, gain)
+
+    prev_score = np.array([h[-1] if h else 0 for h in history_scores], dtype=float)
+    prev_is_int = np.array([not h or isinstance(h[-1], int) for h in history_scores])
+    trend_penalty = np.array([
+        10 if len(h) > 1 and (h[-1] - h[-2]) < -20 else 0 for h in history_scores
+    ])
+    initial_score = prev_score + gain - trend_penalty
+    score_is_int = prev_is_int & gain_capped
+
+    # ---------------- Activity analysis and fairness ----------------
+    with span("activity"):
+        tier_idx = _tier_indices(initial_score, roles)
+        days = [s[:2] for s in inputs.activity]
+        streaks = [s[2:] for s in inputs.activity]
+        inconsistent_days = np.array([d[0] for d in days], dtype=int)
+        inactivity_days = np.array([d[1] for d in days], dtype=int)
+
+        penalty = _inactivity_penalties(inactivity_days) + np.where(inconsistent_days != 0, 30, 0)
+        penalty = (penalty * FAIRNESS_TIER_FACTORS[tier_idx]).astype(int)
+        consistency_bonus = np.where((inactivity_days == 0) & (inconsistent_days == 0), 20, 0)
+        score_after = initial_score - penalty
+        score_is_int |= score_after <= 0  # max(0, ...) hands back the int 0
+        score_after = np.where(score_after > 0, score_after, 0) + consistency_bonus
+        capped = score_after >= 1000
+        score_is_int |= capped
+        score_after = np.where(capped, 1000, score_after)
+
+    # ---------------- Initial Boost ----------------
+    with span("boost"):
+        boost, boost_found = get_boosts_for_users(inputs.user_ids)
+        if month_active == 1:
+            boost = boost + np.array([
+                ROLE_BOOSTS[role]["first_time"] if first_time else 0
+                for role, first_time in zip(roles, inputs.first_time)
+            ])
+        for role, (_, boost_key) in ROLE_MILESTONES.items():
+            counts = inputs.milestone_counts.get(role)
+            if counts is not None:
+                boost[roles == role] += np.where(counts > 100, ROLE_BOOSTS[role][boost_key], 0)
+
+    # ---------------- Spam Detection ----------------
+    with span("spam"):
+        spam_scores = spam_detector.score_matrix(inputs.spam_matrix, spam_models)
+        model_reloader.shadow_spam(inputs.spam_matrix, spam_scores)
+
+    # ---------------- Final Score ----------------
+    final_score = score_after + boost
+    final_capped = final_score >= 1000
+    final_score = np.where(final_capped, 1000, final_score)
+    final_tier = TIER_NAMES[_tier_indices(final_score, roles)]
+
+    final_scores, user_boosts, reason_logs = [], [], []
+    for i in range(n):
+        # Rebuild the scalar types the single-user path produces so output matches exactly
+        user_gain = 80 if gain_capped[i] else float(gain[i])
+        user_boost = boost[i] if boost_found[i] else int(boost[i])
+        if final_capped[i]:
+            user_final = 1000
+        elif boost_found[i]:
+            user_final = final_score[i]
+        elif score_is_int[i]:
+            user_final = int(final_score[i])
+        else:
+            user_final = float(final_score[i])
+        final_scores.append(round(user_final, 2))
+        user_boosts.append(user_boost)
+        reason_logs.append(
+            f"+{round(user_gain,2)} gain, -{int(penalty[i])} penalty, +{int(consistency_bonus[i])} consistency, "
+            f"+{user_boost} boost, ±{pred_error[i]} model error"
+        )
+
+    # Iterating the arrays yields the same scalars indexing them does
+    columns = {
+        "final_score": final_scores,
+        "tier": final_tier.tolist(),
+        "penalty": penalty.tolist(),
+        "consistency_bonus": consistency_bonus.tolist(),
+        "boost": user_boosts,
+        "inconsistent_days": [d[0] for d in days],
+        "inactivity_days": [d[1] for d in days],
+        "avg_inactive_streak": [s[0] for s in streaks],
+        "max_inactive_streak": [s[1] for s in streaks],
+        "ml_prediction_error_margin": pred_error,
+        "spam_score": spam_scores,
+        "reason_log": reason_logs
+    }
+    if columnar:
+        return columns
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
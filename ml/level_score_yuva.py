@@ -3,67 +3,25 @@ from ml_model_module import predict_with_error
 from utils import (
     percentile_rank, get_tier, apply_fairness,
     compute_days, detailed_activity_analysis,
-    ROLE_FEATURE_WEIGHTS, ROLE_BOOSTS
+    ROLE_FEATURE_KEYS, ROLE_BOOSTS
 )
 from initial_boosts import get_boost_for_user
 from spam_detection import HybridSpamDetector, apply_spam_penalty
+from feature_schema import compile_role_schemas, generic_weighted_features
+
+# This variant names the delivery role "delivery_partner"
+ROLE_SCHEMAS = compile_role_schemas({**ROLE_FEATURE_KEYS, "delivery_partner": ROLE_FEATURE_KEYS["delivery"]})
 
 def compute_level_score_backend(user_profile, population_samples, month_active, history_scores=[]):
     role = user_profile.get("role", "driver")
     features = user_profile["features"]
 
-    # ---------------- Role-specific feature vectors ---------------- #
-    if role == "driver":
-        features_list = [
-            features.get("login_rate", 0),
-            features.get("streak_days", 0),
-            features.get("rides_30d", 0),
-            features.get("on_time_rate", 0),
-            features.get("cancellation_rate", 0),
-            features.get("rating", 0),
-            features.get("avg_ride_distance", 0),
-            features.get("peak_hour_rides", 0),
-            features.get("late_pickup_rate", 0),
-            features.get("customer_complaints", 0),
-            features.get("ratings_std", 0),
-            features.get("total_hours_worked", 0)
-        ]
-    elif role == "merchant":
-        features_list = [
-            features.get("login_rate", 0),
-            features.get("streak_days", 0),
-            features.get("sales_30d", 0),
-            features.get("order_fulfillment_rate", 0),
-            features.get("return_rate", 0),
-            features.get("rating", 0),
-            features.get("avg_order_value", 0),
-            features.get("peak_hour_sales", 0),
-            features.get("complaints_received", 0),
-            features.get("new_customers_acquired", 0),
-            features.get("repeat_customer_rate", 0),
-            features.get("total_hours_operated", 0)
-        ]
-    elif role == "delivery_partner":
-        features_list = [
-            features.get("login_rate", 0),
-            features.get("streak_days", 0),
-            features.get("deliveries_30d", 0),
-            features.get("on_time_delivery_rate", 0),
-            features.get("cancellation_rate", 0),
-            features.get("rating", 0),
-            features.get("avg_delivery_distance", 0),
-            features.get("peak_hour_deliveries", 0),
-            features.get("late_delivery_rate", 0),
-            features.get("customer_complaints", 0),
-            features.get("ratings_std", 0),
-            features.get("total_hours_worked", 0)
-        ]
+    # ---------------- Weighted role features ---------------- #
+    schema = ROLE_SCHEMAS.get(role)
+    if schema is not None:
+        weighted_features = schema.extract(features)
     else:
-        features_list = [features.get(k, 0) for k in features]
-
-    # ---------------- Weighted features ---------------- #
-    weights = ROLE_FEATURE_WEIGHTS.get(role, [1]*len(features_list))
-    weighted_features = [f*w for f, w in zip(features_list, weights)]
+        weighted_features = generic_weighted_features(features, role)
 
     # ---------------- ML prediction ---------------- #
     R_raw, pred_error = predict_with_error(weighted_features)
@@ -0,0 +1,184 @@
+import math
+import threading
+from bisect import bisect_left
+
+# Seconds; covers sub-millisecond stages up to slow batch requests
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardedMetric:
+    """
+    Base for metrics written from many threads.
+
+    Each thread updates its own shard, so recording takes no lock; the lock is
+    only taken when a thread creates its shard and when /metrics merges them.
+    A shard is only ever written by its own thread, so no update is lost.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _merged(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_ShardedMetric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merged(self):
+        totals = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def _samples(self):
+        for labels, value in sorted(self._merged().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(_ShardedMetric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the running sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merged(self):
+        totals = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for labels, counts in list(shard.items()):
+                merged = totals.setdefault(labels, [0] * len(counts))
+                for i, value in enumerate(counts):
+                    merged[i] += value
+        return totals
+
+    def _samples(self):
+        bounds = self.buckets + (math.inf,)
+        for labels, counts in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Gauge:
+    """Gauge read at scrape time; fn returns {label values tuple: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames, fn):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.fn().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, labelnames, fn):
+        return self.register(Gauge(name, help_text, labelnames, fn))
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Single registry for the service
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    "ml_requests_total", "HTTP requests by route and status code", ("path", "status"))
+REQUEST_ERRORS = registry.counter(
+    "ml_request_errors_total", "HTTP requests that failed with a 5xx or an exception", ("path",))
+REQUEST_SECONDS = registry.histogram(
+    "ml_request_duration_seconds", "HTTP request latency by route", ("path",))
+STAGE_SECONDS = registry.histogram(
+    "ml_stage_duration_seconds", "Scoring pipeline stage latency", ("stage",))
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+__all__ = [
+    "Counter", "Histogram", "Gauge", "MetricsRegistry", "registry",
+    "REQUESTS", "REQUEST_ERRORS", "REQUEST_SECONDS", "STAGE_SECONDS", "CONTENT_TYPE"
+]
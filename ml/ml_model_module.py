@@ -1,7 +1,23 @@
+import hashlib
+import logging
 import math
+import os
 import numpy as np
 import xgboost as xgb
 from sklearn.metrics import mean_squared_error
+import model_registry
+from model_registry import SchemaMismatchError
+from settings import TREE_PREDICTOR, TREE_PREDICTOR_MAX_ROWS
+from shared_state import shared_store
+from tree_predictor import FlatTreeEnsemble
+from utils import ROLE_FEATURE_KEYS, ROLE_FEATURE_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+LEVEL_MODEL_NAME = "level_model"
+LEVEL_MODEL_FILE = "model.ubj"
+# The model sees weighted role features, so both the orderings and the weights are schema
+LEVEL_FEATURE_SCHEMA = {"features": ROLE_FEATURE_KEYS, "weights": ROLE_FEATURE_WEIGHTS}
 
 # ---------------- Example Training Data ---------------- #
 # Features for all roles (12 features per role)
@@ -14,19 +30,106 @@ X = np.array([
 y = np.array([700, 400, 850, 250])
 
 # ---------------- Train XGBoost Regressor ---------------- #
-ml_model = xgb.XGBRegressor(
-    n_estimators=200,
-    max_depth=5,
-    learning_rate=0.1,
-    objective="reg:squarederror",
-    random_state=42
-)
-ml_model.fit(X, y)
-
-# ---------------- Error Calculation ---------------- #
-train_preds = ml_model.predict(X)
-rmse = math.sqrt(mean_squared_error(y, train_preds))
-error_percent = (rmse / np.mean(y)) * 100
+def train_level_model(X=X, y=y):
+    """Fit the level model and return it with the error stats predict_with_error needs."""
+    model = xgb.XGBRegressor(
+        n_estimators=200,
+        max_depth=5,
+        learning_rate=0.1,
+        objective="reg:squarederror",
+        random_state=42
+    )
+    model.fit(X, y)
+
+    # ---------------- Error Calculation ---------------- #
+    train_preds = model.predict(X)
+    rmse = math.sqrt(mean_squared_error(y, train_preds))
+    error_percent = (rmse / np.mean(y)) * 100
+    return model, {"rmse": rmse, "y_max": float(np.max(y)), "error_percent": float(error_percent)}
+
+def _compile_predictor(model):
+    if shared_store is None:
+        return FlatTreeEnsemble.compile(model)
+
+    # One worker compiles and checks the model; the rest map its node arrays
+    def build():
+        predictor = FlatTreeEnsemble.compile(model)
+        return None if predictor is None else predictor.to_arrays()
+    booster = model.get_booster()
+    key = hashlib.sha256(bytes(booster.save_raw()) + repr(booster.attributes()).encode()).hexdigest()[:32]
+    found = shared_store.attach_or_publish("level_model_nodes", key, build)
+    return None if found is None else FlatTreeEnsemble.from_arrays(*found)
+
+class LevelModel:
+    """A level model together with the error stats it was trained with."""
+    __slots__ = ("model", "rmse", "y_max", "error_percent", "version", "predictor")
+
+    def __init__(self, model, rmse, y_max, error_percent, version):
+        self.model = model
+        self.rmse = rmse
+        self.y_max = y_max
+        self.error_percent = error_percent
+        self.version = version
+        # None when disabled, or when the model cannot be compiled exactly
+        self.predictor = _compile_predictor(model) if TREE_PREDICTOR == "flat" else None
+
+    @classmethod
+    def from_stats(cls, model, stats):
+        return cls(model, stats["rmse"], stats["y_max"], stats["error_percent"], stats.get("version", "untracked"))
+
+    @property
+    def n_features(self):
+        return self.model.get_booster().num_features()
+
+    def predict(self, arr):
+        """float32 predictions for an (N, n_features) matrix, the same as model.predict gives."""
+        if self.predictor is not None and len(arr) <= TREE_PREDICTOR_MAX_ROWS:
+            return self.predictor.predict(arr)
+        return self.model.predict(arr)
+
+# ---------------- Artifacts ---------------- #
+def publish_level_model(model, stats, version=None, **kwargs):
+    def write(directory):
+        model.save_model(os.path.join(directory, LEVEL_MODEL_FILE))
+    return model_registry.publish(
+        LEVEL_MODEL_NAME, version or model_registry.new_version(), write,
+        LEVEL_FEATURE_SCHEMA, stats, **kwargs
+    )
+
+def load_level_model(version=None, **kwargs):
+    def read(directory, meta):
+        model = xgb.XGBRegressor()
+        model.load_model(os.path.join(directory, LEVEL_MODEL_FILE))
+        return model
+    return model_registry.load(LEVEL_MODEL_NAME, read, LEVEL_FEATURE_SCHEMA, version, **kwargs)
+
+def _startup_model():
+    try:
+        return load_level_model()
+    except (FileNotFoundError, SchemaMismatchError) as e:
+        logger.warning("%s; training the example level model in-process, run train_models.py to publish one", e)
+        model, stats = train_level_model()
+        model_registry.register_untracked(LEVEL_MODEL_NAME, LEVEL_FEATURE_SCHEMA, **stats)
+        return model, stats
+
+ml_model, _stats = _startup_model()
+rmse = _stats["rmse"]
+y_max = _stats["y_max"]
+error_percent = _stats["error_percent"]
+
+# The model predict_with_error uses. Swapped as a whole by set_level_model so a
+# caller holding the old one keeps consistent model/error stats.
+active_level_model = LevelModel.from_stats(ml_model, _stats)
+
+def current_level_model():
+    return active_level_model
+
+def set_level_model(level_model):
+    global active_level_model, ml_model, rmse, y_max, error_percent
+    active_level_model = level_model
+    ml_model, rmse, y_max, error_percent = (
+        level_model.model, level_model.rmse, level_model.y_max, level_model.error_percent
+    )
 
 # def predict_with_error(features, ml_model=ml_model, rmse=rmse):
 #     # print('features are here ',features)
@@ -39,16 +142,31 @@ error_percent = (rmse / np.mean(y)) * 100
 #     margin = pred * relative_error
 #     print('the result is  ',pred,margin )
 #     return pred, round(margin,2)
-def predict_with_error(features, ml_model=ml_model, rmse=rmse):
+def predict_with_error(features, level_model=None):
+    level_model = level_model or active_level_model
     arr = np.array(features, dtype=float)
     if arr.ndim == 1:
         arr = arr.reshape(1, -1)
     elif arr.ndim == 3:
         arr = arr.reshape(arr.shape[0], arr.shape[2])
-    pred = ml_model.predict(arr)[0]
-    relative_error = rmse / np.max(y)
+    pred = level_model.predict(arr)[0]
+    relative_error = level_model.rmse / level_model.y_max
     margin = pred * relative_error
-    print('the result is  ',pred,margin )
     return pred, round(margin, 2)
 
-__all__ = ["ml_model", "predict_with_error", "rmse", "error_percent"]
\ No newline at end of file
+def predict_with_error_batch(features, level_model=None):
+    """Row-wise predict_with_error for an (N, n_features) matrix in one predict call."""
+    level_model = level_model or active_level_model
+    arr = np.asarray(features, dtype=float)
+    if arr.ndim == 1:
+        arr = arr.reshape(1, -1)
+    preds = level_model.predict(arr)
+    relative_error = level_model.rmse / level_model.y_max
+    margins = np.round(preds.astype(np.float64) * relative_error, 2)
+    return preds, margins
+
+__all__ = [
+    "ml_model", "predict_with_error", "predict_with_error_batch", "rmse", "error_percent",
+    "train_level_model", "publish_level_model", "load_level_model",
+    "LevelModel", "current_level_model", "set_level_model"
+]
\ No newline at end of file
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from settings import ARTIFACT_DIR
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Model Registry ---------------- #
+# Artifacts live in ARTIFACT_DIR/<name>/<version>/ next to a meta.json that
+# records the version and a hash of the feature schema the model was trained
+# on. ARTIFACT_DIR/<name>/LATEST names the version loaded by default;
+# ML_<NAME>_VERSION in the environment pins a specific one.
+
+META_FILE = "meta.json"
+LATEST_FILE = "LATEST"
+
+# name -> metadata of the artifact this process is serving
+loaded_models = {}
+
+
+class SchemaMismatchError(ValueError):
+    """Raised when an artifact was trained against a different feature schema."""
+
+
+def feature_schema_hash(schema):
+    payload = json.dumps(schema, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def new_version():
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime())
+
+
+def pinned_version(name):
+    return os.getenv(f"ML_{name.upper()}_VERSION") or None
+
+
+def latest_version(name, root=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(root, name, LATEST_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(name, root=ARTIFACT_DIR):
+    directory = os.path.join(root, name)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        v for v in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, v, META_FILE))
+    )
+
+
+def publish(name, version, write_fn, feature_schema, metadata=None, root=ARTIFACT_DIR, make_latest=True):
+    """
+    Write an artifact with write_fn(directory) and register it as <name>/<version>.
+    Files are written to a staging directory first so readers never see a partial artifact.
+    """
+    target = os.path.join(root, name, version)
+    if os.path.exists(target):
+        raise FileExistsError(f"Artifact {name}/{version} already exists")
+    staging = os.path.join(root, name, f".staging-{version}-{os.getpid()}")
+    os.makedirs(staging)
+    try:
+        write_fn(staging)
+        meta = {
+            "name": name,
+            "version": version,
+            "schema_hash": feature_schema_hash(feature_schema),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            **(metadata or {})
+        }
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(staging, target)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    if make_latest:
+        pointer = os.path.join(root, name, f".{LATEST_FILE}-{os.getpid()}")
+        with open(pointer, "w") as f:
+            f.write(version)
+        os.replace(pointer, os.path.join(root, name, LATEST_FILE))
+    logger.info("Published artifact %s/%s", name, version)
+    return meta
+
+
+def load(name, read_fn, feature_schema, version=None, root=ARTIFACT_DIR, record=True):
+    """
+    Load <name>/<version> with read_fn(directory, meta). Without a version the
+    pinned one is used, then LATEST. Raises FileNotFoundError when there is no
+    artifact and SchemaMismatchError when it was built for other features.
+    With record=False the artifact is not reported in loaded_models yet.
+    """
+    version = version or pinned_version(name) or latest_version(name, root)
+    if version is None:
+        raise FileNotFoundError(f"No artifact published for '{name}' in {root}")
+    directory = os.path.join(root, name, version)
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+
+    expected = feature_schema_hash(feature_schema)
+    if meta.get("schema_hash") != expected:
+        raise SchemaMismatchError(
+            f"Artifact {name}/{version} has schema {meta.get('schema_hash')}, service expects {expected}"
+        )
+
+    obj = read_fn(directory, meta)
+    if record:
+        loaded_models[name] = meta
+    logger.info("Loaded artifact %s/%s", name, version)
+    return obj, meta
+
+
+def register_untracked(name, feature_schema, **metadata):
+    """Record a model that was built in-process instead of loaded from an artifact."""
+    loaded_models[name] = {
+        "name": name,
+        "version": "untracked",
+        "schema_hash": feature_schema_hash(feature_schema),
+        **metadata
+    }
+
+
+__all__ = [
+    "loaded_models", "SchemaMismatchError", "feature_schema_hash", "new_version",
+    "latest_version", "list_versions", "publish", "load", "register_untracked"
+]
@@ -0,0 +1,239 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import model_registry
+from ml_model_module import (
+    LEVEL_MODEL_NAME, LevelModel, load_level_model, predict_with_error_batch, set_level_model
+)
+from hybridspamdetector import SPAM_MODEL_NAME
+from settings import SHADOW_PERCENT, SHADOW_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+RELOADABLE = (LEVEL_MODEL_NAME, SPAM_MODEL_NAME)
+
+
+class DriftStats:
+    """Running comparison of shadow outputs against the active model's."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.sum_diff = 0.0
+        self.sum_abs_diff = 0.0
+        self.max_abs_diff = 0.0
+
+    def update(self, active, shadow):
+        diff = np.asarray(shadow, dtype=float) - np.asarray(active, dtype=float)
+        with self._lock:
+            self.count += diff.size
+            self.sum_diff += float(diff.sum())
+            self.sum_abs_diff += float(np.abs(diff).sum())
+            self.max_abs_diff = max(self.max_abs_diff, float(np.abs(diff).max(initial=0.0)))
+
+    def snapshot(self):
+        with self._lock:
+            n = self.count
+            return {
+                "count": n,
+                "mean_diff": self.sum_diff / n if n else 0.0,
+                "mean_abs_diff": self.sum_abs_diff / n if n else 0.0,
+                "max_abs_diff": self.max_abs_diff
+            }
+
+
+class ModelReloader:
+    """
+    Loads a new model version in the background, warms it up with a sample
+    predict and installs it with a single reference swap. Requests pin the
+    models they started with, so in-flight scoring finishes on the old version.
+
+    In shadow mode the candidate is kept next to the active model instead and
+    scores a sample of traffic on a background thread, recording drift.
+    """
+
+    def __init__(self, spam_detector):
+        self.spam_detector = spam_detector
+        self.status = {"state": "idle"}
+        self.shadows = {}  # name -> (candidate, meta)
+        self.shadow_percent = SHADOW_PERCENT
+        self.shadow_dropped = 0
+        self.drift = {name: DriftStats() for name in RELOADABLE}
+        self._lock = threading.Lock()
+        self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow-scoring")
+        self._shadow_pending = 0
+        self._pending_lock = threading.Lock()
+        self._watch_failed = set()
+        self._watch_stop = None
+
+    # ---------------- Reload ---------------- #
+    def reload(self, name, version=None, mode="swap", shadow_percent=None):
+        if name not in RELOADABLE:
+            raise ValueError(f"Unknown model '{name}', expected one of {list(RELOADABLE)}")
+        if mode not in ("swap", "shadow"):
+            raise ValueError(f"Unknown reload mode '{mode}'")
+        with self._lock:
+            if self.status["state"] == "loading":
+                raise RuntimeError(f"A reload of {self.status['name']} is already running")
+            self.status = {"state": "loading", "name": name, "version": version, "mode": mode}
+        thread = threading.Thread(
+            target=self._reload, args=(name, version, mode, shadow_percent),
+            name=f"reload-{name}", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _reload(self, name, version, mode, shadow_percent):
+        status = {"state": "ready", "name": name, "mode": mode}
+        try:
+            candidate, meta = self._load(name, version)
+            self._warm_up(name, candidate)
+            status["version"] = meta["version"]
+            if mode == "swap":
+                self._activate(name, candidate, meta)
+            else:
+                if shadow_percent is not None:
+                    self.shadow_percent = shadow_percent
+                self.drift[name].reset()
+                self.shadows[name] = (candidate, meta)
+            logger.info("Model %s/%s ready (%s)", name, meta["version"], mode)
+        except Exception as e:
+            logger.exception("Reload of %s failed", name)
+            status.update(state="failed", version=version, error=str(e))
+        with self._lock:
+            self.status = status
+
+    def _load(self, name, version):
+        if name == LEVEL_MODEL_NAME:
+            model, meta = load_level_model(version, record=False)
+            return LevelModel.from_stats(model, meta), meta
+        return self.spam_detector.load_models(version, record=False)
+
+    def _warm_up(self, name, candidate):
+        if name == LEVEL_MODEL_NAME:
+            predict_with_error_batch(np.zeros((1, candidate.n_features)), level_model=candidate)
+        else:
+            self.spam_detector.predict_hybrid_scores([{}], models=candidate)
+
+    def _activate(self, name, candidate, meta):
+        if name == LEVEL_MODEL_NAME:
+            set_level_model(candidate)
+        else:
+            self.spam_detector.swap_models(candidate)
+        model_registry.loaded_models[name] = meta
+        shadow = self.shadows.get(name)
+        if shadow is not None and shadow[1]["version"] == meta["version"]:
+            self.shadows.pop(name, None)
+
+    def promote(self, name):
+        """Make the current shadow of `name` the active model."""
+        shadow = self.shadows.get(name)
+        if shadow is None:
+            raise LookupError(f"No shadow model loaded for '{name}'")
+        self._activate(name, *shadow)
+        return shadow[1]
+
+    def clear_shadow(self, name):
+        return self.shadows.pop(name, None) is not None
+
+    def state(self):
+        with self._lock:
+            status = dict(self.status)
+        return {
+            "reload": status,
+            "shadow_percent": self.shadow_percent,
+            "shadow_dropped": self.shadow_dropped,
+            "shadows": {name: meta["version"] for name, (_, meta) in self.shadows.items()},
+            "drift": {name: stats.snapshot() for name, stats in self.drift.items()}
+        }
+
+    # ---------------- Shadow scoring ---------------- #
+    def _submit_shadow(self, fn, *args):
+        if random.random() * 100 >= self.shadow_percent:
+            return
+        with self._pending_lock:
+            if self._shadow_pending >= SHADOW_MAX_PENDING:
+                self.shadow_dropped += 1
+                return
+            self._shadow_pending += 1
+        self._shadow_pool.submit(fn, *args)
+
+    def _shadow_done(self):
+        with self._pending_lock:
+            self._shadow_pending -= 1
+
+    def shadow_level(self, features, active_preds):
+        """Also score level-model inputs with the shadow model, off the request path."""
+        shadow = self.shadows.get(LEVEL_MODEL_NAME)
+        if shadow is not None:
+            self._submit_shadow(
+                self._score_level, shadow[0],
+                np.array(features, dtype=float), np.array(active_preds, dtype=float)
+            )
+
+    def shadow_spam(self, spam_matrix, active_scores):
+        """Also score a float32 spam feature matrix with the shadow models, off the request path."""
+        shadow = self.shadows.get(SPAM_MODEL_NAME)
+        if shadow is not None:
+            self._submit_shadow(
+                self._score_spam, shadow[0],
+                np.array(spam_matrix, dtype=np.float32), np.array(active_scores, dtype=float)
+            )
+
+    def _score_level(self, candidate, features, active_preds):
+        try:
+            preds, _ = predict_with_error_batch(features, level_model=candidate)
+            self.drift[LEVEL_MODEL_NAME].update(active_preds, preds)
+        except Exception:
+            logger.exception("Shadow level scoring failed")
+        finally:
+            self._shadow_done()
+
+    def _score_spam(self, candidate, spam_matrix, active_scores):
+        try:
+            scores = self.spam_detector.score_matrix(spam_matrix, models=candidate)
+            self.drift[SPAM_MODEL_NAME].update(active_scores, scores)
+        except Exception:
+            logger.exception("Shadow spam scoring failed")
+        finally:
+            self._shadow_done()
+
+    # ---------------- Artifact watcher ---------------- #
+    def start_watcher(self, interval):
+        """Poll LATEST for each model and swap in new versions as they are published."""
+        if self._watch_stop is not None:
+            return
+        self._watch_stop = threading.Event()
+        threading.Thread(target=self._watch, args=(interval,), name="model-watcher", daemon=True).start()
+
+    def stop_watcher(self):
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
+
+    def _watch(self, interval):
+        stop = self._watch_stop
+        while not stop.wait(interval):
+            for name in RELOADABLE:
+                if model_registry.pinned_version(name):
+                    continue
+                latest = model_registry.latest_version(name)
+                current = model_registry.loaded_models.get(name, {}).get("version")
+                if latest is None or latest == current or (name, latest) in self._watch_failed:
+                    continue
+                try:
+                    self.reload(name, latest, "swap").join()
+                except RuntimeError:
+                    continue  # a manual reload is running; look again next poll
+                if self.status["state"] == "failed":
+                    self._watch_failed.add((name, latest))
+
+
+__all__ = ["ModelReloader", "DriftStats", "RELOADABLE"]
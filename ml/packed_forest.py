@@ -0,0 +1,222 @@
+import hashlib
+import logging
+import weakref
+
+import numpy as np
+from sklearn.ensemble._iforest import _average_path_length
+
+from shared_state import shared_store
+
+logger = logging.getLogger(__name__)
+
+
+class PackedIsolationForest:
+    """
+    A fitted sklearn IsolationForest as node arrays stacked across trees.
+
+    A batch walks every tree at once, one tree level per step, instead of
+    calling apply and decision_path on each estimator. Each leaf stores the
+    path length sklearn adds for a sample ending there (its depth plus the
+    average path length of its training samples), so scores and labels are
+    the same as the forest's, to the bit.
+    """
+
+    def __init__(self, children, features, thresholds, path_lengths, roots, depth, denominator, offset,
+                 n_features):
+        self.children = children            # (nodes, 2) int32, [left, right]; a leaf's are its own index
+        self.features = features            # (nodes,) int32 column of X; 0 for leaves
+        self.thresholds = thresholds        # (nodes,) float64, x <= threshold goes left
+        self.path_lengths = path_lengths    # (nodes,) float64, set for leaves
+        self.roots = roots                  # (trees,) int32
+        self.depth = depth
+        self.denominator = denominator
+        self.offset = offset
+        self.n_features = n_features
+        self._flat_children = children.reshape(-1)
+
+    @classmethod
+    def from_forest(cls, iso_model):
+        subsample = iso_model._max_features != iso_model.n_features_in_
+        children, features, thresholds, path_lengths, roots = [], [], [], [], []
+        offset, depth = 0, 0
+        for tree, tree_features in zip(iso_model.estimators_, iso_model.estimators_features_):
+            t = tree.tree_
+            left = np.asarray(t.children_left, dtype=np.int64)
+            right = np.asarray(t.children_right, dtype=np.int64)
+            n = len(left)
+            leaf = left == -1
+            own = np.arange(n)
+            node_depth = _node_depths(left, right)
+            feature = np.where(leaf, 0, t.feature)
+            if subsample:
+                # Trees were fitted on X[:, tree_features]
+                feature = np.asarray(tree_features)[feature]
+            children.append(np.stack([np.where(leaf, own, left), np.where(leaf, own, right)], axis=1) + offset)
+            features.append(feature)
+            thresholds.append(np.asarray(t.threshold, dtype=np.float64))
+            # As _compute_score_samples adds it: nodes on the path, plus the leaf's average path length, minus one
+            lengths = (node_depth + 1) + _average_path_length(np.asarray(t.n_node_samples)) - 1.0
+            path_lengths.append(np.where(leaf, lengths, 0.0))
+            roots.append(offset)
+            depth = max(depth, int(node_depth.max()))
+            offset += n
+
+        return cls(
+            children=np.concatenate(children).astype(np.int32),
+            features=np.concatenate(features).astype(np.int32),
+            thresholds=np.concatenate(thresholds),
+            path_lengths=np.concatenate(path_lengths),
+            roots=np.asarray(roots, dtype=np.int32),
+            depth=depth,
+            denominator=len(iso_model.estimators_) * _average_path_length([iso_model.max_samples_])[0],
+            offset=iso_model.offset_,
+            n_features=iso_model.n_features_in_
+        )
+
+    @classmethod
+    def compile(cls, iso_model, probe_rows=512, seed=0):
+        """
+        Packed form of a fitted IsolationForest, or None (with a warning) if it
+        cannot be packed or its scores differ from the forest's on probe rows
+        built around the forest's own split points.
+        """
+        try:
+            packed = cls.from_forest(iso_model)
+        except (AttributeError, ValueError) as e:
+            logger.warning("Packed isolation forest unavailable: %s; using sklearn", e)
+            return None
+        probe = packed.probe(probe_rows, seed)
+        expected = -iso_model._compute_chunked_score_samples(probe) - iso_model.offset_
+        if not np.array_equal(packed.decision_function(probe), expected):
+            logger.warning("Packed isolation forest disagrees with sklearn on probe rows; using sklearn")
+            return None
+        return packed
+
+    # Arrays and scalars that make up a packed forest, for sharing it between processes
+    ARRAYS = ("children", "features", "thresholds", "path_lengths", "roots")
+
+    def to_arrays(self):
+        """(arrays, meta) for SharedStateStore.publish."""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        meta = {"depth": self.depth, "denominator": float(self.denominator), "offset": float(self.offset),
+                "n_features": self.n_features}
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """Rebuild from to_arrays output, e.g. memory-mapped from shared state, without copying."""
+        return cls(**{name: arrays[name] for name in cls.ARRAYS}, depth=meta["depth"],
+                   denominator=meta["denominator"], offset=meta["offset"], n_features=meta["n_features"])
+
+    def probe(self, n, seed=0):
+        """float32 rows mixing split thresholds, their float32 neighbours and random values."""
+        rng = np.random.default_rng(seed)
+        X = rng.normal(0, 100, (n, self.n_features)).astype(np.float32)
+        splits = self.children[:, 0] != np.arange(len(self.children))
+        for f in range(self.n_features):
+            points = self.thresholds[splits & (self.features == f)].astype(np.float32)
+            if len(points):
+                points = np.concatenate([
+                    points, np.nextafter(points, np.float32(-np.inf)), np.nextafter(points, np.float32(np.inf))
+                ])
+                pick = rng.random(n) < 0.7
+                X[pick, f] = rng.choice(points, pick.sum())
+        return X
+
+    def _leaves(self, X):
+        """(rows, trees) leaf node indices for a float32 (rows, features) matrix."""
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        flat = X.ravel()
+        starts = np.arange(len(X))[:, None] * X.shape[1]
+        for _ in range(self.depth):
+            go_right = flat[starts + self.features[nodes]] > self.thresholds[nodes]
+            nodes = self._flat_children[2 * nodes + go_right]
+        return nodes
+
+    def _check(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but IsolationForest is expecting {self.n_features} features as input.")
+        # sklearn's trees reject these too
+        if not np.isfinite(X).all():
+            raise ValueError("Input contains NaN, infinity or a value too large for dtype('float32').")
+        return X
+
+    def score_samples(self, X):
+        """IsolationForest.score_samples: minus the anomaly score, lower is more abnormal."""
+        X = self._check(X)
+        if not len(X):
+            return np.zeros(0)
+        # Tree by tree, in the order sklearn sums them
+        depths = np.add.accumulate(self.path_lengths[self._leaves(X)], axis=1)[:, -1]
+        scores = 2 ** -np.divide(
+            depths, self.denominator, out=np.ones_like(depths), where=self.denominator != 0
+        )
+        return -scores
+
+    def decision_function(self, X):
+        """IsolationForest.decision_function: negative for outliers."""
+        return self.score_samples(X) - self.offset
+
+    def predict(self, X):
+        """IsolationForest.predict: -1 for outliers, 1 for inliers."""
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+    def stats(self):
+        return {"trees": len(self.roots), "nodes": len(self.path_lengths), "depth": self.depth}
+
+
+def _node_depths(left, right):
+    depths = np.zeros(len(left), dtype=np.int64)
+    level, depth = np.array([0]), 0
+    while len(level):
+        depths[level] = depth
+        splits = level[left[level] != -1]
+        level = np.concatenate([left[splits], right[splits]])
+        depth += 1
+    return depths
+
+
+# Packed forms of the forests in use, dropped with the forest
+_packed = weakref.WeakKeyDictionary()
+# Forests that could not be packed, so the check is not redone on every call
+_unpackable = weakref.WeakSet()
+
+
+def _forest_key(iso_model):
+    """Hash of everything the packed form is built from, naming it in shared state."""
+    digest = hashlib.sha256(repr((iso_model.offset_, iso_model.max_samples_, iso_model._max_features)).encode())
+    for tree, features in zip(iso_model.estimators_, iso_model.estimators_features_):
+        t = tree.tree_
+        for array in (t.children_left, t.children_right, t.feature, t.threshold, t.n_node_samples, features):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:32]
+
+
+def _compile(iso_model):
+    if shared_store is None:
+        return PackedIsolationForest.compile(iso_model)
+
+    # One worker packs and checks the forest; the rest map its arrays
+    def build():
+        packed = PackedIsolationForest.compile(iso_model)
+        return None if packed is None else packed.to_arrays()
+    found = shared_store.attach_or_publish("isolation_forest", _forest_key(iso_model), build)
+    return None if found is None else PackedIsolationForest.from_arrays(*found)
+
+
+def packed_forest(iso_model):
+    """The PackedIsolationForest for a fitted forest, built on first use; None if it cannot be packed."""
+    packed = _packed.get(iso_model)
+    if packed is None and iso_model not in _unpackable:
+        packed = _compile(iso_model)
+        if packed is None:
+            _unpackable.add(iso_model)
+        else:
+            _packed[iso_model] = packed
+    return packed
+
+
+__all__ = ["PackedIsolationForest", "packed_forest"]
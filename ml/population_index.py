@@ -0,0 +1,262 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+
+import numpy as np
+
+from settings import SHARED_STATE_POLL_SECONDS
+from shared_state import shared_store
+
+
+def _rank(less, equal, total, value, excluded):
+    """(less + equal / 2) / total, with the excluded peer's score (or None) taken out of the counts."""
+    if excluded is not None:
+        total -= 1
+        if excluded < value:
+            less -= 1
+        elif excluded == value:
+            equal -= 1
+    return (less + 0.5 * equal) / total if total else 0
+
+
+class PopulationIndex:
+    """
+    Per-role index of precomputed peer role scores.
+
+    Scores are kept in a sorted list per role so percentile lookups are two
+    bisections instead of a scan over the whole population. Peers are keyed
+    by id, which makes upserts and deletes incremental.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scores = {}   # role -> sorted list of role scores
+        self._members = {}  # peer_id -> (role, score)
+        self.generation = 0
+
+    def _remove(self, peer_id):
+        entry = self._members.pop(peer_id, None)
+        if entry is None:
+            return False
+        role, score = entry
+        scores = self._scores[role]
+        del scores[bisect_left(scores, score)]
+        if not scores:
+            del self._scores[role]
+        return True
+
+    def upsert(self, peer_id, role, score):
+        with self._lock:
+            self._remove(peer_id)
+            self._members[peer_id] = (role, score)
+            insort(self._scores.setdefault(role, []), score)
+            self.generation += 1
+
+    def upsert_many(self, entries):
+        """Insert or replace several (peer_id, role, score) entries under one lock."""
+        with self._lock:
+            for peer_id, role, score in entries:
+                self._remove(peer_id)
+                self._members[peer_id] = (role, score)
+                insort(self._scores.setdefault(role, []), score)
+            self.generation += 1
+
+    def delete(self, peer_id):
+        with self._lock:
+            removed = self._remove(peer_id)
+            if removed:
+                self.generation += 1
+            return removed
+
+    def delete_many(self, peer_ids):
+        """Remove several peers under one lock, returning how many were present."""
+        with self._lock:
+            removed = sum(1 for peer_id in peer_ids if self._remove(peer_id))
+            if removed:
+                self.generation += 1
+            return removed
+
+    def _excluded(self, role, exclude):
+        """The score of peer exclude if it is indexed under role, else None."""
+        entry = self._members.get(str(exclude)) if exclude is not None else None
+        return entry[1] if entry is not None and entry[0] == role else None
+
+    def size(self, role=None, exclude=None):
+        """Peers indexed, for one role if given, not counting peer exclude."""
+        with self._lock:
+            if role is None:
+                return len(self._members) - (exclude is not None and str(exclude) in self._members)
+            return len(self._scores.get(role, ())) - (self._excluded(role, exclude) is not None)
+
+    def percentile_rank(self, role, value, exclude=None):
+        """
+        Same semantics as utils.percentile_rank, in O(log N). exclude is a peer
+        id left out of the ranking, so a user is never ranked against themself.
+        """
+        with self._lock:
+            scores = self._scores.get(role, ())
+            less = bisect_left(scores, value)
+            equal = bisect_right(scores, value, lo=less) - less
+            return _rank(less, equal, len(scores), value, self._excluded(role, exclude))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "generation": self.generation,
+                "total": len(self._members),
+                "roles": {role: len(scores) for role, scores in self._scores.items()},
+            }
+
+
+class SharedPopulationIndex:
+    """
+    PopulationIndex kept in a SharedStateStore, so every worker process maps
+    one copy of the peers instead of holding its own.
+
+    A generation holds the peer ids sorted, each peer's role code and score,
+    and every score sorted by (role, score) with per-role offsets; a
+    percentile lookup is two binary searches in the role's slice. Whichever
+    worker receives a change applies it under the store's writer lock:
+    attach the latest generation, merge the change in with array operations,
+    publish. Other workers move to new generations within poll_seconds of
+    their next call.
+    """
+
+    NAME = "population"
+
+    def __init__(self, store, poll_seconds=SHARED_STATE_POLL_SECONDS):
+        self.store = store
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._view = None
+        self._checked_at = -float("inf")
+        self._attach()
+
+    @staticmethod
+    def _empty():
+        return {
+            "ids": np.empty(0, dtype="<U1"), "role_codes": np.empty(0, dtype=np.int32),
+            "scores": np.empty(0), "sorted_scores": np.empty(0), "offsets": np.zeros(1, dtype=np.int64)
+        }, {"generation": 0, "roles": []}
+
+    def _attach(self, generation=None):
+        found = self.store.attach(self.NAME, generation)
+        arrays, meta = found if found is not None else self._empty()
+        self._view = (arrays, meta, {role: i for i, role in enumerate(meta["roles"])})
+        self._checked_at = time.monotonic()
+
+    def _current(self):
+        """This worker's view, moved to the latest generation at most every poll_seconds."""
+        if time.monotonic() - self._checked_at >= self.poll_seconds:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.poll_seconds:
+                    latest = self.store.latest(self.NAME)
+                    if latest is not None and latest != self._view[1]["generation"]:
+                        self._attach(latest)
+                    self._checked_at = time.monotonic()
+        return self._view
+
+    @property
+    def generation(self):
+        return self._current()[1]["generation"]
+
+    def _apply(self, entries=(), deletes=()):
+        """Publish the latest generation with entries upserted and deletes removed; returns deleted ids present."""
+        with self.store.writer(self.NAME):
+            self._attach()
+            arrays, meta, _ = self._view
+            ids, role_codes, scores = arrays["ids"], arrays["role_codes"], arrays["scores"]
+            roles = list(meta["roles"])
+
+            # The last entry for an id wins, as with repeated upserts
+            latest = {str(peer_id): (role, score) for peer_id, role, score in entries}
+            for role, _ in latest.values():
+                if role not in roles:
+                    roles.append(role)
+            new_ids = np.array(list(latest), dtype=str)
+            removing = np.array(list(dict.fromkeys(str(peer_id) for peer_id in deletes)), dtype=str)
+            present = removing[np.isin(removing, ids)] if len(ids) else removing[:0]
+            keep = ~np.isin(ids, np.concatenate([new_ids, removing])) if len(ids) else np.ones(0, dtype=bool)
+            if not len(latest) and not len(present):
+                return present
+
+            code = {role: i for i, role in enumerate(roles)}
+            ids = np.concatenate([ids[keep], new_ids])
+            role_codes = np.concatenate([role_codes[keep], [code[r] for r, _ in latest.values()]]).astype(np.int32)
+            scores = np.concatenate([scores[keep], [float(s) for _, s in latest.values()]])
+            order = np.argsort(ids, kind="stable")
+            ids, role_codes, scores = ids[order], role_codes[order], scores[order]
+            by_role = np.lexsort((scores, role_codes))
+            offsets = np.searchsorted(role_codes[by_role], np.arange(len(roles) + 1))
+            self.store.publish(self.NAME, {
+                "ids": ids, "role_codes": role_codes, "scores": scores,
+                "sorted_scores": scores[by_role], "offsets": offsets
+            }, {"roles": roles})
+            self._attach()
+            return present
+
+    def upsert(self, peer_id, role, score):
+        self._apply(entries=[(peer_id, role, score)])
+
+    def upsert_many(self, entries):
+        """Insert or replace several (peer_id, role, score) entries in one generation."""
+        self._apply(entries=list(entries))
+
+    def delete(self, peer_id):
+        return len(self._apply(deletes=[peer_id])) > 0
+
+    def delete_many(self, peer_ids):
+        """Remove several peers in one generation, returning how many were present."""
+        return len(self._apply(deletes=list(peer_ids)))
+
+    def _role_scores(self, role):
+        arrays, _, codes = self._current()
+        i = codes.get(role)
+        if i is None:
+            return arrays["sorted_scores"][:0]
+        offsets = arrays["offsets"]
+        return arrays["sorted_scores"][offsets[i]:offsets[i + 1]]
+
+    def _excluded(self, role, exclude):
+        """The score of peer exclude if it is indexed under role, else None."""
+        if exclude is None:
+            return None
+        arrays, _, codes = self._current()
+        ids = arrays["ids"]
+        i = int(np.searchsorted(ids, str(exclude)))
+        if i == len(ids) or ids[i] != str(exclude) or arrays["role_codes"][i] != codes.get(role):
+            return None
+        return float(arrays["scores"][i])
+
+    def size(self, role=None, exclude=None):
+        """Peers indexed, for one role if given, not counting peer exclude."""
+        if role is None:
+            ids = self._current()[0]["ids"]
+            return len(ids) - (exclude is not None and bool(np.isin(str(exclude), ids)))
+        return len(self._role_scores(role)) - (self._excluded(role, exclude) is not None)
+
+    def percentile_rank(self, role, value, exclude=None):
+        """
+        Same semantics as utils.percentile_rank, in O(log N). exclude is a peer
+        id left out of the ranking, so a user is never ranked against themself.
+        """
+        scores = self._role_scores(role)
+        less = int(np.searchsorted(scores, value, side="left"))
+        equal = int(np.searchsorted(scores, value, side="right")) - less
+        return _rank(less, equal, len(scores), value, self._excluded(role, exclude))
+
+    def stats(self):
+        arrays, meta, _ = self._current()
+        counts = np.diff(arrays["offsets"]).tolist()
+        return {
+            "generation": meta["generation"],
+            "total": len(arrays["ids"]),
+            "roles": {role: n for role, n in zip(meta["roles"], counts) if n},
+            "shared": True
+        }
+
+
+# Single index for the service; shared between worker processes when ML_SHARED_STATE_DIR is set
+population_index = SharedPopulationIndex(shared_store) if shared_store is not None else PopulationIndex()
+
+__all__ = ["PopulationIndex", "SharedPopulationIndex", "population_index"]
@@ -0,0 +1,447 @@
+import contextvars
+import fcntl
+import itertools
+import json
+import logging
+import math
+import multiprocessing.util
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from settings import SKETCH_COMPRESSION, SKETCH_MIN_COUNT, SKETCH_DIR, SKETCH_SOURCE, SKETCH_SYNC_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Largest compression accepted from a serialized sketch; memory grows linearly with it
+MAX_COMPRESSION = 10000
+
+
+class QuantileSketch:
+    """
+    Mergeable t-digest of a stream of values, for percentile ranks without
+    keeping the values.
+
+    Values are buffered and folded into at most about compression / 2
+    centroids, small near the tails and larger in the middle, so ranks are
+    most accurate at the extremes. Two sketches merge by pooling their
+    centroids, and the state round-trips through a plain dict. Not thread
+    safe; PopulationSketches locks around it.
+    """
+
+    def __init__(self, compression=SKETCH_COMPRESSION, buffer_size=None):
+        self.compression = float(compression)
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = np.empty(buffer_size or max(1, int(self.compression)))
+        self._buffered = 0
+        self._lookup = None  # arrays _centroid_rank derives from the centroids
+
+    @property
+    def count(self):
+        return float(self.weights.sum()) + self._buffered
+
+    def __len__(self):
+        return int(self.count)
+
+    def add(self, value):
+        value = float(value)
+        if math.isnan(value):
+            return
+        if self._buffered == len(self._buffer):
+            self._compress()
+        self._buffer[self._buffered] = value
+        self._buffered += 1
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        while len(values):
+            if self._buffered == len(self._buffer):
+                self._compress()
+            take = min(len(values), len(self._buffer) - self._buffered)
+            self._buffer[self._buffered:self._buffered + take] = values[:take]
+            self._buffered += take
+            values = values[take:]
+
+    def merge(self, other):
+        """Fold another sketch's values into this one."""
+        other._compress()
+        self._compress(other.means, other.weights)
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    def _compress(self, means=None, weights=None):
+        """Fold the buffer, and any extra centroids, into the centroid list."""
+        buffered = self._buffer[:self._buffered]
+        parts_m = [self.means, buffered] + ([means] if means is not None else [])
+        parts_w = [self.weights, np.ones(len(buffered))] + ([weights] if weights is not None else [])
+        self._buffered = 0
+        self._lookup = None
+        m = np.concatenate(parts_m)
+        if not len(m):
+            return
+        w = np.concatenate(parts_w)
+        self.min = min(self.min, float(m.min()))
+        self.max = max(self.max, float(m.max()))
+        order = np.argsort(m, kind="stable")
+        m, w = m[order], w[order]
+        total = w.sum()
+        # Each centroid spans at most one unit of the k1 scale, k(q) = compression / (2 pi) * asin(2q - 1)
+        q = (np.cumsum(w) - w / 2) / total
+        bucket = np.floor(self.compression / (2 * math.pi) * np.arcsin(2 * q - 1)).astype(np.int64)
+        starts = np.flatnonzero(np.concatenate([[True], bucket[1:] != bucket[:-1]]))
+        self.weights = np.add.reduceat(w, starts)
+        self.means = np.add.reduceat(m * w, starts) / self.weights
+
+    def percentile_rank(self, values):
+        """
+        Approximate percentile_rank of each value, the share of values below it
+        with ties counted half, from 0 to 1. A scalar gives a float.
+        """
+        x = np.asarray(values, dtype=float)
+        n = self.count
+        if n == 0:
+            return np.zeros(x.shape) if x.ndim else 0.0
+        below = self._centroid_rank(x) if len(self.weights) else np.zeros(x.shape)
+        if self._buffered:
+            # Buffered values are still exact
+            buffered = np.sort(self._buffer[:self._buffered])
+            less = np.searchsorted(buffered, x, side="left")
+            below = below + (less + np.searchsorted(buffered, x, side="right")) / 2
+        rank = below / n
+        return rank if x.ndim else float(rank)
+
+    def _centroid_rank(self, x):
+        """Weight of the centroids below x, ties half, interpolated between centroid means."""
+        if self._lookup is None:
+            before = np.concatenate([[0.0], np.cumsum(self.weights)])  # weight of the centroids before each
+            # Each centroid's mean sits at the middle of its weight; the ends are the exact min and max
+            points = np.concatenate([[self.min], self.means, [self.max]])
+            ranks = np.concatenate([[0.0], before[:-1] + self.weights / 2, [before[-1]]])
+            self._lookup = before, points, ranks
+        before, points, ranks = self._lookup
+        less = np.searchsorted(self.means, x, side="left")
+        more = np.searchsorted(self.means, x, side="right")
+        # A value equal to centroid means counts their weight half, like ties; np.interp
+        # already gives 0 below min and the total above max
+        return np.where(more > less, (before[less] + before[more]) / 2, np.interp(x, points, ranks))
+
+    def quantile(self, q):
+        """Approximate value at quantile q in [0, 1]."""
+        self._compress()
+        if not len(self.weights):
+            return math.nan
+        cumulative = np.cumsum(self.weights) - self.weights / 2
+        points = np.concatenate([[0.0], cumulative, [self.weights.sum()]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * self.weights.sum(), points, values))
+
+    def to_dict(self):
+        self._compress()
+        return {
+            "compression": self.compression,
+            "count": self.count,
+            "min": self.min if self.weights.size else None,
+            "max": self.max if self.weights.size else None,
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuild a sketch from to_dict's output; raises ValueError for a malformed state."""
+        try:
+            compression = float(state["compression"])
+            means = np.asarray(state["means"], dtype=float)
+            weights = np.asarray(state["weights"], dtype=float)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Bad sketch state: {e}")
+        if not 0 < compression <= MAX_COMPRESSION:
+            raise ValueError(f"Sketch compression must be above 0 and at most {MAX_COMPRESSION}")
+        sketch = cls(compression)
+        if means.ndim != 1 or means.shape != weights.shape:
+            raise ValueError("Sketch means and weights must be lists of the same length")
+        if not (np.isfinite(means).all() and np.isfinite(weights).all() and (weights > 0).all()):
+            raise ValueError("Sketch means must be finite and weights positive")
+        if len(means):
+            # Re-folding bounds the centroid count whatever the sender's lists held
+            sketch._compress(means, weights)
+            if state.get("min") is not None:
+                sketch.min = min(sketch.min, float(state["min"]))
+            if state.get("max") is not None:
+                sketch.max = max(sketch.max, float(state["max"]))
+        return sketch
+
+
+# List the additions made in this context are appended to, see PopulationSketches.recording
+_recording = contextvars.ContextVar("sketch_recording", default=None)
+
+
+class PopulationSketches:
+    """
+    Per-role quantile sketches of scores seen by the service, keyed by
+    (metric, role).
+
+    Each worker sketches the values it scores itself. Sketches exported by
+    other workers or nodes are kept per source, and replacing a source's
+    snapshot never double counts it. A rank combines this worker's sketch
+    with every source's, weighted by count, so lookups stay O(log k) and no
+    population is shipped or stored. Until a role has min_count values its
+    rank is None.
+
+    With a directory, workers share their sketches through it: each holds a
+    slot file (<source>-<n>.json, claimed with an flock), rewrites it with its
+    own sketches every sync_seconds and merges every other file as a source.
+    A restarted worker takes over a free slot and continues from its
+    snapshot, so sketches outlive restarts, and a directory on shared storage
+    merges nodes too.
+    """
+
+    def __init__(self, compression=SKETCH_COMPRESSION, min_count=SKETCH_MIN_COUNT,
+                 directory=SKETCH_DIR, source=SKETCH_SOURCE, sync_seconds=SKETCH_SYNC_SECONDS):
+        self.compression = compression
+        self.min_count = min_count
+        self._lock = threading.Lock()
+        self._local = {}    # (metric, role) -> QuantileSketch
+        self._sources = {}  # source -> {(metric, role): QuantileSketch}
+        self.generation = 0  # bumped when a source snapshot is replaced or removed by hand
+        self.directory = directory
+        self.source = source
+        self.sync_seconds = sync_seconds
+        self._sync_lock = threading.Lock()
+        self._pid = None          # process that claimed the slot; a forked child claims its own
+        self._slot = None         # (slot name, open lock file)
+        self._next_sync = 0.0
+        self._file_mtimes = {}    # slot name -> mtime of the snapshot merged from it
+
+    def _sketch(self, metric, role):
+        key = (metric, role)
+        sketch = self._local.get(key)
+        if sketch is None:
+            sketch = self._local[key] = QuantileSketch(self.compression)
+        return sketch
+
+    def add(self, metric, role, value):
+        self._maybe_sync()
+        recorded = _recording.get()
+        if recorded is not None:
+            recorded.append((metric, [role], [value]))
+        with self._lock:
+            self._sketch(metric, role).add(value)
+
+    def add_many(self, metric, roles, values):
+        """Record values[i] under roles[i]."""
+        self._maybe_sync()
+        roles = np.asarray(roles, dtype=object)
+        values = np.asarray(values, dtype=float)
+        recorded = _recording.get()
+        if recorded is not None:
+            recorded.append((metric, roles.tolist(), values.tolist()))
+        with self._lock:
+            for role in dict.fromkeys(roles.tolist()):
+                self._sketch(metric, role).add_many(values[roles == role])
+
+    @contextmanager
+    def recording(self):
+        """
+        Collect the additions made in this context, for replay(): a cached
+        result then adds what computing it added, as if it were computed again.
+        """
+        recorded = []
+        token = _recording.set(recorded)
+        try:
+            yield recorded
+        finally:
+            _recording.reset(token)
+
+    def replay(self, recorded):
+        for metric, roles, values in recorded:
+            self.add_many(metric, roles, values)
+
+    def percentile_rank(self, metric, role, values):
+        """
+        Ranks of values among everything sketched for the role, local and
+        merged, as percentile_rank computes them; None below min_count.
+        """
+        self._maybe_sync()
+        key = (metric, role)
+        with self._lock:
+            sketches = [s[key] for s in (self._local, *self._sources.values()) if key in s]
+            counts = [s.count for s in sketches]
+            total = sum(counts)
+            if total == 0 or total < self.min_count:
+                return None
+            return sum(s.percentile_rank(values) * c for s, c in zip(sketches, counts)) / total
+
+    def export(self):
+        """This worker's own sketches as {metric: {role: state}}, for other workers to merge."""
+        with self._lock:
+            states = {}
+            for (metric, role), sketch in self._local.items():
+                states.setdefault(metric, {})[role] = sketch.to_dict()
+            return states
+
+    def replace_source(self, source, states, bump=True):
+        """
+        Install another worker's export as the snapshot for source, replacing its
+        last one. Directory syncs pass bump=False: like this worker's own
+        additions, other workers' only drift ranks slowly.
+        """
+        try:
+            sketches = {
+                (metric, role): QuantileSketch.from_dict(state)
+                for metric, roles in states.items() for role, state in roles.items()
+            }
+        except AttributeError:
+            raise ValueError("Sketches must be given as {metric: {role: state}}")
+        with self._lock:
+            self._sources[source] = sketches
+            self.generation += bump
+        return len(sketches)
+
+    def remove_source(self, source, bump=True):
+        with self._lock:
+            removed = self._sources.pop(source, None) is not None
+            if removed:
+                self.generation += bump
+            return removed
+
+    # ---------------- Directory sync ---------------- #
+    def _maybe_sync(self):
+        if not self.directory:
+            return
+        if self._pid == os.getpid() and time.monotonic() < self._next_sync:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return  # another thread is syncing
+        try:
+            self._next_sync = time.monotonic() + self.sync_seconds
+            self.sync()
+        except OSError as e:
+            logger.warning("Sketch sync with %s failed: %s", self.directory, e)
+        finally:
+            self._sync_lock.release()
+
+    def _claim_slot(self):
+        """Lock the first free slot and continue from its snapshot."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            # A forked worker starts with its parent's sketches, which the parent publishes itself
+            self._local = {}
+            for name in self._file_mtimes:
+                self._sources.pop(name, None)
+            self._file_mtimes = {}
+        for n in itertools.count():
+            name = f"{self.source}-{n}"
+            lock = open(os.path.join(self.directory, name + ".lock"), "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                continue
+            self._slot, self._pid = (name, lock), os.getpid()
+            # Pool worker processes skip atexit handlers but run these finalizers
+            multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+            break
+        states = self._read(os.path.join(self.directory, name + ".json"))
+        if states:
+            restored = {(metric, role): QuantileSketch.from_dict(state)
+                        for metric, roles in states.items() for role, state in roles.items()}
+            with self._lock:
+                for key, sketch in restored.items():
+                    added = self._local.get(key)  # by another thread since the reset
+                    self._local[key] = sketch if added is None else sketch.merge(added)
+        logger.info("Population sketches sync through %s as %s", self.directory, name)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning("Ignoring unreadable sketch snapshot %s: %s", path, e)
+            return None
+
+    def close(self):
+        """Write a last snapshot and give up the slot, e.g. at shutdown."""
+        if self._slot is None or self._pid != os.getpid():
+            return
+        with self._sync_lock:
+            try:
+                self.sync()
+            except OSError as e:
+                logger.warning("Sketch sync with %s failed: %s", self.directory, e)
+            self._slot[1].close()
+            self._slot, self._pid = None, None
+
+    def sync(self):
+        """Write this worker's sketches to its slot file and merge every other slot's."""
+        if self._pid != os.getpid():
+            self._claim_slot()
+        own = self._slot[0]
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{own}-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.export(), f)
+            os.replace(tmp, os.path.join(self.directory, own + ".json"))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        seen = set()
+        for entry in os.scandir(self.directory):
+            name = entry.name[:-len(".json")]
+            if not entry.name.endswith(".json") or name == own:
+                continue
+            seen.add(name)
+            mtime = entry.stat().st_mtime_ns
+            if self._file_mtimes.get(name) == mtime:
+                continue
+            states = self._read(entry.path)
+            if states is None:
+                continue
+            try:
+                self.replace_source(name, states, bump=False)
+            except ValueError as e:
+                logger.warning("Ignoring sketch snapshot %s: %s", entry.path, e)
+                continue
+            self._file_mtimes[name] = mtime
+        for name in set(self._file_mtimes) - seen:
+            self.remove_source(name, bump=False)
+            del self._file_mtimes[name]
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for sketches in (self._local, *self._sources.values()):
+                for (metric, role), sketch in sketches.items():
+                    roles = counts.setdefault(metric, {})
+                    roles[role] = roles.get(role, 0) + sketch.count
+            return {
+                "generation": self.generation,
+                "min_count": self.min_count,
+                "sources": sorted(self._sources),
+                "counts": counts
+            }
+
+
+# Single set of sketches for the service
+population_sketches = PopulationSketches()
+
+
+def recorded_call(fn, **kwargs):
+    """(fn(**kwargs), the sketch additions it made), for PopulationSketches.replay; runs in any worker."""
+    with population_sketches.recording() as recorded:
+        value = fn(**kwargs)
+    return value, recorded
+
+__all__ = ["MAX_COMPRESSION", "QuantileSketch", "PopulationSketches", "population_sketches", "recorded_call"]
@@ -0,0 +1,363 @@
+"""
+Re-score a whole partner base offline, streaming profiles through a process pool.
+
+    python rescore.py profiles.jsonl scores.jsonl
+    python rescore.py profiles.csv scores.csv --pipeline credit --workers 8
+    python rescore.py profiles.parquet scores/ --ordered --checkpoint run.ckpt
+
+Formats follow the file extension: .jsonl/.ndjson, .csv or .parquet (Parquet
+needs pyarrow, and its output is a directory with one part file per chunk).
+In CSV and Parquet input, columns named features.<name> make up the features
+dict, and activity_log / history_scores may hold JSON text.
+
+Input is read chunk by chunk and at most 2 x workers chunks are in flight, so
+memory stays flat whatever the input size. With --checkpoint a crashed run
+restarts where it stopped: finished chunks are skipped and anything written
+after the last checkpoint is truncated and redone.
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from tracing import configure_logging
+
+logger = logging.getLogger("rescore")
+
+PIPELINES = ("level", "credit", "both")
+JSON_COLUMNS = ("activity_log", "history_scores")
+FEATURE_PREFIX = "features."
+
+
+def detect_format(path):
+    ext = os.path.splitext(path.rstrip("/"))[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if ext in (".csv", ".parquet"):
+        return ext[1:]
+    raise ValueError(f"Cannot tell the format of '{path}', expected .jsonl, .ndjson, .csv or .parquet")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet input and output need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+# ---------------- Reading ---------------- #
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value)) or value == ""
+
+
+def profile_from_row(row):
+    """Nest a flat CSV/Parquet row into the profile shape the scoring functions take."""
+    profile = {}
+    for col, value in row.items():
+        if _is_missing(value):
+            continue
+        if col.startswith(FEATURE_PREFIX):
+            profile.setdefault("features", {})[col[len(FEATURE_PREFIX):]] = value
+        elif col in JSON_COLUMNS and isinstance(value, str):
+            profile[col] = json.loads(value)
+        else:
+            profile[col] = value
+    return profile
+
+
+def read_chunks(path, fmt, chunk_size, skip=frozenset()):
+    """Yield (chunk_id, profiles) for each chunk not in skip. Skipped JSONL chunks are not parsed."""
+    if fmt == "jsonl":
+        with open(path) as f:
+            chunk_id, lines = 0, []
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+                if len(lines) == chunk_size:
+                    if chunk_id not in skip:
+                        yield chunk_id, [json.loads(l) for l in lines]
+                    chunk_id, lines = chunk_id + 1, []
+            if lines and chunk_id not in skip:
+                yield chunk_id, [json.loads(l) for l in lines]
+    elif fmt == "csv":
+        import pandas as pd
+        reader = pd.read_csv(path, chunksize=chunk_size, keep_default_na=True)
+        for chunk_id, frame in enumerate(reader):
+            if chunk_id not in skip:
+                yield chunk_id, [profile_from_row(r) for r in frame.to_dict("records")]
+    else:
+        parquet = _import_pyarrow().parquet.ParquetFile(path)
+        for chunk_id, batch in enumerate(parquet.iter_batches(batch_size=chunk_size)):
+            if chunk_id not in skip:
+                yield chunk_id, [profile_from_row(r) for r in batch.to_pylist()]
+
+
+# ---------------- Scoring (worker processes) ---------------- #
+def _init_worker(population_path):
+    # Importing the scoring modules loads the models, once per worker
+    global level_score, final_credit_score
+    import level_score
+    import final_credit_score
+    if population_path:
+        peers = [p for _, chunk in read_chunks(population_path, detect_format(population_path), 10000)
+                 for p in chunk]
+        final_credit_score.upsert_population_peers(peers)
+
+
+def _score_level(profiles, month_active):
+    # Ranked against the population sketches, as the service's level endpoints rank
+    history = [p.get("history_scores", []) for p in profiles]
+    try:
+        return level_score.compute_level_scores_batch(profiles, {}, month_active, history)
+    except Exception:
+        # One bad profile fails the whole batch; score one by one to isolate it
+        results = []
+        for profile, scores in zip(profiles, history):
+            try:
+                results.append(level_score.compute_level_scores_batch([profile], {}, month_active, [scores])[0])
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
+
+
+def _score_both(profiles, month_active):
+    """
+    (level, credit) per profile from one scoring run each, so the level shares
+    the credit score's prediction and sketch percentile: it equals credit.level
+    whenever the profile's month_active is month_active.
+    """
+    results = []
+    for profile in profiles:
+        run = final_credit_score.scoring_run(profile)
+        credit = run.get("credit")
+        try:
+            level = level_score.level_result(run, month_active)
+        except Exception as e:
+            level = {"error": str(e)}
+        results.append((level, credit))
+    return results
+
+
+def _score_chunk(chunk_id, profiles, pipeline, month_active):
+    ids = [{"user_id": p.get("user_id", p.get("id"))} for p in profiles]
+    if pipeline == "level":
+        return chunk_id, [{**i, **r} for i, r in zip(ids, _score_level(profiles, month_active))]
+    if pipeline == "credit":
+        credit = [final_credit_score.compute_final_credit_score(p) for p in profiles]
+        return chunk_id, [{**i, **r} for i, r in zip(ids, credit)]
+    return chunk_id, [{**i, "level": l, "credit": c} for i, (l, c) in zip(ids, _score_both(profiles, month_active))]
+
+
+# ---------------- Writing ---------------- #
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def flatten(row, prefix=""):
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[prefix + key] = value.item() if isinstance(value, np.generic) else value
+    return flat
+
+
+class JsonlWriter:
+    def __init__(self, path, offset, fieldnames=None):
+        self.f = _open_at(path, offset)
+        self.fieldnames = None
+
+    def write(self, rows):
+        self.f.writelines(json.dumps(r, default=_plain) + "\n" for r in rows)
+
+    def position(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+
+class CsvWriter(JsonlWriter):
+    def __init__(self, path, offset, fieldnames=None):
+        self.f = _open_at(path, offset)
+        self.fieldnames = fieldnames
+        self.writer = None
+
+    def write(self, rows):
+        rows = [flatten(r) for r in rows]
+        if self.writer is None:
+            if self.fieldnames is None:
+                # Columns come from the first chunk, plus an error column per result group
+                # since rows that failed only carry an error
+                names = dict.fromkeys(k for r in rows for k in r)
+                for prefix in dict.fromkeys(k.rpartition(".")[0] for k in list(names)):
+                    names.setdefault(f"{prefix}.error" if prefix else "error")
+                self.fieldnames = list(names)
+                self.writer = csv.DictWriter(self.f, self.fieldnames, extrasaction="ignore")
+                self.writer.writeheader()
+            else:
+                self.writer = csv.DictWriter(self.f, self.fieldnames, extrasaction="ignore")
+        self.writer.writerows(rows)
+
+
+class ParquetWriter:
+    """One part file per chunk, so a resumed run never has to truncate anything."""
+
+    def __init__(self, path, offset, fieldnames=None):
+        self.pa = _import_pyarrow()
+        self.path = path
+        self.fieldnames = None
+        self.chunk_id = None
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, rows):
+        table = self.pa.Table.from_pylist([flatten(r) for r in rows])
+        part = os.path.join(self.path, f"part-{self.chunk_id:06d}.parquet")
+        self.pa.parquet.write_table(table, part + ".tmp")
+        os.replace(part + ".tmp", part)
+
+    def position(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+def _open_at(path, offset):
+    f = open(path, "a+" if offset else "w", newline="")
+    if offset:
+        f.truncate(offset)
+        f.seek(offset)
+    return f
+
+
+# ---------------- Checkpoints ---------------- #
+class Checkpoint:
+    def __init__(self, path, run):
+        self.path = path
+        self.run = run
+        self.done = set()
+        self.output_bytes = 0
+        self.fieldnames = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved["run"] != run:
+                raise SystemExit(f"Checkpoint {path} belongs to a different run: {saved['run']}")
+            self.done = set(saved["done"])
+            self.output_bytes = saved["output_bytes"]
+            self.fieldnames = saved["fieldnames"]
+            logger.info("Resuming from %s: %d chunks already done", path, len(self.done))
+
+    def mark(self, chunk_id, output_bytes, fieldnames):
+        self.done.add(chunk_id)
+        self.output_bytes = output_bytes
+        self.fieldnames = fieldnames
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"run": self.run, "done": sorted(self.done),
+                       "output_bytes": output_bytes, "fieldnames": fieldnames}, f)
+        os.replace(tmp, self.path)
+
+
+# ---------------- Driver ---------------- #
+def rescore(input_path, output_path, pipeline="level", workers=None, chunk_size=5000,
+            ordered=False, checkpoint_path=None, month_active=30, population_path=None):
+    in_fmt, out_fmt = detect_format(input_path), detect_format(output_path)
+    workers = workers or os.cpu_count() or 1
+    run = {"input": os.path.abspath(input_path), "output": os.path.abspath(output_path),
+           "pipeline": pipeline, "chunk_size": chunk_size, "month_active": month_active}
+    checkpoint = Checkpoint(checkpoint_path, run)
+    writer = WRITERS[out_fmt](output_path, checkpoint.output_bytes, checkpoint.fieldnames)
+
+    source = read_chunks(input_path, in_fmt, chunk_size, skip=frozenset(checkpoint.done))
+    in_flight, ready, order = {}, {}, deque()
+    rows_written, started = 0, time.perf_counter()
+
+    def write(chunk_id, rows):
+        nonlocal rows_written
+        writer.chunk_id = chunk_id
+        writer.write(rows)
+        checkpoint.mark(chunk_id, writer.position(), writer.fieldnames)
+        rows_written += len(rows)
+        logger.info("chunk %d written, %d rows so far (%.0f rows/s)",
+                    chunk_id, rows_written, rows_written / (time.perf_counter() - started))
+
+    # Spawned workers start clean instead of inheriting this process's logging threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(population_path,)) as pool:
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(in_flight) + len(ready) < 2 * workers:
+                    try:
+                        chunk_id, profiles = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = pool.submit(_score_chunk, chunk_id, profiles, pipeline, month_active)
+                    in_flight[future] = chunk_id
+                    order.append(chunk_id)
+                if not in_flight and not ready:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    chunk_id, rows = future.result()
+                    del in_flight[future]
+                    ready[chunk_id] = rows
+                if ordered:
+                    while order and order[0] in ready:
+                        chunk_id = order.popleft()
+                        write(chunk_id, ready.pop(chunk_id))
+                else:
+                    for chunk_id in list(ready):
+                        write(chunk_id, ready.pop(chunk_id))
+        finally:
+            writer.close()
+    return rows_written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score user profiles offline")
+    parser.add_argument("input", help="profiles as .jsonl, .csv or .parquet")
+    parser.add_argument("output", help="results as .jsonl, .csv or .parquet (a directory)")
+    parser.add_argument("--pipeline", choices=PIPELINES, default="level")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="profiles per chunk")
+    parser.add_argument("--ordered", action="store_true", help="write results in input order")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file for resuming")
+    parser.add_argument("--month-active", type=int, default=30, help="month_active for the level score")
+    parser.add_argument("--population", default=None, help="peer profiles to index for the credit score")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    rows = rescore(
+        args.input, args.output, args.pipeline, args.workers, args.chunk_size,
+        args.ordered, args.checkpoint, args.month_active, args.population
+    )
+    print(f"{rows} profiles scored into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
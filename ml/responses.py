@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _numpy_default(obj):
+    """NumPy values as the JSON types to_serializable used to convert them to."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """
+    JSON bytes for content in one pass, with NumPy scalars and arrays written
+    natively. Uses orjson when it is installed and the standard library
+    encoder, with Starlette's JSONResponse settings, otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_numpy_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_numpy_default
+    ).encode("utf-8")
+
+
+class NumpyJSONResponse(JSONResponse):
+    """
+    JSONResponse that takes NumPy values as they are. Returning one from an
+    endpoint also skips FastAPI's jsonable_encoder pass over the content.
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+__all__ = ["NumpyJSONResponse", "dumps"]
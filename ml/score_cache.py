@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from initial_boosts import BOOST_TABLE_NAME, boost_index
+from hybridspamdetector import SPAM_MODEL_NAME
+from ml_model_module import LEVEL_MODEL_NAME
+from model_registry import loaded_models
+from population_index import population_index
+from quantile_sketch import population_sketches
+from settings import SCORE_CACHE_MAX_BYTES, SCORE_CACHE_TTL_SECONDS, SCORE_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Returned by get() on a miss, since None and 0 are valid cached results
+MISS = object()
+
+
+def _canonical(obj):
+    """JSON encoding that is the same for equal inputs regardless of dict order."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=repr)
+
+
+class ScoreCache:
+    """
+    Content-addressed cache of scoring results.
+
+    Keys hash the scoring function's name, its inputs and a generation tuple
+    describing the models, boost table and population the result came from,
+    so any change there makes old entries unreachable. The memory tier is an
+    LRU capped in bytes of pickled results, with a TTL; hits unpickle a fresh
+    copy so callers can modify what they get back. The optional disk tier is a
+    directory of one file per key, shared by every worker pointed at it.
+    """
+
+    def __init__(self, max_bytes=SCORE_CACHE_MAX_BYTES, ttl_seconds=SCORE_CACHE_TTL_SECONDS,
+                 disk_dir=SCORE_CACHE_DIR, generation_fn=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self.generation_fn = generation_fn or (lambda: None)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, pickled result)
+        self._generation = None
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, fn_name, *args, **kwargs):
+        generation = self.generation_fn()
+        if generation != self._generation:
+            # The old entries can never be hit again, so free their memory now
+            with self._lock:
+                if generation != self._generation:
+                    self._entries.clear()
+                    self.bytes = 0
+                    self._generation = generation
+        payload = _canonical([fn_name, generation, args, kwargs])
+        return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+    # ---------------- Lookups ---------------- #
+    def _memory_get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            expires_at, data = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.bytes -= len(data)
+                self.expirations += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return pickle.loads(data)
+
+    def peek(self, key):
+        """Memory tier only and no miss counted; cheap enough for the event loop."""
+        return self._memory_get(key)
+
+    def get(self, key):
+        value = self._memory_get(key)
+        if value is not MISS:
+            return value
+        if self.disk_dir:
+            data = self._disk_get(key)
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._store(key, data)
+                return pickle.loads(data)
+        with self._lock:
+            self.misses += 1
+        return MISS
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._store(key, data)
+        if self.disk_dir:
+            self._disk_put(key, data)
+
+    def _store(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, data)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    # ---------------- Disk tier ---------------- #
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Could not write score cache entry %s: %s", key, e)
+
+    def prune_disk(self):
+        """Delete expired files from the disk tier; meant for a periodic job."""
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for directory, _, files in os.walk(self.disk_dir or ()):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    # ---------------- Wrappers ---------------- #
+    def call(self, key, fn, *args, cacheable=None, **kwargs):
+        """fn(*args, **kwargs) through the cache. Results failing cacheable(result) are not stored."""
+        value = self.get(key)
+        if value is MISS:
+            value = fn(*args, **kwargs)
+            if cacheable is None or cacheable(value):
+                self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_dir": self.disk_dir,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+def service_generation():
+    """Everything a cached score depends on besides its inputs."""
+    return (
+        tuple(loaded_models.get(name, {}).get("version") for name in (LEVEL_MODEL_NAME, SPAM_MODEL_NAME, BOOST_TABLE_NAME)),
+        boost_index.generation,
+        population_index.generation,
+        # Merged sketches from other workers; this worker's own additions only drift ranks slowly
+        population_sketches.generation
+    )
+
+
+# Single cache for the service
+score_cache = ScoreCache(generation_fn=service_generation)
+
+__all__ = ["ScoreCache", "MISS", "service_generation", "score_cache"]
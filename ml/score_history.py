@@ -0,0 +1,345 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from settings import SCORE_HISTORY_DIR, SCORE_HISTORY_PERIOD
+
+# ---------------- Score History ---------------- #
+# Every level score the service computes, per user, in fixed-width columns of
+# memory-mapped files. Records are grouped in chunks of CHUNK_RECORDS scores
+# of one user; each chunk points back at the user's previous chunk, and an
+# in-memory index holds every user's newest chunk. Reading a user's last k
+# scores touches about k / CHUNK_RECORDS chunks, whatever the history holds.
+
+CHUNK_RECORDS = 16
+# column -> (dtype, shape of one chunk's entry)
+COLUMNS = {
+    "scores": (np.float64, (CHUNK_RECORDS,)),
+    "times": (np.float64, (CHUNK_RECORDS,)),  # unix seconds
+    "chunk_user": (np.int32, ()),             # slot of the chunk's user in users.txt, -1 once deleted
+    "chunk_prev": (np.int32, ()),             # the user's previous chunk, -1 for their first
+    "chunk_fill": (np.uint8, ()),             # records written; 0 for chunks not allocated yet
+}
+USERS_FILE = "users.txt"
+LOCK_FILE = ".lock"
+MIN_CHUNKS = 1024
+PERIODS = ("day", "week", "month")
+
+
+def period_index(timestamps, period):
+    """The UTC calendar period of each unix timestamp, as integers that grow with time."""
+    seconds = np.asarray(timestamps, dtype=np.float64).astype("datetime64[s]")
+    if period == "month":
+        return seconds.astype("datetime64[M]").astype(np.int64)
+    days = seconds.astype("datetime64[D]").astype(np.int64)
+    if period == "week":
+        return (days + 3) // 7  # weeks start on Monday; 1970-01-01 was a Thursday
+    return days
+
+
+class ScoreHistoryStore:
+    """
+    Per-user score time series in columnar files under a directory;
+    ":memory:" uses a temporary directory removed with the store.
+
+    record_many keeps one score per user and calendar period, replacing the
+    newest record while its period lasts; closed_many reads the closing
+    scores of the periods before the current one. Scoring a user again in
+    the same period therefore starts from the same history, however often it
+    happens. append_many adds records unconditionally.
+
+    Chunks are allocated in order and a chunk's fill count is written after
+    its scores, so readers never see a record half written. Writers in
+    different processes take turns on an flock and each process picks up the
+    chunks, users and file growth of the others before reading, so worker
+    processes can share one directory.
+    """
+
+    def __init__(self, path=SCORE_HISTORY_DIR, period=SCORE_HISTORY_PERIOD):
+        if period not in PERIODS:
+            raise ValueError(f"Unknown score history period '{period}', expected one of {list(PERIODS)}")
+        self.period = period
+        self._tmp = None
+        if not path or path == ":memory:":
+            self._tmp = tempfile.TemporaryDirectory(prefix="score-history-")
+            path = self._tmp.name
+        self.path = path
+        self._users_path = os.path.join(path, USERS_FILE)
+        self._fill_path = self._file("chunk_fill")
+        self._lock = threading.Lock()
+        self._columns = None
+        self._maps = []
+        self._lock_file = None
+        self._capacity = 0
+        self._fill_size = -1
+        self._scanned = 0       # chunks indexed so far; every chunk before it is allocated
+        self._users = []        # slot -> user id
+        self._slots = {}        # user id -> slot
+        self._users_read = 0    # bytes of users.txt read
+        self._last = {}         # slot -> the user's newest chunk
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    # ---------------- Files ---------------- #
+    def _open(self):
+        # Opened on first use so importing the module never touches the disk
+        if self._columns is None:
+            os.makedirs(self.path, exist_ok=True)
+            for name in COLUMNS:
+                open(self._file(name), "ab").close()
+            open(self._users_path, "ab").close()
+            self._lock_file = open(os.path.join(self.path, LOCK_FILE), "a")
+            self._columns = {}
+        self._refresh()
+
+    def _map(self):
+        # Columns are grown with chunk_fill last, so no column is shorter than chunk_fill says
+        capacity = min(
+            os.path.getsize(self._file(name)) // (np.dtype(dtype).itemsize * int(np.prod(shape)))
+            for name, (dtype, shape) in COLUMNS.items()
+        )
+        self.flush()
+        self._maps = [
+            np.memmap(self._file(name), dtype=dtype, mode="r+", shape=(capacity, *shape))
+            for name, (dtype, shape) in COLUMNS.items()
+        ] if capacity else []
+        # Plain ndarray views of the maps: indexing a memmap subclass costs several times more
+        self._columns = {
+            name: np.asarray(self._maps[i]) if capacity else np.zeros((0, *shape), dtype=dtype)
+            for i, (name, (dtype, shape)) in enumerate(COLUMNS.items())
+        }
+        self._capacity = capacity
+
+    def _grow(self, chunks):
+        """Extend every column to hold at least chunks chunks. The caller holds the writer lock."""
+        capacity = max(chunks, 2 * self._capacity, MIN_CHUNKS)
+        for name, (dtype, shape) in COLUMNS.items():
+            with open(self._file(name), "r+b") as f:
+                f.truncate(capacity * np.dtype(dtype).itemsize * int(np.prod(shape)))
+        self._refresh()
+
+    def _refresh(self):
+        """Pick up what other processes wrote: file growth, new users and new chunks."""
+        fill_size = os.path.getsize(self._fill_path)
+        if fill_size != self._fill_size:
+            self._map()
+            self._fill_size = fill_size
+        if os.path.getsize(self._users_path) > self._users_read:
+            with open(self._users_path, "rb") as f:
+                f.seek(self._users_read)
+                data = f.read()
+            # Only whole lines; a writer may be midway through one
+            data = data[:data.rfind(b"\n") + 1]
+            for line in data.splitlines():
+                user_id = json.loads(line)
+                self._slots[user_id] = len(self._users)
+                self._users.append(user_id)
+            self._users_read += len(data)
+        fill = self._columns["chunk_fill"]
+        # A chunk is only allocated once the one before it holds a record, so
+        # nothing is new unless the next chunk has been filled
+        if self._scanned < self._capacity and fill[self._scanned]:
+            unallocated = np.flatnonzero(fill[self._scanned:] == 0)
+            end = self._scanned + unallocated[0] if len(unallocated) else self._capacity
+            users = np.asarray(self._columns["chunk_user"][self._scanned:end])
+            chunks = np.arange(self._scanned, end)
+            live = users >= 0
+            # Later chunks overwrite earlier ones, leaving each user's newest
+            self._last.update(zip(users[live].tolist(), chunks[live].tolist()))
+            self._scanned = end
+
+    @contextmanager
+    def _writer(self):
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            self._refresh()
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def flush(self):
+        """Write mapped pages back to the files."""
+        for column in self._maps:
+            column.flush()
+
+    # ---------------- Writes ---------------- #
+    def _slot(self, user_id):
+        slot = self._slots.get(user_id)
+        if slot is None:
+            with open(self._users_path, "ab") as f:
+                f.write(json.dumps(user_id).encode() + b"\n")
+            self._refresh()
+            slot = self._slots[user_id]
+        return slot
+
+    def _chunk(self, slot):
+        """Chunk the user's next record goes to, allocating one when theirs is full."""
+        columns = self._columns
+        last = self._last.get(slot)
+        if last is not None and columns["chunk_user"][last] != slot:
+            last = None  # deleted by another process
+        if last is not None and columns["chunk_fill"][last] < CHUNK_RECORDS:
+            return last
+        chunk = self._scanned
+        if chunk >= self._capacity:
+            self._grow(chunk + 1)
+            columns = self._columns
+        columns["chunk_user"][chunk] = slot
+        columns["chunk_prev"][chunk] = -1 if last is None else last
+        self._last[slot] = chunk
+        self._scanned = chunk + 1
+        return chunk
+
+    def append(self, user_id, score, timestamp=None):
+        self.append_many([(user_id, score, timestamp)])
+
+    def _append(self, slot, score, timestamp):
+        chunk = self._chunk(slot)
+        fill = int(self._columns["chunk_fill"][chunk])
+        self._columns["scores"][chunk, fill] = score
+        self._columns["times"][chunk, fill] = timestamp
+        # Last, so readers only count records already written
+        self._columns["chunk_fill"][chunk] = fill + 1
+
+    def append_many(self, entries):
+        """Record (user_id, score[, timestamp]) entries, in order."""
+        now = time.time()
+        with self._lock:
+            self._open()
+            with self._writer():
+                for user_id, score, *rest in entries:
+                    timestamp = rest[0] if rest and rest[0] is not None else now
+                    self._append(self._slot(str(user_id)), score, timestamp)
+
+    def record_many(self, entries):
+        """
+        Record (user_id, score[, timestamp]) entries, in order, keeping one per
+        user and period: a score in the same period as the user's newest
+        record replaces it.
+        """
+        now = time.time()
+        with self._lock:
+            self._open()
+            with self._writer():
+                for user_id, score, *rest in entries:
+                    timestamp = rest[0] if rest and rest[0] is not None else now
+                    slot = self._slot(str(user_id))
+                    columns = self._columns  # remapped when an append grows the files
+                    last = self._last.get(slot)
+                    if last is not None and columns["chunk_user"][last] == slot:
+                        fill = int(columns["chunk_fill"][last])
+                        newest, period = period_index([columns["times"][last, fill - 1], timestamp], self.period)
+                        if fill and newest == period:
+                            columns["scores"][last, fill - 1] = score
+                            columns["times"][last, fill - 1] = timestamp
+                            continue
+                    self._append(slot, score, timestamp)
+
+    def delete(self, user_id):
+        """Erase a user's history, returning whether they had one."""
+        with self._lock:
+            self._open()
+            with self._writer():
+                slot = self._slots.get(str(user_id))
+                chunks = self._chunks(slot)
+                for chunk in chunks:
+                    self._columns["scores"][chunk] = np.nan
+                    self._columns["times"][chunk] = np.nan
+                    self._columns["chunk_user"][chunk] = -1
+                self._last.pop(slot, None)
+                return bool(chunks)
+
+    # ---------------- Reads ---------------- #
+    def _chunks(self, slot, records=None):
+        """The user's chunks, newest first, enough to cover their last records scores (all by default)."""
+        columns = self._columns
+        chunk = self._last.get(slot, -1)
+        chunks, covered = [], 0
+        while chunk >= 0 and columns["chunk_user"][chunk] == slot and (records is None or covered < records):
+            chunks.append(chunk)
+            covered += int(columns["chunk_fill"][chunk])
+            chunk = int(columns["chunk_prev"][chunk])
+        return chunks
+
+    def _read(self, column, user_id, limit):
+        """A user's last limit values of column, oldest first, copied out of the map."""
+        slot = self._slots.get(str(user_id))
+        chunks = self._chunks(slot, limit)[::-1] if slot is not None else []
+        if not chunks:
+            return np.empty(0)
+        fills = self._columns["chunk_fill"][chunks].tolist()
+        values = np.concatenate([self._columns[column][c, :n] for c, n in zip(chunks, fills)])
+        return values[max(len(values) - limit, 0):] if limit is not None else values
+
+    def history(self, user_id, limit=None):
+        """(scores, timestamps) arrays of a user's last limit scores (all by default), oldest first."""
+        with self._lock:
+            self._open()
+            return self._read("scores", user_id, limit), self._read("times", user_id, limit)
+
+    def recent(self, user_id, limit):
+        """A user's last limit scores as a list, oldest first, as history_scores takes them."""
+        return self.recent_many([user_id], limit)[0]
+
+    def recent_many(self, user_ids, limit):
+        with self._lock:
+            self._open()
+            return [self._read("scores", user_id, limit).tolist() for user_id in user_ids]
+
+    def _closed(self, user_id, limit, current):
+        """The user's closing scores of their last limit periods before period current, oldest first."""
+        if limit == 0:
+            return []
+        records = None if limit is None else limit + 1
+        while True:
+            scores = self._read("scores", user_id, records)
+            periods = period_index(self._read("times", user_id, records), self.period)
+            # The last record of each period closes it; the window ends at the newest record, so
+            # every period in it has its closing record in it
+            closing = (periods < current) & np.append(periods[1:] != periods[:-1], True)
+            if records is None or len(scores) < records or closing.sum() >= limit:
+                closed = scores[closing]
+                return (closed if limit is None else closed[len(closed) - min(limit, len(closed)):]).tolist()
+            # Several records in one period, from before they were kept one per period
+            records *= 2
+
+    def closed_many(self, user_ids, limit, now=None):
+        """
+        Each user's closing scores of their last limit periods before the one
+        holding now (the current time by default), oldest first, as
+        history_scores takes them.
+        """
+        current = int(period_index([time.time() if now is None else now], self.period)[0])
+        with self._lock:
+            self._open()
+            return [self._closed(user_id, limit, current) for user_id in user_ids]
+
+    def __contains__(self, user_id):
+        """Whether the user has any stored score."""
+        with self._lock:
+            self._open()
+            slot = self._slots.get(str(user_id))
+            return slot is not None and bool(self._chunks(slot, 1))
+
+    def stats(self):
+        with self._lock:
+            self._open()
+            return {
+                "users": len(self._last),
+                "chunks": self._scanned,
+                "capacity": self._capacity,
+                "bytes": sum(c.nbytes for c in self._columns.values())
+            }
+
+
+# Single store for the service
+score_history = ScoreHistoryStore()
+
+__all__ = ["ScoreHistoryStore", "score_history", "CHUNK_RECORDS", "PERIODS", "period_index"]
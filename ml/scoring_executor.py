@@ -0,0 +1,253 @@
+import asyncio
+import contextvars
+import functools
+import math
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from settings import (
+    EXECUTOR_KIND, EXECUTOR_WORKERS, RETRY_AFTER_SECONDS,
+    INTERACTIVE_WEIGHT, INTERACTIVE_CONCURRENCY, INTERACTIVE_QUEUE_DEPTH, INTERACTIVE_DEADLINE_MS,
+    BULK_WEIGHT, BULK_CONCURRENCY, BULK_QUEUE_DEPTH, BULK_DEADLINE_MS
+)
+
+
+class ExecutorSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+    def __init__(self, retry_after, message="Scoring queue is full"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(ExecutorSaturated):
+    """Raised when a call's deadline passes before a worker was free to start it."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after, "Request deadline passed before scoring started")
+
+
+# (lane name, deadline in time.monotonic() seconds) of the calls made in this context
+_request_class = contextvars.ContextVar("scoring_request_class", default=None)
+
+
+class _Waiter:
+    """A call waiting in a lane; compared by identity."""
+    __slots__ = ("future", "timer")
+
+    def __init__(self, future):
+        self.future = future
+        self.timer = None
+
+
+class Lane:
+    """One request class: its share of the workers, its wait queue and its deadline."""
+
+    def __init__(self, name, weight, concurrency, queue_depth, deadline_ms):
+        self.name = name
+        self.weight = weight
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        # Seconds from a request's arrival; 0 or less waits without a deadline
+        self.deadline = deadline_ms / 1000 if deadline_ms > 0 else math.inf
+        self.running = 0
+        self.waiting = deque()  # _Waiter, oldest first
+        self.vtime = 0.0        # advances by 1 / weight per call started
+        self.rejected = 0
+        self.shed = 0
+
+    def stats(self):
+        return {
+            "weight": self.weight,
+            "concurrency": self.concurrency,
+            "queue_depth": self.queue_depth,
+            "deadline_ms": self.deadline * 1000 if math.isfinite(self.deadline) else None,
+            "running": self.running,
+            "queued": len(self.waiting),
+            "rejected": self.rejected,
+            "shed": self.shed
+        }
+
+
+def default_lanes():
+    return [
+        Lane("interactive", INTERACTIVE_WEIGHT, INTERACTIVE_CONCURRENCY, INTERACTIVE_QUEUE_DEPTH,
+             INTERACTIVE_DEADLINE_MS),
+        Lane("bulk", BULK_WEIGHT, BULK_CONCURRENCY, BULK_QUEUE_DEPTH, BULK_DEADLINE_MS)
+    ]
+
+
+class ScoringExecutor:
+    """
+    Runs CPU-bound scoring off the event loop on a thread or process pool.
+
+    Calls belong to a lane, the request class set with request_class() (the
+    first lane otherwise). A lane admits at most concurrency + queue_depth
+    calls at once; beyond that run() fails fast with ExecutorSaturated
+    instead of queueing without bound. Waiting calls are held here rather
+    than in the pool, and each freed worker goes to the lane furthest behind
+    its weighted share, so a backlog in one lane only delays another by its
+    weight. A call whose deadline passes while it waits fails with
+    DeadlineExceeded without reaching a worker. Admission and scheduling are
+    only touched from the event loop thread, so they need no lock.
+    """
+
+    def __init__(self, kind=EXECUTOR_KIND, workers=EXECUTOR_WORKERS, retry_after=RETRY_AFTER_SECONDS, lanes=None):
+        if kind == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scoring")
+        elif kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError(f"Unknown executor kind '{kind}', expected 'thread' or 'process'")
+        self.kind = kind
+        self.workers = workers
+        self.retry_after = retry_after
+        self.lanes = {lane.name: lane for lane in (lanes or default_lanes())}
+        self._default_lane = next(iter(self.lanes.values()))
+        self._running = 0
+        self._vtime = 0.0  # vtime of the last call started
+
+    @property
+    def in_flight(self):
+        return self._running + self.queued
+
+    @property
+    def queued(self):
+        return sum(len(lane.waiting) for lane in self.lanes.values())
+
+    @property
+    def queue_depth(self):
+        return sum(lane.queue_depth for lane in self.lanes.values())
+
+    @property
+    def rejected(self):
+        return sum(lane.rejected for lane in self.lanes.values())
+
+    @property
+    def shed(self):
+        return sum(lane.shed for lane in self.lanes.values())
+
+    @contextmanager
+    def request_class(self, name, arrived=None):
+        """
+        Run the scoring calls made in this context in lane name, with its
+        deadline counted from arrived (time.monotonic(), now by default).
+        """
+        lane = self.lanes.get(name)
+        if lane is None:
+            raise ValueError(f"Unknown request class '{name}', expected one of {list(self.lanes)}")
+        arrived = time.monotonic() if arrived is None else arrived
+        token = _request_class.set((name, arrived + lane.deadline))
+        try:
+            yield lane
+        finally:
+            _request_class.reset(token)
+
+    # ---------------- Scheduling ---------------- #
+    def _start(self, lane):
+        self._running += 1
+        lane.running += 1
+        self._vtime = lane.vtime
+        lane.vtime += 1 / lane.weight
+
+    def _release(self, lane):
+        self._running -= 1
+        lane.running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free workers to waiting calls, the lane furthest behind its share first."""
+        while self._running < self.workers:
+            ready = [lane for lane in self.lanes.values() if lane.waiting and lane.running < lane.concurrency]
+            if not ready:
+                return
+            lane = min(ready, key=lambda lane: lane.vtime)
+            waiter = lane.waiting.popleft()
+            if waiter.timer is not None:
+                waiter.timer.cancel()
+            if waiter.future.done():
+                continue
+            self._start(lane)
+            waiter.future.set_result(None)
+
+    def _expire(self, lane, waiter):
+        if waiter in lane.waiting:
+            lane.waiting.remove(waiter)
+            lane.shed += 1
+            waiter.future.set_exception(DeadlineExceeded(self.retry_after))
+
+    async def _wait(self, lane, deadline, loop):
+        """Wait in lane's queue until _dispatch starts the call."""
+        waiter = _Waiter(loop.create_future())
+        if math.isfinite(deadline):
+            waiter.timer = loop.call_later(deadline - time.monotonic(), self._expire, lane, waiter)
+        lane.waiting.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # Started just as the caller went away; give the worker back
+                self._release(lane)
+            elif waiter in lane.waiting:
+                lane.waiting.remove(waiter)
+                if waiter.timer is not None:
+                    waiter.timer.cancel()
+            raise
+
+    async def run(self, fn, *args, **kwargs):
+        tagged = _request_class.get()
+        lane = self.lanes.get(tagged[0]) if tagged else None
+        if lane is None:
+            lane = self._default_lane
+            deadline = time.monotonic() + lane.deadline
+        else:
+            deadline = tagged[1]
+        if lane.running + len(lane.waiting) >= lane.concurrency + lane.queue_depth:
+            lane.rejected += 1
+            raise ExecutorSaturated(self.retry_after)
+        if time.monotonic() >= deadline:
+            lane.shed += 1
+            raise DeadlineExceeded(self.retry_after)
+        loop = asyncio.get_running_loop()
+        if not lane.waiting:
+            # A lane that was idle starts level with the others instead of with saved-up credit
+            lane.vtime = max(lane.vtime, self._vtime)
+        if self._running < self.workers and lane.running < lane.concurrency and not lane.waiting:
+            self._start(lane)
+        else:
+            await self._wait(lane, deadline, loop)
+        try:
+            call = functools.partial(fn, *args, **kwargs)
+            if self.kind == "thread":
+                # Carry the request's context (the active trace) onto the worker thread
+                call = functools.partial(contextvars.copy_context().run, call)
+            future = self._pool.submit(call)
+        except Exception:
+            self._release(lane)
+            raise
+        # Release the worker when the work finishes, not when the caller stops waiting
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release, lane))
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()}
+        }
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+# Single executor for the service
+scoring_executor = ScoringExecutor()
+
+__all__ = ["ScoringExecutor", "Lane", "ExecutorSaturated", "DeadlineExceeded", "scoring_executor"]
@@ -1,24 +1,37 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from typing import List, Dict, Any, Optional, Literal
 import uvicorn
-from level_score import compute_level_score_backend
+from level_score import (
+    compute_level_score_backend, compute_level_scores_batch,
+    model_reloader, level_coalescer, spam_coalescer, LEVEL_MONTH_ACTIVE
+)
 from spam_detection import apply_spam_penalty
-from initial_boosts import get_boost_for_user
-from final_credit_score import compute_final_credit_score
-import numpy as np 
-def to_serializable(obj):
-    if isinstance(obj, (np.int32, np.int64)):
-        return int(obj)
-    if isinstance(obj, (np.float32, np.float64)):
-        return float(obj)
-    if isinstance(obj, dict):
-        return {k: to_serializable(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [to_serializable(v) for v in obj]
-    return obj
-app = FastAPI(title="Grab ML Service")
+from initial_boosts import get_boost_for_user, upsert_engaged_users, boost_index
+import pandas as pd
+from final_credit_score import (
+    compute_final_credit_score, compute_scores, upsert_population_peers, delete_population_peers,
+    DEFAULT_STAGES
+)
+from stage_graph import scoring_stages, UnknownStage
+from population_index import population_index
+from quantile_sketch import population_sketches, recorded_call
+from model_registry import loaded_models
+from settings import RELOAD_POLL_SECONDS, SCORE_HISTORY_WINDOW
+from scoring_executor import scoring_executor, ExecutorSaturated, DeadlineExceeded
+from score_cache import score_cache, MISS
+from activity_state import activity_store, ActivityGap
+from score_history import score_history
+from tracing import configure_logging, trace
+from wire_format import WireFormatError, activity_deltas, is_wire_format, score_level_frame
+from responses import NumpyJSONResponse
+import metrics
+import time
+import asyncio
+app = FastAPI(title="Grab ML Service", default_response_class=NumpyJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,35 +46,373 @@ class UserFeatures(BaseModel):
     role: str = "driver"
     features: Dict[str, Any]
     activity_log: List[Dict[str, Any]] = []
-    history_scores: List[float] = []
+    # Omitted: the user's last scores stored by the service, see score_history.py
+    history_scores: Optional[List[float]] = None
+    # New days only; appended to the stored activity state, which then replaces activity_log
+    activity_delta: Optional[List[Dict[str, Any]]] = None
+    # Index of activity_delta[0] in the user's history, so retries are not counted twice
+    activity_start_day: Optional[int] = None
+
+class ActivityLog(BaseModel):
+    activity_log: List[Dict[str, Any]]
+
+class BatchUserFeatures(BaseModel):
+    users: List[UserFeatures]
 
 class BoostRequest(BaseModel):
     user_id: str
     engagement_metrics: Dict[str, float]
-app = FastAPI()
+
+class BoostUpsert(BaseModel):
+    users: List[BoostRequest]
 
 class credit_score(BaseModel):
     user_profile: Dict[str, Any]
-    population_samples: List[Dict[str, Any]]
+    population_samples: List[Dict[str, Any]] = []
+
+class ScoreRequest(BaseModel):
+    user_profile: Dict[str, Any]
+    population_samples: List[Dict[str, Any]] = []
+    # Stages to return, see GET /score/stages; the ones they depend on run too
+    stages: List[str] = list(DEFAULT_STAGES)
+
+class ModelReloadRequest(BaseModel):
+    name: str
+    version: Optional[str] = None
+    mode: str = "swap"
+    shadow_percent: Optional[float] = None
+
+class PopulationUpsert(BaseModel):
+    peers: List[Dict[str, Any]]
+
+class PopulationDelete(BaseModel):
+    peer_ids: List[str]
+
+class SketchSnapshot(BaseModel):
+    # {metric: {role: sketch state}}, as GET /population/sketches returns them
+    sketches: Dict[str, Dict[str, Dict[str, Any]]]
+
+configure_logging()
+
+# ---------------- Metrics ---------------- #
+metrics.registry.gauge(
+    "ml_executor_in_flight", "Scoring calls running or waiting for a worker", (),
+    lambda: {(): scoring_executor.in_flight}
+)
+metrics.registry.gauge(
+    "ml_executor_queued", "Scoring calls waiting for a worker", (),
+    lambda: {(): scoring_executor.queued}
+)
+metrics.registry.gauge(
+    "ml_executor_queue_capacity", "Scoring calls allowed to wait for a worker", (),
+    lambda: {(): scoring_executor.queue_depth}
+)
+metrics.registry.gauge(
+    "ml_executor_rejected", "Scoring calls refused with a 503 since startup", (),
+    lambda: {(): scoring_executor.rejected}
+)
+metrics.registry.gauge(
+    "ml_lane_calls", "Scoring calls per request class; state is running or queued", ("lane", "state"),
+    lambda: {
+        key: value for name, lane in scoring_executor.lanes.items()
+        for key, value in (((name, "running"), lane.running), ((name, "queued"), len(lane.waiting)))
+    }
+)
+metrics.registry.gauge(
+    "ml_lane_refused", "Scoring calls refused with a 503 per request class; reason is queue_full or deadline",
+    ("lane", "reason"),
+    lambda: {
+        key: value for name, lane in scoring_executor.lanes.items()
+        for key, value in (((name, "queue_full"), lane.rejected), ((name, "deadline"), lane.shed))
+    }
+)
+metrics.registry.gauge(
+    "ml_model_info", "Loaded model versions; role is active or shadow", ("name", "version", "role"),
+    lambda: {
+        **{(name, meta.get("version"), "active"): 1 for name, meta in list(loaded_models.items())},
+        **{(name, version, "shadow"): 1 for name, version in model_reloader.state()["shadows"].items()}
+    }
+)
+
+metrics.registry.gauge(
+    "ml_score_cache_events", "Score cache lookups and removals since startup", ("event",),
+    lambda: {(event,): value for event, value in score_cache.stats().items()
+             if event in ("hits", "disk_hits", "misses", "evictions", "expirations")}
+)
+metrics.registry.gauge(
+    "ml_score_cache_bytes", "Pickled size of the results held in memory by the score cache", (),
+    lambda: {(): score_cache.bytes}
+)
+
+# ---------------- Request Classes ---------------- #
+# Scoring calls run in the request class the header names, else the endpoint's:
+# population-sized and batch calls are bulk, everything else interactive
+REQUEST_CLASS_HEADER = "x-request-class"
+BULK_PATHS = {"/calculate-scores/batch", "/get-credit-score"}
+
+def request_class(request):
+    name = request.headers.get(REQUEST_CLASS_HEADER)
+    if name:
+        return name.strip().lower()
+    return "bulk" if request.url.path in BULK_PATHS else "interactive"
+
+_route_paths = {}
+
+def _route_label(request):
+    # Route templates, not raw paths, so labels stay bounded
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not _route_paths:
+        _route_paths.update({getattr(r, "endpoint", None): r.path for r in app.routes})
+    return _route_paths.get(endpoint, "unmatched")
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    # Tracing is sampled: most requests get no trace and only feed the histograms
+    start = time.perf_counter()
+    arrived = time.monotonic()
+    with trace(request.url.path):
+        try:
+            lane = request_class(request)
+            if lane in scoring_executor.lanes:
+                # Deadlines count from here, so time spent reading the body counts too
+                with scoring_executor.request_class(lane, arrived):
+                    response = await call_next(request)
+            else:
+                response = NumpyJSONResponse(
+                    {"detail": f"Unknown request class '{lane}', expected one of {list(scoring_executor.lanes)}"},
+                    status_code=400
+                )
+        except Exception:
+            path = _route_label(request)
+            metrics.REQUESTS.inc(path, "500")
+            metrics.REQUEST_ERRORS.inc(path)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, path)
+            raise
+    path = _route_label(request)
+    metrics.REQUESTS.inc(path, str(response.status_code))
+    if response.status_code >= 500:
+        metrics.REQUEST_ERRORS.inc(path)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, path)
+    return response
+
+async def run_scoring(fn, *args, **kwargs):
+    """Run a scoring function on the executor, turning a full queue or a passed deadline into a 503."""
+    try:
+        return await scoring_executor.run(fn, *args, **kwargs)
+    except DeadlineExceeded as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Request deadline passed before scoring started, retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except ExecutorSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Scoring capacity exhausted, retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def _in_cache_thread(method, *args):
+    # The disk tier does file I/O, so it leaves the event loop; the memory tier is cheap enough to stay
+    if score_cache.disk_dir:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def run_cached_scoring(fn, cacheable=None, **kwargs):
+    """
+    (value, hit): run_scoring through the score cache. The cache is read and written in this
+    process and only fn goes to the executor: the cache holds a lock, which a
+    process pool cannot pickle. Hits are answered without touching the executor.
+    A hit replays the sketch additions computing the value made, so the
+    population sketches see every request whether or not it was cached.
+    """
+    if not score_cache.enabled:
+        return await run_scoring(fn, **kwargs), False
+    # Entries hold (value, sketch additions); the suffix keeps them apart from plain values
+    key = score_cache.key(f"{fn.__name__}+sketches", **kwargs)
+    cached = await _in_cache_thread(score_cache.get, key)
+    if cached is not MISS:
+        value, recorded = cached
+        population_sketches.replay(recorded)
+        return value, True
+    value, recorded = await run_scoring(recorded_call, fn, **kwargs)
+    if cacheable is None or cacheable(value):
+        await _in_cache_thread(score_cache.put, key, (value, recorded))
+    return value, False
+
+async def append_activity(updates):
+    """Append (user_id, days, start_day) updates to the stored states. Returns {user_id: ActivityState}."""
+    if not updates:
+        return {}
+    try:
+        # The store holds a lock and an SQLite connection, so it runs on a thread of this process, never the pool
+        states = await asyncio.to_thread(activity_store.append_many, updates)
+    except ActivityGap as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Activity day without {e}")
+    return {user_id: state for (user_id, _, _), state in zip(updates, states)}
+
+async def apply_activity_deltas(users):
+    """Append each user's activity_delta to their stored state. Returns {user_id: ActivityState}."""
+    return await append_activity(
+        [(u.user_id, u.activity_delta, u.activity_start_day) for u in users if u.activity_delta is not None]
+    )
+
+async def read_body(request: Request, model):
+    """
+    The body parsed as model, or the raw bytes if the client sent the binary
+    wire format instead of JSON. Invalid JSON still gets FastAPI's 422.
+    """
+    body = await request.body()
+    if is_wire_format(request.headers.get("content-type")):
+        return body
+    try:
+        return model.parse_raw(body)
+    except ValidationError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("body",))], body=body)
+
+async def stored_history(user_ids, history_scores):
+    """
+    history_scores with each None replaced by the user's stored scores of the
+    periods before the current one, so every request in a period starts from
+    the same history. The store takes an flock another process may hold, so
+    this and record_scores run on a thread rather than the event loop.
+    """
+    missing = [user_id for user_id, h in zip(user_ids, history_scores) if h is None]
+    if not missing:
+        return list(history_scores)
+    stored = iter(await asyncio.to_thread(score_history.closed_many, missing, SCORE_HISTORY_WINDOW))
+    return [next(stored) if h is None else h for h in history_scores]
+
+async def record_scores(user_ids, final_scores):
+    """
+    Record each user's new level score as their score for the current period,
+    replacing one recorded earlier in it. Only level scores computed as
+    /calculate-score computes them belong here, so the series stays
+    comparable whichever endpoint produced a score.
+    """
+    await asyncio.to_thread(score_history.record_many, list(zip(user_ids, final_scores)))
+
+def profile_user_id(user_profile):
+    user_id = user_profile.get("user_id", user_profile.get("id"))
+    return None if user_id is None else str(user_id)
+
+async def with_stored_history(user_profile):
+    """The profile, with the user's stored history_scores if it has none."""
+    user_id = profile_user_id(user_profile)
+    if user_profile.get("history_scores") is not None or user_id is None:
+        return user_profile
+    history_scores, = await stored_history([user_id], [None])
+    return {**user_profile, "history_scores": history_scores}
+
+def level_profile(user, activity_states):
+    profile = {
+        "user_id": user.user_id,
+        "role": user.role,
+        "features": user.features,
+        "activity_log": user.activity_log
+    }
+    if user.user_id in activity_states:
+        profile["activity_state"] = activity_states[user.user_id]
+    return profile
+
+def _without_error(result):
+    return "error" not in result
+
+def _without_stage_errors(results):
+    return all("error" not in result for result in results.values() if isinstance(result, dict))
+
+@app.on_event("startup")
+async def start_model_watcher():
+    if RELOAD_POLL_SECONDS > 0:
+        model_reloader.start_watcher(RELOAD_POLL_SECONDS)
+
+@app.on_event("shutdown")
+async def stop_scoring_executor():
+    scoring_executor.shutdown()
+
+@app.on_event("shutdown")
+async def flush_score_history():
+    score_history.flush()
+
+@app.on_event("shutdown")
+async def save_population_sketches():
+    population_sketches.close()
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "executor": scoring_executor.stats(),
+        "coalescers": {c.name: c.stats() for c in (level_coalescer, spam_coalescer)},
+        "score_cache": score_cache.stats()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/models")
+async def get_models():
+    return {"models": loaded_models}
+
+@app.post("/admin/models/reload", status_code=202)
+async def reload_model(request: ModelReloadRequest):
+    try:
+        model_reloader.reload(request.name, request.version, request.mode, request.shadow_percent)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return model_reloader.state()
+
+@app.get("/admin/models/reload")
+async def reload_status():
+    return model_reloader.state()
+
+@app.post("/admin/models/{name}/promote")
+async def promote_shadow_model(name: str):
+    try:
+        meta = model_reloader.promote(name)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"promoted": meta["version"], **model_reloader.state()}
+
+@app.delete("/admin/models/{name}/shadow")
+async def clear_shadow_model(name: str):
+    if not model_reloader.clear_shadow(name):
+        raise HTTPException(status_code=404, detail=f"No shadow model loaded for '{name}'")
+    return model_reloader.state()
 
 @app.post("/calculate-score")
-async def calculate_score(user_data: UserFeatures):
+async def calculate_score(request: Request):
+    user_data = await read_body(request, UserFeatures)
     try:
-        print(user_data)
-        score_dict = compute_level_score_backend(
-            user_profile={
-                "user_id": user_data.user_id,
-                "role": user_data.role,
-                "features": user_data.features,
-                "activity_log": user_data.activity_log
-            },
-            population_samples={"R_raw_values": []},
-            month_active=30,
-            history_scores=user_data.history_scores
+        if isinstance(user_data, bytes):
+            user_ids, results = await run_scoring(
+                score_level_frame, user_data,
+                population_samples={},
+                month_active=LEVEL_MONTH_ACTIVE,
+                users=1,
+                history_window=SCORE_HISTORY_WINDOW,
+                activity_states=await append_activity(activity_deltas(user_data))
+            )
+            await record_scores(user_ids, [results[0]["final_score"]])
+            return NumpyJSONResponse(results[0])
+
+        activity_states = await apply_activity_deltas([user_data])
+        score_dict, hit = await run_cached_scoring(
+            compute_level_score_backend,
+            user_profile=level_profile(user_data, activity_states),
+            population_samples={},
+            month_active=LEVEL_MONTH_ACTIVE,
+            history_scores=(await stored_history([user_data.user_id], [user_data.history_scores]))[0]
         )
+        if not hit:
+            await record_scores([user_data.user_id], [score_dict["final_score"]])
 
         # final_score, credit_score = apply_spam_penalty(
         #     final_score=float(score_dict["final_score"]),
@@ -76,18 +427,69 @@ async def calculate_score(user_data: UserFeatures):
         #     "status": "success"
         # })
 
-        # # 🔥 sanitize before returning
-        return to_serializable(score_dict)
+        # NumPy values are serialized as they are, no sanitizing pass needed
+        return NumpyJSONResponse(score_dict)
 
+    except HTTPException:
+        raise
+    except WireFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def level_final_scores(results, shape):
+    return results["final_score"] if shape == "columns" else [result["final_score"] for result in results]
+
+def batch_response(user_ids, results, shape):
+    if shape == "columns":
+        return NumpyJSONResponse({"results": {"user_id": user_ids, **results}, "status": "success"})
+    return NumpyJSONResponse({
+        "results": [{"user_id": user_id, **result} for user_id, result in zip(user_ids, results)],
+        "status": "success"
+    })
+
+@app.post("/calculate-scores/batch")
+async def calculate_scores_batch(request: Request, shape: Literal["rows", "columns"] = "rows"):
+    batch = await read_body(request, BatchUserFeatures)
+    try:
+        if isinstance(batch, bytes):
+            user_ids, results = await run_scoring(
+                score_level_frame, batch,
+                population_samples={},
+                month_active=LEVEL_MONTH_ACTIVE,
+                columnar=shape == "columns",
+                history_window=SCORE_HISTORY_WINDOW,
+                activity_states=await append_activity(activity_deltas(batch))
+            )
+            await record_scores(user_ids, level_final_scores(results, shape))
+            return batch_response(user_ids, results, shape)
+
+        activity_states = await apply_activity_deltas(batch.users)
+        user_ids = [user.user_id for user in batch.users]
+        results = await run_scoring(
+            compute_level_scores_batch,
+            user_profiles=[level_profile(user, activity_states) for user in batch.users],
+            population_samples={},
+            month_active=LEVEL_MONTH_ACTIVE,
+            history_scores=await stored_history(user_ids, [user.history_scores for user in batch.users]),
+            columnar=shape == "columns"
+        )
+        await record_scores(user_ids, level_final_scores(results, shape))
+        return batch_response(user_ids, results, shape)
+    except HTTPException:
+        raise
+    except WireFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/get-credit-score")
 async def get_credit_score(request:credit_score):
     try:
-        print("in the getcredit path")
-        score_dict = compute_final_credit_score(
-            user_profile=request.user_profile,
+        score_dict, _ = await run_cached_scoring(
+            compute_final_credit_score,
+            cacheable=_without_error,
+            user_profile=await with_stored_history(request.user_profile),
             population_samples=request.population_samples,
             delta_base=2.0,
             lambda_r=0.7,
@@ -95,11 +497,49 @@ async def get_credit_score(request:credit_score):
             target_accept=0.7,
             eta=0.1
         )
-        return to_serializable(score_dict)
+        return NumpyJSONResponse(score_dict)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/score")
+async def score(request: ScoreRequest):
+    """Level and credit scores, or any of their stages, from one pass that computes each stage once."""
+    try:
+        scoring_stages.check(request.stages)
+    except UnknownStage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        results, hit = await run_cached_scoring(
+            compute_scores,
+            cacheable=_without_stage_errors,
+            user_profile=await with_stored_history(request.user_profile),
+            stages=request.stages,
+            population_samples=request.population_samples,
+            delta_base=2.0,
+            lambda_r=0.7,
+            accept_rate=0.6,
+            target_accept=0.7,
+            eta=0.1
+        )
+        user_id = profile_user_id(request.user_profile)
+        # Only level, which is computed as /calculate-score computes it; credit_level is not recorded.
+        # A cache hit was recorded when it was computed
+        if "level" in results and user_id is not None and not hit:
+            await record_scores([user_id], [results["level"]["final_score"]])
+        return NumpyJSONResponse(results)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/score/stages")
+async def score_stages():
+    return {"stages": scoring_stages.names, "default": list(DEFAULT_STAGES)}
+
+
 @app.post("/get-initial-boost")
 async def get_initial_boost(request: BoostRequest):
     try:
@@ -112,5 +552,85 @@ async def get_initial_boost(request: BoostRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Plain def: the table rebuild and publish run on FastAPI's threadpool, off the event loop
+@app.post("/initial-boosts/upsert")
+def initial_boosts_upsert(request: BoostUpsert):
+    try:
+        engagement = pd.DataFrame([
+            {"UserID": user.user_id, **user.engagement_metrics} for user in request.users
+        ])
+        results = upsert_engaged_users(engagement)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing engagement metric {e}")
+    return {
+        "boosts": dict(zip(results["UserID"], results["InitialBoost"].astype(float))),
+        **boost_index.stats()
+    }
+
+@app.get("/activity/{user_id}")
+def get_activity(user_id: str):
+    state = activity_store.get(user_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"No activity state for user {user_id}")
+    return state.to_dict()
+
+@app.put("/activity/{user_id}")
+def replace_activity(user_id: str, request: ActivityLog):
+    try:
+        return activity_store.replace(user_id, request.activity_log).to_dict()
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Activity day without {e}")
+
+@app.delete("/activity/{user_id}")
+def delete_activity(user_id: str):
+    return {"deleted": activity_store.delete(user_id)}
+
+@app.get("/history/{user_id}")
+def get_score_history(user_id: str, limit: Optional[int] = None):
+    if limit is not None and limit < 0:
+        raise HTTPException(status_code=400, detail="limit must not be negative")
+    scores, timestamps = score_history.history(user_id, limit)
+    if not len(scores) and (limit != 0 or user_id not in score_history):
+        raise HTTPException(status_code=404, detail=f"No score history for user {user_id}")
+    return NumpyJSONResponse({"user_id": user_id, "scores": scores, "timestamps": timestamps})
+
+@app.delete("/history/{user_id}")
+def delete_score_history(user_id: str):
+    return {"deleted": score_history.delete(user_id)}
+
+@app.get("/population")
+async def get_population():
+    return population_index.stats()
+
+# Plain def: the index rebuild and shared-state publish run on FastAPI's threadpool, off the event loop
+@app.post("/population/upsert")
+def population_upsert(request: PopulationUpsert):
+    try:
+        count = upsert_population_peers(request.peers)
+        return {"upserted": count, "status": "success", **population_index.stats()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/population/delete")
+def population_delete(request: PopulationDelete):
+    count = delete_population_peers(request.peer_ids)
+    return {"deleted": count, "status": "success", **population_index.stats()}
+
+@app.get("/population/sketches")
+async def get_population_sketches():
+    return {"sketches": population_sketches.export(), **population_sketches.stats()}
+
+@app.put("/population/sketches/{source}")
+async def replace_population_sketches(source: str, request: SketchSnapshot):
+    try:
+        count = population_sketches.replace_source(source, request.sketches)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"replaced": count, "status": "success", **population_sketches.stats()}
+
+@app.delete("/population/sketches/{source}")
+async def delete_population_sketches(source: str):
+    return {"deleted": population_sketches.remove_source(source), **population_sketches.stats()}
+
 if __name__ == "__main__":
     uvicorn.run("server:app", host="0.0.0.0", port=5000, reload=True)
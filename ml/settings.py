@@ -0,0 +1,128 @@
+import os
+import socket
+from dotenv import load_dotenv
+
+# ---------------- Service Settings ---------------- #
+# Every value can be overridden through the environment or a .env file.
+load_dotenv()
+
+def env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+def env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+def env_str(name, default):
+    value = os.getenv(name)
+    return value if value not in (None, "") else default
+
+# Directory holding versioned model artifacts, see model_registry.py
+ARTIFACT_DIR = env_str(
+    "ML_ARTIFACT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts")
+)
+
+# ---------------- Hot Reload ---------------- #
+# Share of scoring calls (0-100) also scored by a shadow model
+SHADOW_PERCENT = env_float("ML_SHADOW_PERCENT", 5.0)
+# Shadow work waiting beyond this is dropped rather than queued
+SHADOW_MAX_PENDING = env_int("ML_SHADOW_MAX_PENDING", 1000)
+# Poll artifacts/<name>/LATEST this often and swap in new versions; 0 disables
+RELOAD_POLL_SECONDS = env_float("ML_RELOAD_POLL_SECONDS", 0)
+
+# ---------------- Scoring Executor ---------------- #
+# "thread" or "process". Process workers hold their own copies of the population
+# index and models, so upserts and hot reloads only reach thread workers; with
+# ML_SHARED_STATE_DIR set the population index is shared and upserts reach all.
+EXECUTOR_KIND = env_str("ML_EXECUTOR", "thread")
+EXECUTOR_WORKERS = env_int("ML_EXECUTOR_WORKERS", min(32, (os.cpu_count() or 1) + 4))
+# Scoring calls allowed to wait for a worker before new ones get a 503
+EXECUTOR_QUEUE_DEPTH = env_int("ML_EXECUTOR_QUEUE_DEPTH", 64)
+RETRY_AFTER_SECONDS = env_int("ML_RETRY_AFTER_SECONDS", 1)
+
+# ---------------- Priority Lanes ---------------- #
+# Scoring calls are "interactive" (the app's single-user calls) or "bulk" (batches
+# and population-sized credit scores), from the X-Request-Class header or the
+# endpoint. Each class has its own concurrency limit and queue; freed workers go to
+# waiting calls in proportion to the class weights. A call still waiting when its
+# deadline, counted from the request's arrival, passes is answered with a 503
+# before any model work.
+INTERACTIVE_WEIGHT = env_float("ML_INTERACTIVE_WEIGHT", 4)
+INTERACTIVE_CONCURRENCY = env_int("ML_INTERACTIVE_CONCURRENCY", EXECUTOR_WORKERS)
+INTERACTIVE_QUEUE_DEPTH = env_int("ML_INTERACTIVE_QUEUE_DEPTH", EXECUTOR_QUEUE_DEPTH)
+INTERACTIVE_DEADLINE_MS = env_float("ML_INTERACTIVE_DEADLINE_MS", 2000)
+BULK_WEIGHT = env_float("ML_BULK_WEIGHT", 1)
+# Below the pool size, so bulk calls never hold every worker
+BULK_CONCURRENCY = env_int("ML_BULK_CONCURRENCY", max(1, EXECUTOR_WORKERS // 2))
+BULK_QUEUE_DEPTH = env_int("ML_BULK_QUEUE_DEPTH", 16)
+BULK_DEADLINE_MS = env_float("ML_BULK_DEADLINE_MS", 30000)
+
+# ---------------- Inference Coalescing ---------------- #
+# Concurrent single-user predicts arriving within this window share one model
+# call. 0 disables coalescing; each caller waits at most about this long extra.
+COALESCE_WINDOW_MS = env_float("ML_COALESCE_WINDOW_MS", 0)
+COALESCE_MAX_BATCH = env_int("ML_COALESCE_MAX_BATCH", 64)
+
+# ---------------- Level Model Inference ---------------- #
+# "flat" evaluates the level model's trees as NumPy node arrays, checked against
+# XGBoost when a model is loaded; "xgboost" always calls the booster
+TREE_PREDICTOR = env_str("ML_TREE_PREDICTOR", "flat")
+# Larger batches go to XGBoost, whose threaded predictor wins past a few dozen rows
+TREE_PREDICTOR_MAX_ROWS = env_int("ML_TREE_PREDICTOR_MAX_ROWS", 16)
+
+# ---------------- Population Sketches ---------------- #
+# t-digest compression for the per-role score sketches; about compression / 2 centroids each
+SKETCH_COMPRESSION = env_float("ML_SKETCH_COMPRESSION", 100)
+# Level scores rank against the sketch only once a role has this many values; before that the percentile is 0
+SKETCH_MIN_COUNT = env_int("ML_SKETCH_MIN_COUNT", 100)
+# Directory where workers persist their sketches and merge each other's; empty keeps
+# each worker's sketches in its memory only. Shared storage merges nodes too.
+SKETCH_DIR = env_str("ML_SKETCH_DIR", "")
+# Prefix of this node's slot files in ML_SKETCH_DIR; must differ between nodes
+SKETCH_SOURCE = env_str("ML_SKETCH_SOURCE", socket.gethostname())
+# How often a worker rewrites its snapshot and merges the others'
+SKETCH_SYNC_SECONDS = env_float("ML_SKETCH_SYNC_SECONDS", 30)
+
+# ---------------- Shared State ---------------- #
+# Directory, ideally on tmpfs (e.g. /dev/shm/incentra), where worker processes share
+# read-only state: compiled model node arrays and the population index. Empty keeps
+# each worker's state private.
+SHARED_STATE_DIR = env_str("ML_SHARED_STATE_DIR", "")
+# Generations kept per kind of state
+SHARED_STATE_KEEP = env_int("ML_SHARED_STATE_KEEP", 3)
+# How often a worker looks for a newer population generation published by another
+SHARED_STATE_POLL_SECONDS = env_float("ML_SHARED_STATE_POLL_SECONDS", 1.0)
+
+# ---------------- Logging and Tracing ---------------- #
+LOG_LEVEL = env_str("ML_LOG_LEVEL", "INFO")
+LOG_FILE = env_str("ML_LOG_FILE", "credit_score_warnings.log")
+# Share of requests (0-1) whose per-stage timings are logged
+TRACE_SAMPLE_RATE = env_float("ML_TRACE_SAMPLE_RATE", 0.01)
+
+# ---------------- Score Cache ---------------- #
+# Memory cap for cached score results in bytes; 0 disables the cache
+SCORE_CACHE_MAX_BYTES = env_int("ML_SCORE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+SCORE_CACHE_TTL_SECONDS = env_float("ML_SCORE_CACHE_TTL_SECONDS", 300)
+# Optional directory shared by workers as a second tier; must not be writable by others
+SCORE_CACHE_DIR = env_str("ML_SCORE_CACHE_DIR", "")
+
+# ---------------- Activity State ---------------- #
+# SQLite file holding each user's running activity summary; ":memory:" keeps it in memory only
+ACTIVITY_DB = env_str(
+    "ML_ACTIVITY_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "activity.sqlite3")
+)
+
+# ---------------- Score History ---------------- #
+# Directory of each user's level scores in memory-mapped columns; ":memory:" keeps them in a temporary directory
+SCORE_HISTORY_DIR = env_str(
+    "ML_SCORE_HISTORY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "score_history")
+)
+# Stored scores passed as history_scores when a request sends none; the level score reads the last two
+SCORE_HISTORY_WINDOW = env_int("ML_SCORE_HISTORY_WINDOW", 2)
+# Calendar period (UTC) the history keeps one score per: "day", "week" or "month".
+# A user scored again within a period replaces that period's score.
+SCORE_HISTORY_PERIOD = env_str("ML_SCORE_HISTORY_PERIOD", "month")
@@ -0,0 +1,156 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+
+import numpy as np
+
+from settings import SHARED_STATE_DIR, SHARED_STATE_KEEP
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Shared State ---------------- #
+# Read-only arrays every worker process maps from the same files, so N workers
+# hold one copy instead of N. Each kind of state is a series of generations,
+# root/<name>/<generation>/ holding one .npy per array and a meta.json, with
+# root/<name>/LATEST naming the newest. A generation is never modified once
+# published; writers build the next one beside it.
+
+META_FILE = "meta.json"
+LATEST_FILE = "LATEST"
+LOCK_FILE = ".lock"
+
+
+class SharedStateStore:
+    """
+    Generations of NumPy arrays in files that workers attach with
+    mmap_mode="r", sharing the pages through the OS cache. Point root at a
+    tmpfs such as /dev/shm to keep them off disk.
+
+    Writers hold an exclusive flock on root/<name>/.lock while they read the
+    latest generation, derive the next one and publish it, so writers in
+    different processes take turns and none loses another's change. Older
+    generations beyond keep are removed; a worker still mapping one keeps its
+    pages until it lets go.
+    """
+
+    def __init__(self, root, keep=SHARED_STATE_KEEP):
+        self.root = root
+        self.keep = max(1, keep)
+
+    def _dir(self, name):
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def writer(self, name):
+        """Hold name's writer lock; publish() must be called inside it."""
+        os.makedirs(self._dir(name), exist_ok=True)
+        with open(os.path.join(self._dir(name), LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def generations(self, name):
+        directory = self._dir(name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            int(g) for g in os.listdir(directory)
+            if g.isdigit() and os.path.isfile(os.path.join(directory, g, META_FILE))
+        )
+
+    def latest(self, name):
+        """The newest published generation of name, or None."""
+        try:
+            with open(os.path.join(self._dir(name), LATEST_FILE)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def attach(self, name, generation=None):
+        """
+        (arrays, meta) of a generation, the latest by default, with every array
+        memory-mapped read-only; None if there is none.
+        """
+        generation = self.latest(name) if generation is None else generation
+        if generation is None:
+            return None
+        directory = os.path.join(self._dir(name), str(generation))
+        try:
+            with open(os.path.join(directory, META_FILE)) as f:
+                meta = json.load(f)
+            arrays = {
+                key: np.load(os.path.join(directory, f"{key}.npy"), mmap_mode="r", allow_pickle=False)
+                for key in meta["arrays"]
+            }
+        except FileNotFoundError:
+            # Pruned between reading LATEST and opening it; the caller retries with the new LATEST
+            return None
+        return arrays, meta
+
+    def publish(self, name, arrays, meta=None):
+        """
+        Write arrays as generation latest + 1 and make it LATEST. The caller
+        holds writer(name). Arrays must not be object arrays; store strings
+        as fixed-width unicode.
+        """
+        generation = max(self.generations(name), default=0) + 1
+        directory = self._dir(name)
+        staging = os.path.join(directory, f".staging-{generation}-{os.getpid()}")
+        os.makedirs(staging)
+        try:
+            for key, array in arrays.items():
+                np.save(os.path.join(staging, f"{key}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+            with open(os.path.join(staging, META_FILE), "w") as f:
+                json.dump({**(meta or {}), "generation": generation, "arrays": list(arrays)}, f)
+            os.replace(staging, os.path.join(directory, str(generation)))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        pointer = os.path.join(directory, f".{LATEST_FILE}-{os.getpid()}")
+        with open(pointer, "w") as f:
+            f.write(str(generation))
+        os.replace(pointer, os.path.join(directory, LATEST_FILE))
+        for old in self.generations(name)[:-self.keep]:
+            shutil.rmtree(os.path.join(directory, str(old)), ignore_errors=True)
+        logger.info("Published shared state %s/%d", name, generation)
+        return generation
+
+    def attach_or_publish(self, name, key, build):
+        """
+        The kept generation of name published for key (say a model's content
+        hash), or, if no worker has published one yet, build() -> (arrays,
+        meta) published now under the writer lock so only one worker builds
+        it. build() may return None for state it cannot produce; nothing is
+        published and None is returned.
+        """
+        found = self._find(name, key)
+        if found is not None:
+            return found
+        with self.writer(name):
+            found = self._find(name, key)
+            if found is not None:
+                return found
+            built = build()
+            if built is None:
+                return None
+            arrays, meta = built
+            return self.attach(name, self.publish(name, arrays, {**meta, "key": key}))
+
+    def _find(self, name, key):
+        # Newest first: the active model's arrays are usually the latest
+        for generation in reversed(self.generations(name)):
+            found = self.attach(name, generation)
+            if found is not None and found[1].get("key") == key:
+                return found
+        return None
+
+
+# Single store for the service; None when ML_SHARED_STATE_DIR is unset and state stays per worker
+shared_store = SharedStateStore(SHARED_STATE_DIR) if SHARED_STATE_DIR else None
+
+__all__ = ["SharedStateStore", "shared_store"]
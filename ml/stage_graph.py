@@ -0,0 +1,95 @@
+class UnknownStage(ValueError):
+    """Raised when a caller asks for a stage no module registered."""
+
+
+class StageGraph:
+    """
+    Named scoring stages. Each stage is a function of a StageRun that gets the
+    stages it depends on from the run, so dependencies are found by calling
+    them and only the stages a request needs are computed.
+    """
+
+    def __init__(self):
+        self._stages = {}  # name -> (fn, view, public)
+
+    def stage(self, name, view=None, public=True):
+        """
+        Decorator registering fn(run) as stage name. view(value) gives the
+        result as a caller sees it, the value itself by default. Private
+        stages hold per-request state other stages share and cannot be asked
+        for.
+        """
+        def register(fn):
+            if name in self._stages:
+                raise ValueError(f"Stage '{name}' is already registered")
+            self._stages[name] = (fn, view, public)
+            return fn
+        return register
+
+    @property
+    def names(self):
+        """Public stages, in the order they were registered."""
+        return [name for name, (_, _, public) in self._stages.items() if public]
+
+    def check(self, stages):
+        """Raise UnknownStage unless every name in stages is a public stage."""
+        unknown = [name for name in stages if name not in self._stages or not self._stages[name][2]]
+        if unknown:
+            raise UnknownStage(f"Unknown stages {unknown}; expected some of {self.names}")
+
+    def run(self, **params):
+        """A StageRun over params, for one request."""
+        return StageRun(self, params)
+
+
+class StageRun:
+    """
+    One request's pass through a StageGraph. A stage is computed the first
+    time it is asked for and kept, so a stage several others depend on runs
+    once. One that raised raises the same error again instead of running twice.
+    """
+
+    def __init__(self, graph, params):
+        self.graph = graph
+        self.params = params
+        self._results = {}  # name -> (ok, value or exception)
+        self._running = set()
+
+    def get(self, name):
+        done = self._results.get(name)
+        if done is None:
+            if name in self._running:
+                raise RuntimeError(f"Stage '{name}' depends on itself")
+            fn = self.graph._stages[name][0]
+            self._running.add(name)
+            try:
+                done = (True, fn(self))
+            except Exception as e:
+                done = (False, e)
+            finally:
+                self._running.discard(name)
+            self._results[name] = done
+        ok, value = done
+        if not ok:
+            raise value
+        return value
+
+    def outputs(self, stages):
+        """{stage: its view} for each named public stage, in the order given."""
+        self.graph.check(stages)
+        results = {}
+        for name in dict.fromkeys(stages):
+            view = self.graph._stages[name][1]
+            value = self.get(name)
+            results[name] = value if view is None else view(value)
+        return results
+
+    def computed(self):
+        """Names of the stages computed so far, in order."""
+        return list(self._results)
+
+
+# Stages of the level and credit scores; level_score.py and final_credit_score.py register theirs
+scoring_stages = StageGraph()
+
+__all__ = ["StageGraph", "StageRun", "UnknownStage", "scoring_stages"]
@@ -0,0 +1,146 @@
+"""
+Seeded synthetic partners for benchmarks and load tests.
+
+Profiles carry everything the scoring paths read: the level-model features
+and spam features under "features", the credit-score fields at the top level,
+an activity log and score history. The same seed, sizes and chunk size always
+give the same data, and each chunk is generated on its own, so a million
+profiles can be streamed without holding them all.
+"""
+import numpy as np
+import pandas as pd
+
+from final_credit_score import ROLE_WEIGHTS, TIER_MULTIPLIERS
+from utils import ROLE_FEATURE_KEYS
+
+ROLES = ("driver", "merchant", "delivery")
+SPAM_FEATURES = (
+    "review_count", "rating_variance", "avg_review_length",
+    "logins_per_day", "std_login_time", "account_age_days"
+)
+
+# One random stream per kind of data, so adding a field to one kind does not shift the others
+_PROFILES, _POPULATION, _SPAM = 1, 2, 3
+
+
+def _rng(seed, stream, chunk=0):
+    return np.random.default_rng([seed, stream, chunk])
+
+
+def _sample_feature(rng, name, n):
+    """Plausible values for a feature, picked by its name."""
+    if name.startswith(("cancellation", "return", "late")) and name.endswith("_rate"):
+        return rng.beta(1, 12, n)
+    if name.endswith(("_rate", "_ratio")):
+        return rng.beta(8, 2, n)
+    if name in ("rating", "avg_rating", "customer_rating"):
+        return np.round(rng.uniform(3.0, 5.0, n), 2)
+    if name in ("ratings_std", "rating_variance", "std_login_time"):
+        return rng.uniform(0.0, 1.5, n)
+    if name.startswith("total_hours"):
+        return rng.uniform(20, 300, n).round(1)
+    if name.startswith("avg_"):
+        return rng.gamma(4.0, 30.0, n).round(2)
+    if name in ("revenue_growth",):
+        return rng.normal(10, 15, n).round(2)
+    if name in ("logins_per_day",):
+        return rng.gamma(2.0, 1.0, n).round(2)
+    if name in ("account_age_days",):
+        return rng.integers(1, 2000, n)
+    if name in ("streak_days",):
+        return rng.integers(0, 60, n)
+    if "complaint" in name or name in ("disputes", "issues", "complaints"):
+        return rng.poisson(2.0, n)
+    # Counts: rides, sales, deliveries, reviews, customers
+    return rng.poisson(120, n)
+
+
+def _columns(rng, names, n):
+    return {name: _sample_feature(rng, name, n).tolist() for name in names}
+
+
+def _rows(columns, n):
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())] if names else [{} for _ in range(n)]
+
+
+def _chunk_profiles(seed, chunk, start, n, roles, activity_days, history_len):
+    rng = _rng(seed, _PROFILES, chunk)
+    role_of = rng.choice(len(roles), n)
+    tiers = list(TIER_MULTIPLIERS)
+    tier_of = rng.choice(len(tiers), n)
+    # Each user has their own activity rate, so inactivity streaks vary between users
+    active_rate = rng.beta(6, 2, n)
+    active = (rng.random((n, activity_days)) < active_rate[:, None]).tolist()
+    history = np.round(rng.uniform(0, 900, (n, history_len)), 1).tolist()
+    extras = rng.random((n, 3)).round(3).tolist()
+    spam = _rows(_columns(rng, SPAM_FEATURES, n), n)
+
+    profiles = [None] * n
+    for r, role in enumerate(roles):
+        index = np.flatnonzero(role_of == r)
+        features = _rows(_columns(rng, ROLE_FEATURE_KEYS[role], len(index)), len(index))
+        credit = _rows(_columns(rng, ROLE_WEIGHTS[role]["features"], len(index)), len(index))
+        for i, level_features, credit_features in zip(index.tolist(), features, credit):
+            user_id = str(start + i)
+            profiles[i] = {
+                "user_id": user_id,
+                "id": user_id,
+                "role": role,
+                "tier": tiers[tier_of[i]],
+                "features": {**level_features, **spam[i]},
+                **credit_features,
+                "behavior_score": extras[i][0],
+                "loyalty_score": extras[i][1],
+                "demand_score": extras[i][2],
+                "activity_log": [{"active": a} for a in active[i]],
+                "history_scores": history[i],
+                "month_active": 30
+            }
+    return profiles
+
+
+def profile_chunks(n, seed=0, chunk_size=10000, roles=ROLES, activity_days=30, history_len=3):
+    """Yield n synthetic user profiles as lists of at most chunk_size."""
+    for chunk, start in enumerate(range(0, n, chunk_size)):
+        yield _chunk_profiles(seed, chunk, start, min(chunk_size, n - start), roles, activity_days, history_len)
+
+
+def make_profiles(n, seed=0, **kwargs):
+    """n synthetic user profiles as one list."""
+    return [p for chunk in profile_chunks(n, seed, **kwargs) for p in chunk]
+
+
+def population_chunks(n, seed=0, chunk_size=100000, roles=ROLES):
+    """Yield n peer profiles for the population index, as upsert_population_peers takes them."""
+    for chunk, start in enumerate(range(0, n, chunk_size)):
+        size = min(chunk_size, n - start)
+        rng = _rng(seed, _POPULATION, chunk)
+        role_of = rng.choice(len(roles), size)
+        peers = [None] * size
+        for r, role in enumerate(roles):
+            index = np.flatnonzero(role_of == r)
+            rows = _rows(_columns(rng, ROLE_WEIGHTS[role]["features"], len(index)), len(index))
+            for i, row in zip(index.tolist(), rows):
+                peers[i] = {"id": f"peer-{start + i}", "role": role, **row}
+        yield peers
+
+
+def spam_training_frame(n=2000, seed=0, spam_rate=0.2):
+    """Labelled spam features with an is_spam column, for HybridSpamDetector training."""
+    rng = _rng(seed, _SPAM)
+    frame = pd.DataFrame(_columns(rng, SPAM_FEATURES, n))
+    is_spam = rng.random(n) < spam_rate
+    # Spammers post many short reviews with little variance, from young accounts
+    frame.loc[is_spam, "review_count"] *= 3
+    frame.loc[is_spam, "avg_review_length"] /= 4
+    frame.loc[is_spam, "rating_variance"] /= 5
+    frame.loc[is_spam, "account_age_days"] //= 10
+    frame["is_spam"] = is_spam.astype(int)
+    return frame
+
+
+__all__ = [
+    "ROLES", "SPAM_FEATURES", "profile_chunks", "make_profiles", "population_chunks",
+    "spam_training_frame"
+]
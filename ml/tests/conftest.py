@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Keep test runs off the service's on-disk state
+os.environ.setdefault("ML_ACTIVITY_DB", ":memory:")
+os.environ.setdefault("ML_SCORE_HISTORY_DIR", ":memory:")
+os.environ.setdefault("ML_SCORE_CACHE_MAX_BYTES", "0")
+
+# The service modules import each other as top-level modules from ml/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from initial_boosts import boost_reference, calculate_initial_boosts, company_preferences, df
+
+
+def _engagement(n, seed, scale=100):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"UserID": np.arange(n), **{f: rng.random(n) * scale for f in company_preferences}})
+
+
+def test_cohorts_scored_against_the_table():
+    table = _engagement(200, 0)
+    reference = boost_reference(table, company_preferences)
+    full = calculate_initial_boosts(table.copy(), company_preferences)
+    # Any split of the table into upserted cohorts gives each user their full-table boost
+    for cohort in (table.iloc[:1], table.iloc[5:8], table.iloc[100:]):
+        upserted = calculate_initial_boosts(cohort.copy(), company_preferences, reference)
+        assert upserted.equals(full.loc[cohort.index])
+
+
+def test_outside_the_bounds_is_clipped():
+    reference = boost_reference(df, company_preferences)
+    extremes = pd.DataFrame({"UserID": [1, 2], **{f: [0.0, 100.0] for f in company_preferences}})
+    boosts = calculate_initial_boosts(extremes, company_preferences, reference)["InitialBoost"].tolist()
+    assert boosts == [0.0, 20.0]
+
+
+def test_without_reference_normalises_the_cohort():
+    cohort = _engagement(20, 1)
+    assert calculate_initial_boosts(cohort.copy(), company_preferences).equals(
+        calculate_initial_boosts(cohort.copy(), company_preferences, boost_reference(cohort, company_preferences)))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from level_score import compute_level_score_backend, compute_level_scores_batch
+from synthetic import make_profiles
+
+
+def _profiles(n=120, seed=0, roles=("driver", "merchant", "delivery")):
+    profiles = make_profiles(n, seed=seed, roles=roles)
+    rng = np.random.default_rng(seed)
+    for i, profile in enumerate(profiles):
+        # Empty, one-entry, falling (trend penalty) and integer histories
+        profile["history_scores"] = [[], [float(rng.integers(0, 900))], [500.0, 450.0], [990], [300, 310]][i % 5]
+        profile["first_time_account"] = bool(i % 3)
+        if i % 7 == 0:
+            profile["activity_log"] = []
+    return profiles
+
+
+@pytest.mark.parametrize("month_active", [1, 30])
+@pytest.mark.parametrize("population", [
+    {"R_raw_values": list(np.linspace(0.2, 1.2, 40))},
+    {"R_raw_values": [0.0]},
+    {"R_raw_values": []},
+])
+def test_batch_equals_single_user(month_active, population):
+    # First-month boosts exist for driver and merchant only ("delivery" has none in ROLE_BOOSTS)
+    profiles = _profiles(roles=("driver", "merchant", "delivery") if month_active > 1 else ("driver", "merchant"))
+    histories = [p["history_scores"] for p in profiles]
+    batch = compute_level_scores_batch(profiles, population, month_active, histories)
+    single = [compute_level_score_backend(p, population, month_active, h) for p, h in zip(profiles, histories)]
+    assert batch == single
+    # Same types too, e.g. the int 80 of a capped gain
+    assert [{k: type(v) for k, v in r.items()} for r in batch] == [{k: type(v) for k, v in r.items()} for r in single]
+
+
+def test_capped_and_uncapped_gain_covered():
+    profiles = _profiles()
+    population = {"R_raw_values": list(np.linspace(0.2, 1.2, 40))}
+    reasons = [r["reason_log"] for r in compute_level_scores_batch(
+        profiles, population, 30, [p["history_scores"] for p in profiles])]
+    assert any(r.startswith("+80 gain") for r in reasons)
+    assert any(not r.startswith("+80 gain") for r in reasons)
+
+
+def test_columnar_matches_rows():
+    profiles = _profiles(40, seed=1)
+    population = {"R_raw_values": list(np.linspace(0.2, 1.2, 40))}
+    histories = [p["history_scores"] for p in profiles]
+    rows = compute_level_scores_batch(profiles, population, 30, histories)
+    columns = compute_level_scores_batch(profiles, population, 30, histories, columnar=True)
+    for field, values in columns.items():
+        assert [r[field] for r in rows] == list(values)
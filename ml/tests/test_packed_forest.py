@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import IsolationForest
+
+from packed_forest import PackedIsolationForest
+
+
+def _fit(seed=0, **params):
+    rng = np.random.default_rng(seed)
+    X = np.vstack([rng.normal(0, 1, (300, 6)), rng.normal(6, 0.5, (20, 6))])
+    return IsolationForest(n_estimators=60, random_state=seed, **params).fit(X)
+
+
+def _rows(n, seed):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 3, (n, 6)).astype(np.float32)
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"contamination": 0.1},
+    {"max_features": 0.5},
+    {"max_samples": 64, "bootstrap": True},
+])
+def test_matches_sklearn_on_random_rows(params):
+    forest = _fit(**params)
+    packed = PackedIsolationForest.from_forest(forest)
+    X = _rows(1000, 1)
+    assert np.array_equal(packed.score_samples(X), forest.score_samples(X))
+    assert np.array_equal(packed.decision_function(X), forest.decision_function(X))
+    assert np.array_equal(packed.predict(X), forest.predict(X))
+
+
+def test_split_points_and_neighbours():
+    forest = _fit(2)
+    packed = PackedIsolationForest.from_forest(forest)
+    probe = packed.probe(2000, seed=3)
+    assert np.array_equal(packed.score_samples(probe), forest.score_samples(probe))
+
+
+def test_fitted_on_dataframe():
+    rng = np.random.default_rng(4)
+    columns = list("abcdef")
+    forest = IsolationForest(n_estimators=30, random_state=0).fit(pd.DataFrame(rng.normal(0, 1, (200, 6)), columns=columns))
+    packed = PackedIsolationForest.compile(forest)
+    assert packed is not None
+    X = _rows(300, 5)
+    assert np.array_equal(packed.decision_function(X), forest.decision_function(pd.DataFrame(X, columns=columns)))
+
+
+def test_rejects_what_sklearn_rejects():
+    packed = PackedIsolationForest.from_forest(_fit())
+    with pytest.raises(ValueError):
+        packed.score_samples(np.full((1, 6), np.nan))
+    with pytest.raises(ValueError):
+        packed.score_samples(np.zeros((1, 5)))
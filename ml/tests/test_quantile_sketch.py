@@ -0,0 +1,60 @@
+import numpy as np
+
+from quantile_sketch import PopulationSketches
+
+
+def _values(seed, n=500):
+    return np.random.default_rng(seed).normal(0.5, 0.2, n)
+
+
+def test_workers_merge_through_the_directory(tmp_path):
+    a = PopulationSketches(min_count=1, directory=str(tmp_path), source="node", sync_seconds=3600)
+    b = PopulationSketches(min_count=1, directory=str(tmp_path), source="node", sync_seconds=3600)
+    a.add_many("R_raw", ["driver"] * 500, _values(0))
+    b.add_many("R_raw", ["driver"] * 500, _values(1))
+    a.sync()
+    b.sync()
+    a.sync()
+    assert a._slot[0] != b._slot[0]
+    assert a.stats()["counts"] == b.stats()["counts"] == {"R_raw": {"driver": 1000}}
+    probe = np.linspace(0, 1, 11)
+    assert np.allclose(a.percentile_rank("R_raw", "driver", probe), b.percentile_rank("R_raw", "driver", probe))
+    # Syncs drift ranks like local additions; they do not invalidate cached scores
+    assert a.generation == b.generation == 0
+
+
+def test_restart_continues_from_the_slot(tmp_path):
+    a = PopulationSketches(min_count=1, directory=str(tmp_path), source="node", sync_seconds=3600)
+    a.add_many("R_raw", ["driver"] * 500, _values(2))
+    expected = a.percentile_rank("R_raw", "driver", [0.3, 0.6])
+    a.close()
+    restarted = PopulationSketches(min_count=1, directory=str(tmp_path), source="node", sync_seconds=3600)
+    restarted.sync()
+    assert restarted._slot[0] == "node-0"
+    assert restarted.stats()["counts"] == {"R_raw": {"driver": 500}}
+    # Reloading re-folds the centroids, which moves ranks by far less than the sketch's error
+    assert np.allclose(restarted.percentile_rank("R_raw", "driver", [0.3, 0.6]), expected, atol=0.005)
+
+
+def test_removed_snapshot_is_dropped(tmp_path):
+    a = PopulationSketches(min_count=1, directory=str(tmp_path), source="a", sync_seconds=3600)
+    b = PopulationSketches(min_count=1, directory=str(tmp_path), source="b", sync_seconds=3600)
+    a.add("R_raw", "driver", 0.5)
+    a.sync()
+    b.sync()
+    assert b.stats()["counts"] == {"R_raw": {"driver": 1}}
+    (tmp_path / "a-0.json").unlink()
+    b.sync()
+    assert b.stats()["counts"] == {}
+
+
+def test_replay_adds_what_was_recorded():
+    source = PopulationSketches(min_count=1)
+    with source.recording() as recorded:
+        source.add("role_score", "driver", 0.25)
+        source.add_many("R_raw", ["driver", "merchant", "driver"], [0.1, 0.2, 0.3])
+    target = PopulationSketches(min_count=1)
+    target.replay(recorded)
+    assert target.export() == source.export()
+    source.add("R_raw", "driver", 0.9)
+    assert len(recorded) == 2
@@ -0,0 +1,62 @@
+import calendar
+
+from fastapi.testclient import TestClient
+
+import server
+from score_history import ScoreHistoryStore, period_index
+
+
+def _t(year, month, day, hour=12):
+    return float(calendar.timegm((year, month, day, hour, 0, 0)))
+
+
+def test_one_score_per_period():
+    store = ScoreHistoryStore(":memory:")
+    store.record_many([("u", 10.0, _t(2026, 1, 3)), ("u", 20.0, _t(2026, 1, 30)), ("u", 30.0, _t(2026, 2, 1))])
+    store.record_many([("u", 35.0, _t(2026, 2, 20))])
+    scores, times = store.history("u")
+    assert scores.tolist() == [20.0, 35.0]
+    assert times.tolist() == [_t(2026, 1, 30), _t(2026, 2, 20)]
+
+
+def test_closed_periods_only():
+    store = ScoreHistoryStore(":memory:")
+    # Appended several per period, as histories were kept before
+    store.append_many([("u", s, _t(2026, m, d)) for s, m, d in
+                       [(1.0, 1, 1), (2.0, 1, 9), (3.0, 2, 1), (4.0, 3, 1), (5.0, 3, 2), (6.0, 3, 3), (7.0, 4, 1)]])
+    now = _t(2026, 4, 15)
+    assert store.closed_many(["u"], 2, now) == [[3.0, 6.0]]
+    assert store.closed_many(["u"], 3, now) == [[2.0, 3.0, 6.0]]
+    assert store.closed_many(["u"], None, now) == [[2.0, 3.0, 6.0]]
+    assert store.closed_many(["u"], 10, _t(2026, 5, 1)) == [[2.0, 3.0, 6.0, 7.0]]
+    assert store.closed_many(["u", "nobody"], 0, now) == [[], []]
+    assert store.closed_many(["nobody"], 2, now) == [[]]
+
+
+def test_periods():
+    monday, sunday = _t(2026, 10, 12), _t(2026, 10, 18)
+    assert period_index([monday, sunday], "week").tolist() == [period_index([monday], "week")[0]] * 2
+    assert period_index([sunday, _t(2026, 10, 19)], "week").tolist()[0] + 1 == period_index([_t(2026, 10, 19)], "week")[0]
+    assert period_index([_t(2026, 10, 18, 0), _t(2026, 10, 18, 23)], "day").tolist() == [20744, 20744]
+
+
+def test_rescoring_does_not_ratchet():
+    client = TestClient(server.app)
+    profile = {"id": "hist-ratchet", "role": "driver", "features": {"rides_30d": 50, "rating": 4.5},
+               "activity_log": [{"active": True}] * 10}
+    client.delete("/history/hist-ratchet")
+    server.score_history.append_many([("hist-ratchet", 30.0, _t(2025, 1, 1))])
+    levels = [client.post("/score", json={"user_profile": profile, "stages": ["level"]}).json()["level"]["final_score"]
+              for _ in range(3)]
+    assert levels[0] == levels[1] == levels[2]
+    assert server.score_history.history("hist-ratchet")[0].tolist() == [30.0, levels[0]]
+
+
+def test_history_limit_zero():
+    client = TestClient(server.app)
+    server.score_history.record_many([("hist-zero", 12.0)])
+    response = client.get("/history/hist-zero", params={"limit": 0})
+    assert response.status_code == 200
+    assert response.json()["scores"] == []
+    assert client.get("/history/hist-nobody", params={"limit": 0}).status_code == 404
+    assert client.get("/history/hist-zero").json()["scores"] == [12.0]
@@ -0,0 +1,64 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hybridspamdetector import HybridSpamDetector
+
+
+@pytest.fixture(scope="module")
+def detector():
+    rng = np.random.default_rng(0)
+    detector = HybridSpamDetector()
+    df = pd.DataFrame(rng.random((400, 6)) * 50, columns=detector.required_features)
+    df["is_spam"] = ((df["review_count"] > 30) ^ (rng.random(400) < 0.1)).astype(int)
+    with contextlib.redirect_stdout(io.StringIO()):
+        detector.train_supervised(df.copy(), n_estimators=50)
+    detector.fit_anomaly(df.copy(), n_estimators=50)
+    return detector
+
+
+def _frame(detector, n, seed):
+    rng = np.random.default_rng(seed)
+    values = rng.random((n, 6)) * 60
+    values[:, 0] = np.round(values[:, 0])  # integer counts, as the service receives them
+    return pd.DataFrame(values, columns=detector.required_features)
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_score_matrix_equals_dataframe_path(detector, seed):
+    df = _frame(detector, 500, seed)
+    expected = detector.compute_hybrid_score(df.copy()).to_numpy()
+    X = df.to_numpy(dtype=np.float32)
+    assert np.array_equal(detector.score_matrix(X), expected)
+    # One row at a time, as the coalescer-less single-user path scores
+    assert np.array_equal(np.concatenate([detector.score_matrix(x) for x in X]), expected)
+
+
+@pytest.mark.parametrize("seed", [4, 5])
+def test_spam_probability_and_anomaly_score(detector, seed):
+    df = _frame(detector, 500, seed)
+    supervised_model, iso_model = detector.models
+    X = df.to_numpy(dtype=np.float32)
+    probs = supervised_model.predict_proba(df)[:, 1]
+    labels = iso_model.predict(df)
+    assert np.array_equal(detector.score_matrix(X), 0.7*probs + 0.3*((labels == -1)*1))
+    assert np.array_equal(detector.anomaly_scores(X), iso_model.decision_function(df))
+
+
+def test_feature_dicts_equal_dataframe(detector):
+    df = _frame(detector, 200, 6)
+    dicts = df.to_dict("records")
+    dicts[0]["review_count"] = "12"  # coerced to a number on both paths
+    expected = detector.compute_hybrid_score(pd.DataFrame(dicts)).to_numpy()
+    assert np.array_equal(detector.predict_hybrid_scores(dicts).to_numpy(), expected)
+    assert detector.predict_hybrid_score(dicts[1]) == expected[1]
+
+
+def test_no_models_scores_zero():
+    detector = HybridSpamDetector()
+    assert detector.score_matrix(np.zeros((3, 6), dtype=np.float32)).tolist() == [0, 0, 0]
+    assert detector.compute_hybrid_score(pd.DataFrame({"review_count": [1, 2, 3]})).tolist() == [0, 0, 0]
+    assert detector.anomaly_scores(np.zeros(6)) is None
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import xgboost as xgb
+
+from tree_predictor import FlatTreeEnsemble, UnsupportedModel
+
+
+def _fit(seed=0, missing_rate=0.1, **params):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 10, (400, 8)).astype(np.float32)
+    X[rng.random(X.shape) < missing_rate] = np.nan
+    y = np.nan_to_num(X[:, 0]) * 3 - np.nan_to_num(X[:, 1]) ** 2 + rng.normal(0, 1, 400)
+    model = xgb.XGBRegressor(n_estimators=40, max_depth=5, learning_rate=0.2, random_state=seed, **params)
+    model.fit(X, y)
+    return model
+
+
+def _rows(n, n_features, seed):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 12, (n, n_features)).astype(np.float32)
+    X[rng.random(X.shape) < 0.15] = np.nan
+    X[0] = np.nan  # a row with every feature missing
+    return X
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_booster_on_random_rows(seed):
+    model = _fit(seed)
+    booster = model.get_booster()
+    flat = FlatTreeEnsemble.from_booster(booster)
+    X = _rows(1000, 8, seed + 10)
+    expected = booster.inplace_predict(X)
+    assert np.array_equal(flat.predict(X), expected)
+    assert np.array_equal(flat.predict(X), booster.predict(xgb.DMatrix(X)))
+
+
+def test_single_rows_match_batch():
+    model = _fit()
+    flat = FlatTreeEnsemble.from_booster(model.get_booster())
+    X = _rows(50, 8, 3)
+    expected = model.get_booster().inplace_predict(X)
+    assert np.array_equal(np.concatenate([flat.predict(x) for x in X]), expected)
+
+
+def test_split_points_and_neighbours():
+    model = _fit(4)
+    flat = FlatTreeEnsemble.from_booster(model.get_booster())
+    probe = flat.probe(2000, seed=5)
+    assert np.array_equal(flat.predict(probe), model.get_booster().inplace_predict(probe))
+
+
+def test_compile_honours_early_stopping():
+    rng = np.random.default_rng(6)
+    X = rng.normal(0, 1, (300, 4)).astype(np.float32)
+    y = X[:, 0] + rng.normal(0, 1, 300)
+    model = xgb.XGBRegressor(n_estimators=200, early_stopping_rounds=3, random_state=0)
+    model.fit(X[:200], y[:200], eval_set=[(X[200:], y[200:])], verbose=False)
+    flat = FlatTreeEnsemble.compile(model)
+    assert flat is not None
+    rows = _rows(500, 4, 7)
+    assert np.array_equal(flat.predict(rows), model.predict(rows))
+
+
+def test_rejects_unsupported_objective():
+    rng = np.random.default_rng(8)
+    X = rng.normal(0, 1, (100, 3))
+    model = xgb.XGBRegressor(n_estimators=3, objective="reg:logistic").fit(X, rng.random(100))
+    with pytest.raises(UnsupportedModel):
+        FlatTreeEnsemble.from_booster(model.get_booster())
+    assert FlatTreeEnsemble.compile(model) is None
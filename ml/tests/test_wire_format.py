@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from activity_state import ActivityState, activity_store
+from wire_format import MEDIA_TYPE, WireFormatError, activity_deltas, encode_level_batch
+
+
+def _profile(user_id, seed, **extra):
+    rng = np.random.default_rng(seed)
+    return {
+        "user_id": user_id,
+        "role": "driver",
+        "features": {"rides_30d": float(rng.integers(0, 200)), "rating": 4.5, "review_count": 3.0},
+        "activity_log": [{"active": bool(a)} for a in rng.random(int(rng.integers(0, 20))) < 0.6],
+        **extra
+    }
+
+
+def test_activity_deltas_round_trip():
+    delta = [{"active": a} for a in (True, False, False, True, False, True, True, False, True)]
+    frame = encode_level_batch([
+        _profile("a", 0),
+        _profile("b", 1, activity_delta=delta, activity_start_day=4),
+        _profile("c", 2, activity_delta=[]),
+    ], history_scores=[[], [], []])
+    assert activity_deltas(frame) == [("b", delta, 4), ("c", [], None)]
+    assert activity_deltas(encode_level_batch([_profile("a", 0)])) == []
+
+
+def test_bad_start_day_rejected():
+    frame = encode_level_batch([_profile("a", 0, activity_delta=[{"active": True}], activity_start_day="x")])
+    with pytest.raises(WireFormatError):
+        activity_deltas(frame)
+
+
+def test_binary_delta_merges_stored_state_like_json():
+    client = TestClient(server.app)
+    history = [[500.0], [], [120.0, 90.0]]
+    for user_id in ("wj1", "wj2", "wj3", "wb1", "wb2", "wb3"):
+        activity_store.delete(user_id)
+    seeded = [[{"active": a} for a in (True, False, False)], [], [{"active": False}] * 5]
+    for n, days in enumerate(seeded, 1):
+        activity_store.replace(f"wj{n}", days)
+        activity_store.replace(f"wb{n}", days)
+
+    def users(prefix):
+        return [
+            _profile(f"{prefix}1", 1, activity_delta=[{"active": False}, {"active": True}], activity_start_day=3),
+            _profile(f"{prefix}2", 2, activity_delta=[{"active": False}] * 4),
+            _profile(f"{prefix}3", 3),  # no delta: scored from its activity_log
+        ]
+
+    json_users = [{**u, "history_scores": h} for u, h in zip(users("wj"), history)]
+    expected = client.post("/calculate-scores/batch", json={"users": json_users}).json()["results"]
+    frame = encode_level_batch(users("wb"), history_scores=history)
+    got = client.post("/calculate-scores/batch", content=frame, headers={"content-type": MEDIA_TYPE}).json()["results"]
+
+    for e, g in zip(expected, got):
+        assert {k: v for k, v in e.items() if k != "user_id"} == {k: v for k, v in g.items() if k != "user_id"}
+    for n in (1, 2, 3):
+        assert activity_store.get(f"wb{n}") == activity_store.get(f"wj{n}")
+    assert activity_store.get("wb1") == ActivityState.from_log(seeded[0] + [{"active": False}, {"active": True}])
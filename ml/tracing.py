@@ -0,0 +1,143 @@
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+from settings import LOG_LEVEL, LOG_FILE, TRACE_SAMPLE_RATE
+
+logger = logging.getLogger("tracing")
+
+# ---------------- Non-blocking logging ---------------- #
+# Scoring threads only enqueue records; a listener thread formats them and
+# does the console/file I/O.
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread instead of the caller."""
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(level=LOG_LEVEL, log_file=LOG_FILE):
+    """Route the root logger through a queue to console and file handlers. Safe to call repeatedly."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+        handlers = [logging.StreamHandler()]
+        if log_file:
+            handlers.append(logging.FileHandler(log_file, delay=True))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+# ---------------- Sampled tracing ---------------- #
+
+class Trace:
+    __slots__ = ("trace_id", "name", "start", "spans")
+
+    def __init__(self, trace_id, name):
+        self.trace_id = trace_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+
+_trace_ids = itertools.count(1)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def trace(name, sample_rate=None):
+    """
+    Open a trace for one request. Only a sample_rate share of traces record
+    spans; the rest make span() a no-op. A sampled trace is logged as one
+    structured line when it closes.
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate:
+        token = _current_trace.set(None)
+        try:
+            yield None
+        finally:
+            _current_trace.reset(token)
+        return
+
+    current = Trace(next(_trace_ids), name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        total_ms = (time.perf_counter() - current.start) * 1000
+        logger.info("trace %s", _TraceRecord(current, total_ms))
+
+
+class _TraceRecord:
+    """Defers JSON encoding of a finished trace until the log listener formats it."""
+    __slots__ = ("trace", "total_ms")
+
+    def __init__(self, trace, total_ms):
+        self.trace = trace
+        self.total_ms = total_ms
+
+    def __str__(self):
+        return json.dumps({
+            "trace_id": self.trace.trace_id,
+            "name": self.trace.name,
+            "total_ms": round(self.total_ms, 3),
+            "spans": [{"name": n, "ms": round(ms, 3), **attrs} for n, ms, attrs in self.trace.spans]
+        })
+
+
+class span:
+    """
+    Time one pipeline stage. Every use feeds the stage latency histogram;
+    only sampled traces also keep the span for their log line. A plain class
+    rather than @contextmanager, since it wraps every stage of every request.
+    """
+    __slots__ = ("name", "attrs", "start")
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, self.name)
+        current = _current_trace.get()
+        if current is not None:
+            current.spans.append((self.name, elapsed * 1000, self.attrs))
+        return False
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+__all__ = ["configure_logging", "trace", "span", "current_trace", "Trace"]
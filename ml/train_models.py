@@ -0,0 +1,101 @@
+"""
+Train the service models offline and publish them as versioned artifacts.
+
+    python train_models.py                                # level model + boost table
+    python train_models.py --spam-data labelled.csv       # also the spam models
+    python train_models.py --level-data 'levels/*.parquet' --spam-data spam/ --report report.json
+    python train_models.py --version 2024-06-01 --no-latest
+
+Labelled data is streamed in chunks (see training_pipeline.py), so files may be
+larger than memory. Without --level-data the level model is trained on the
+built-in example rows. Workers load whatever LATEST points to at startup (or
+ML_<NAME>_VERSION).
+"""
+import argparse
+import json
+import logging
+
+import model_registry
+from settings import ARTIFACT_DIR
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and publish Incentra model artifacts")
+    parser.add_argument("--version", default=None, help="artifact version (default: UTC timestamp)")
+    parser.add_argument("--root", default=ARTIFACT_DIR, help="artifact directory")
+    parser.add_argument("--no-latest", action="store_true", help="publish without moving LATEST")
+
+    data = parser.add_argument_group("training data (CSV or Parquet files, directories or globs)")
+    data.add_argument("--level-data", nargs="+", default=None,
+                      help="labelled users with a role column, their role's features and --level-target")
+    data.add_argument("--level-target", default="level_score", help="level score column")
+    data.add_argument("--spam-data", nargs="+", default=None, help="labelled users with an is_spam column")
+    data.add_argument("--spam-label", default="is_spam", help="spam label column (0 or 1)")
+
+    training = parser.add_argument_group("training")
+    training.add_argument("--level-trees", type=int, default=200, help="level model boosting rounds")
+    training.add_argument("--spam-trees", type=int, default=200, help="spam classifier boosting rounds")
+    training.add_argument("--forest-trees", type=int, default=200, help="isolation forest trees")
+    training.add_argument("--holdout", type=float, default=0.25,
+                          help="share of streamed rows held out for evaluation (level: only with --early-stopping)")
+    training.add_argument("--early-stopping", type=int, default=None,
+                          help="stop boosting after this many rounds without holdout improvement")
+    training.add_argument("--chunk-rows", type=int, default=None, help="rows read per chunk")
+    training.add_argument("--reservoir-rows", type=int, default=None, help="rows sampled for the isolation forest")
+    training.add_argument("--external-memory", default=None,
+                          help="directory for XGBoost's on-disk pages instead of an in-memory QuantileDMatrix")
+    training.add_argument("--threads", type=int, default=0, help="threads per stage (default: all cores)")
+    training.add_argument("--report", default=None, help="write each stage's time and memory as JSON here")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    version = args.version or model_registry.new_version()
+    publish_kwargs = {"root": args.root, "make_latest": not args.no_latest}
+
+    # Imported after logging is configured so their startup loading is reported
+    import ml_model_module
+    from initial_boosts import calculate_initial_boosts, boost_reference, publish_boost_table, df, company_preferences
+    import training_pipeline
+    from training_pipeline import TrainingReport
+
+    report = TrainingReport()
+    streaming = {
+        "early_stopping_rounds": args.early_stopping,
+        "chunk_rows": args.chunk_rows or training_pipeline.DEFAULT_CHUNK_ROWS,
+        "external_memory": args.external_memory,
+        "threads": args.threads,
+        "report": report
+    }
+
+    if args.level_data:
+        model, stats = training_pipeline.train_level_model(
+            args.level_data, target=args.level_target, n_estimators=args.level_trees,
+            holdout=args.holdout if args.early_stopping else 0.0, **streaming
+        )
+    else:
+        with report.stage("level_example"):
+            model, stats = ml_model_module.train_level_model()
+    meta = ml_model_module.publish_level_model(model, stats, version, **publish_kwargs)
+    print(f"level model {meta['version']} rmse={stats['rmse']:.4f}")
+
+    with report.stage("boost_table"):
+        boosts = calculate_initial_boosts(df.copy(), company_preferences)
+    meta = publish_boost_table(boosts, version, boost_reference(df, company_preferences), **publish_kwargs)
+    print(f"boost table {meta['version']} rows={meta['rows']}")
+
+    if args.spam_data:
+        detector, stats = training_pipeline.train_spam_models(
+            args.spam_data, label=args.spam_label, n_estimators=args.spam_trees,
+            forest_trees=args.forest_trees, holdout=args.holdout,
+            reservoir_rows=args.reservoir_rows or training_pipeline.DEFAULT_RESERVOIR_ROWS, **streaming
+        )
+        meta = detector.publish(version, metadata=stats, **publish_kwargs)
+        print(f"spam models {meta['version']} holdout={stats.get('holdout')}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"version": version, "stages": report.stages}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
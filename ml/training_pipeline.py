@@ -0,0 +1,427 @@
+"""
+Out-of-core training for the level and spam models.
+
+Labelled rows are streamed from CSV or Parquet files in chunks, parsed one
+chunk ahead in a background thread, and fed to XGBoost through a DataIter, so
+no stage holds the whole dataset: by default into a QuantileDMatrix, which
+keeps only the binned features, or with external_memory into a DMatrix that
+pages them to disk. The IsolationForest is fitted on a reservoir sample of the
+training rows taken during the same pass. Trees are built on every core.
+Each stage's time and memory go into a TrainingReport that is published with
+the artifacts.
+"""
+import glob
+import json
+import logging
+import math
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.ensemble import IsolationForest
+
+from feature_schema import ROLE_SCHEMAS
+from hybridspamdetector import HybridSpamDetector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 100_000
+DEFAULT_RESERVOIR_ROWS = 100_000
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+# ---------------- Reading ---------------- #
+def data_files(paths):
+    """Files named by paths, each a file, a directory of CSV/Parquet files or a glob."""
+    files = []
+    for path in [paths] if isinstance(paths, str) else paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith((".csv", *PARQUET_SUFFIXES))
+            ))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path)))
+        else:
+            files.append(path)
+    if not files:
+        raise FileNotFoundError(f"No training data files in {paths}")
+    return files
+
+
+def read_chunks(paths, columns, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """DataFrames of at most chunk_rows rows, holding whichever of columns each file has."""
+    wanted = set(columns)
+    for path in data_files(paths):
+        if path.endswith(PARQUET_SUFFIXES):
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise RuntimeError("Reading Parquet training data needs pyarrow: pip install pyarrow")
+            parquet = pq.ParquetFile(path)
+            present = [name for name in parquet.schema_arrow.names if name in wanted]
+            for batch in parquet.iter_batches(batch_size=chunk_rows, columns=present):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, chunksize=chunk_rows, usecols=lambda name: name in wanted)
+
+
+def prefetch(chunks, depth=2):
+    """Iterate chunks with up to depth of them produced ahead in a background thread."""
+    items = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put((True, chunk)):
+                    return
+            put((False, None))
+        except BaseException as e:
+            put((False, e))
+
+    threading.Thread(target=produce, name="training-prefetch", daemon=True).start()
+    try:
+        while True:
+            ok, item = items.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def level_matrix(frame):
+    """
+    (X, keep): a chunk's weighted level model inputs, as FeatureSchema.extract
+    builds them, and a mask of the rows whose role has a schema. A missing
+    feature is 0.
+    """
+    width = max(schema.width for schema in ROLE_SCHEMAS.values())
+    X = np.zeros((len(frame), width), dtype=np.float32)
+    roles = frame["role"].to_numpy() if "role" in frame else np.full(len(frame), None)
+    keep = np.zeros(len(frame), dtype=bool)
+    for role, schema in ROLE_SCHEMAS.items():
+        rows = roles == role
+        if rows.any():
+            values = frame.loc[rows].reindex(columns=schema.keys).apply(pd.to_numeric, errors="coerce")
+            X[rows, :schema.width] = values.fillna(0).to_numpy(dtype=float) * schema.weights
+            keep |= rows
+    return X, keep
+
+
+def spam_matrix(frame, features):
+    """(X, keep): a chunk's spam features, coerced as validate_features does, and an all-true mask."""
+    values = frame.reindex(columns=features).apply(pd.to_numeric, errors="coerce")
+    return values.fillna(0).to_numpy(dtype=np.float32), np.ones(len(frame), dtype=bool)
+
+
+def labelled_chunks(paths, label, columns, to_matrix, part="train", holdout=0.0, seed=42,
+                    chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    (X, y) for the part ("train" or "holdout") of each chunk's labelled rows.
+    Every row lands in the holdout with probability holdout, drawn from seed
+    and its chunk, so each pass over the files splits them the same way.
+    """
+    for i, frame in enumerate(prefetch(read_chunks(paths, [label, *columns], chunk_rows))):
+        if label not in frame:
+            raise ValueError(f"Training data has no '{label}' column")
+        y = pd.to_numeric(frame[label], errors="coerce").to_numpy(dtype=float)
+        X, keep = to_matrix(frame)
+        keep &= ~np.isnan(y)
+        if holdout:
+            held = np.random.default_rng([seed, i]).random(len(frame)) < holdout
+            keep &= held if part == "holdout" else ~held
+        if keep.any():
+            yield X[keep], y[keep]
+
+
+# ---------------- Feeding XGBoost ---------------- #
+class ChunkIter(xgb.DataIter):
+    """
+    XGBoost data iterator over make_chunks(), which returns a fresh iterator
+    of (X, y) chunks for every pass. observe(X, y), if given, sees each chunk
+    of the first pass, so statistics and samples come without another read.
+    """
+
+    def __init__(self, make_chunks, observe=None, feature_names=None, cache_prefix=None):
+        super().__init__(cache_prefix=cache_prefix)
+        self._make_chunks = make_chunks
+        self._observe = observe
+        self._feature_names = feature_names
+        self._chunks = None
+        self.passes = 0
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = iter(self._make_chunks())
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return 0
+        X, y = chunk
+        if self.passes == 0 and self._observe is not None:
+            self._observe(X, y)
+        input_data(data=X, label=y, feature_names=self._feature_names)
+        return 1
+
+    def reset(self):
+        if self._chunks is not None:
+            self._chunks = None
+            self.passes += 1
+
+
+def _dmatrix(make_chunks, observe=None, feature_names=None, external_memory=None, name="train", ref=None,
+             threads=-1):
+    if external_memory:
+        os.makedirs(external_memory, exist_ok=True)
+        it = ChunkIter(make_chunks, observe, feature_names, cache_prefix=os.path.join(external_memory, name))
+        return xgb.DMatrix(it, nthread=threads)
+    return xgb.QuantileDMatrix(ChunkIter(make_chunks, observe, feature_names), ref=ref, nthread=threads)
+
+
+def _sklearn_model(cls, booster, **attributes):
+    """booster as an XGBRegressor or XGBClassifier, the form the service publishes and loads."""
+    booster.set_attr(scikit_learn=json.dumps({"_estimator_type": cls._estimator_type, **attributes}))
+    try:
+        model = cls()
+        model.load_model(bytearray(booster.save_raw(raw_format="ubj")))
+    finally:
+        booster.set_attr(scikit_learn=None)
+    return model
+
+
+class Reservoir:
+    """
+    Uniform sample of at most size rows from a stream of row chunks: Algorithm
+    R, drawing a whole chunk's slots at once.
+    """
+
+    def __init__(self, size, width, seed=42):
+        self.size = size
+        self.seen = 0
+        self._rows = np.empty((size, width), dtype=np.float32)
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, X):
+        filled = min(max(self.size - self.seen, 0), len(X))
+        self._rows[self.seen:self.seen + filled] = X[:filled]
+        rest = X[filled:]
+        if len(rest):
+            # Row k of the stream (0-based) replaces a random slot with probability size / (k + 1)
+            positions = self.seen + filled + np.arange(len(rest))
+            slots = (self._rng.random(len(rest)) * (positions + 1)).astype(np.int64)
+            taken = slots < self.size
+            slots, rows = slots[taken], rest[taken]
+            # A slot drawn twice keeps the later row, as one row at a time would
+            _, last = np.unique(slots[::-1], return_index=True)
+            last = len(slots) - 1 - last
+            self._rows[slots[last]] = rows[last]
+        self.seen += len(X)
+
+    def sample(self):
+        return self._rows[:min(self.seen, self.size)]
+
+
+class _LabelStats:
+    def __init__(self):
+        self.rows, self.total, self.max = 0, 0.0, -math.inf
+
+    def add(self, X, y):
+        self.rows += len(y)
+        self.total += float(y.sum())
+        self.max = max(self.max, float(y.max()))
+
+
+# ---------------- Reporting ---------------- #
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class TrainingReport:
+    """Wall time, resident memory and row counts of each training stage."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **info):
+        """Time the block as stage name; it can add its own fields to the yielded dict."""
+        entry = {"stage": name, **info}
+        rss, start = _rss_mb(), time.perf_counter()
+        yield entry
+        entry["seconds"] = round(time.perf_counter() - start, 3)
+        end_rss = _rss_mb()
+        if end_rss is not None:
+            entry["rss_mb"] = round(end_rss, 1)
+            entry["rss_change_mb"] = round(end_rss - rss, 1)
+        entry["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        self.stages.append(entry)
+        logger.info("training stage %s", json.dumps(entry))
+
+
+# ---------------- Training ---------------- #
+def _threads(threads):
+    # 0 or less means every core, as -1 does for XGBoost and scikit-learn
+    return threads if threads and threads > 0 else -1
+
+
+def _train(params, make_chunks, label_name, report, n_estimators, holdout, early_stopping_rounds,
+           external_memory, threads, observe=None, feature_names=None):
+    """Booster trained on the chunks' train part, stopped early on the holdout part if asked."""
+    with report.stage(f"{label_name}_data") as entry:
+        train = _dmatrix(lambda: make_chunks("train"), observe, feature_names, external_memory,
+                         f"{label_name}-train", threads=threads)
+        entry["rows"] = train.num_row()
+    if not train.num_row():
+        raise ValueError("No labelled training rows")
+    evals = []
+    if holdout:
+        with report.stage(f"{label_name}_holdout_data") as entry:
+            valid = _dmatrix(lambda: make_chunks("holdout"), None, feature_names, external_memory,
+                             f"{label_name}-holdout", ref=train, threads=threads)
+            entry["rows"] = valid.num_row()
+        if valid.num_row():
+            evals = [(valid, "holdout")]
+    if early_stopping_rounds and not evals:
+        raise ValueError("Early stopping needs holdout rows")
+    with report.stage(f"{label_name}_train", trees=n_estimators) as entry:
+        evals_result = {}
+        booster = xgb.train(
+            {**params, "tree_method": "hist", "nthread": threads}, train, n_estimators,
+            evals=evals, evals_result=evals_result, early_stopping_rounds=early_stopping_rounds or None,
+            verbose_eval=False
+        )
+        if evals:
+            metric, values = next(iter(evals_result["holdout"].items()))
+            entry[f"holdout_{metric}"] = round(float(values[-1]), 6)
+        if early_stopping_rounds:
+            entry["best_iteration"] = booster.best_iteration
+    return booster
+
+
+def train_level_model(paths, target="level_score", n_estimators=200, max_depth=5, learning_rate=0.1,
+                      holdout=0.0, early_stopping_rounds=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                      external_memory=None, threads=0, seed=42, report=None):
+    """
+    Stream a labelled level dataset (a role column, each role's raw features
+    and target) and return (XGBRegressor, stats) as
+    ml_model_module.train_level_model does, stats also carrying the report.
+    """
+    report = report or TrainingReport()
+    first_stage = len(report.stages)
+    threads = _threads(threads)
+    columns = ["role", *sorted({key for schema in ROLE_SCHEMAS.values() for key in schema.keys})]
+    labels = _LabelStats()
+
+    def make_chunks(part):
+        return labelled_chunks(paths, target, columns, level_matrix, part, holdout, seed, chunk_rows)
+
+    booster = _train(
+        {"objective": "reg:squarederror", "max_depth": max_depth, "eta": learning_rate, "seed": seed},
+        make_chunks, "level", report, n_estimators, holdout, early_stopping_rounds, external_memory,
+        threads, observe=labels.add
+    )
+    model = _sklearn_model(xgb.XGBRegressor, booster)
+
+    # ---------------- Error Calculation ---------------- #
+    with report.stage("level_error") as entry:
+        squared, rows = 0.0, 0
+        for X, y in make_chunks("train"):
+            squared += float(np.square(model.predict(X) - y).sum())
+            rows += len(y)
+        rmse = math.sqrt(squared / rows)
+        entry["rows"] = rows
+    error_percent = rmse / (labels.total / labels.rows) * 100
+    stats = {"rmse": rmse, "y_max": labels.max, "error_percent": float(error_percent), "rows": labels.rows,
+             "training": report.stages[first_stage:]}
+    return model, stats
+
+
+def train_spam_models(paths, label="is_spam", n_estimators=200, max_depth=5, learning_rate=0.1,
+                      forest_trees=200, contamination=0.2, reservoir_rows=DEFAULT_RESERVOIR_ROWS,
+                      holdout=0.25, early_stopping_rounds=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                      external_memory=None, threads=0, seed=42, report=None):
+    """
+    Stream a labelled spam dataset and return a HybridSpamDetector holding
+    both trained models, with stats for its artifact metadata.
+    """
+    report = report or TrainingReport()
+    first_stage = len(report.stages)
+    threads = _threads(threads)
+    detector = HybridSpamDetector()
+    features = detector.required_features
+    reservoir = Reservoir(reservoir_rows, len(features), seed)
+
+    def make_chunks(part):
+        return labelled_chunks(paths, label, features, lambda frame: spam_matrix(frame, features), part,
+                               holdout, seed, chunk_rows)
+
+    booster = _train(
+        {"objective": "binary:logistic", "eval_metric": "logloss", "max_depth": max_depth,
+         "eta": learning_rate, "seed": seed},
+        make_chunks, "spam", report, n_estimators, holdout, early_stopping_rounds, external_memory,
+        threads, observe=lambda X, y: reservoir.add(X), feature_names=features
+    )
+    supervised = _sklearn_model(xgb.XGBClassifier, booster, n_classes_=2, classes_=[0, 1])
+    stats = {"rows": reservoir.seen}
+
+    if holdout:
+        with report.stage("spam_holdout_report") as entry:
+            counts = np.zeros((2, 2), dtype=np.int64)  # [actual, predicted]
+            for X, y in make_chunks("holdout"):
+                predicted = supervised.predict(pd.DataFrame(X, columns=features))
+                np.add.at(counts, (y.astype(int), predicted.astype(int)), 1)
+            tn, fp, fn, tp = counts.ravel().tolist()
+            entry["rows"] = int(counts.sum())
+            stats["holdout"] = {
+                "accuracy": (tp + tn) / max(counts.sum(), 1),
+                "precision": tp / max(tp + fp, 1),
+                "recall": tp / max(tp + fn, 1)
+            }
+
+    with report.stage("spam_anomaly", trees=forest_trees) as entry:
+        sample = pd.DataFrame(reservoir.sample(), columns=features)
+        entry["rows"] = len(sample)
+        iso_model = IsolationForest(
+            n_estimators=forest_trees, contamination=contamination, random_state=seed, n_jobs=threads
+        )
+        iso_model.fit(sample)
+
+    detector.swap_models((supervised, iso_model))
+    stats["training"] = report.stages[first_stage:]
+    return detector, stats
+
+
+__all__ = [
+    "DEFAULT_CHUNK_ROWS", "DEFAULT_RESERVOIR_ROWS", "ChunkIter", "Reservoir", "TrainingReport",
+    "data_files", "read_chunks", "prefetch", "level_matrix", "spam_matrix", "labelled_chunks",
+    "train_level_model", "train_spam_models"
+]
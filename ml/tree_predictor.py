@@ -0,0 +1,218 @@
+import json
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Objectives whose prediction is the raw margin, so no output transform is needed
+IDENTITY_OBJECTIVES = ("reg:squarederror",)
+
+
+class UnsupportedModel(ValueError):
+    """Raised for boosters the flat predictor cannot reproduce exactly."""
+
+
+class FlatTreeEnsemble:
+    """
+    An XGBoost tree ensemble as flat node arrays, evaluated with NumPy.
+
+    Every tree's nodes are concatenated into one set of arrays, with leaves
+    pointing back at themselves, so a batch walks all trees at once in
+    max_depth steps. It follows XGBoost's CPU predictor exactly: features are
+    float32, a NaN takes the node's default branch, otherwise x < split goes
+    left, and leaf values are added to base_score one tree at a time in
+    float32. Single rows reuse per-thread buffers instead of allocating.
+    """
+
+    def __init__(self, children, features, thresholds, default_left, values, roots, depth, base_score, n_features):
+        self.children = children          # (nodes, 2) int32, [left, right]; a leaf's are its own index
+        self.features = features          # (nodes,) int32; 0 for leaves
+        self.thresholds = thresholds      # (nodes,) float32
+        self.default_left = default_left  # (nodes,) bool, branch for a missing value
+        self.values = values              # (nodes,) float32 leaf values
+        self.roots = roots                # (trees,) int32
+        self.depth = depth
+        self.base_score = np.float32(base_score)
+        self.n_features = n_features
+        self._flat_children = children.reshape(-1)
+        self._local = threading.local()
+
+    @classmethod
+    def from_booster(cls, booster, n_trees=None):
+        """Build from an xgboost.Booster, using its first n_trees trees (all by default)."""
+        learner = json.loads(booster.save_raw(raw_format="json"))["learner"]
+        gbm = learner["gradient_booster"]
+        objective = learner["objective"]["name"]
+        params = learner["learner_model_param"]
+        if gbm["name"] != "gbtree":
+            raise UnsupportedModel(f"Booster type '{gbm['name']}' is not supported, only gbtree")
+        if objective not in IDENTITY_OBJECTIVES:
+            raise UnsupportedModel(f"Objective '{objective}' is not supported")
+        if int(params.get("num_class", 0)) > 1 or int(params.get("num_target", 1)) > 1:
+            raise UnsupportedModel("Multi-output models are not supported")
+        trees = gbm["model"]["trees"][:n_trees]
+
+        children, features, thresholds, default_left, values, roots = [], [], [], [], [], []
+        offset, depth = 0, 0
+        for tree in trees:
+            if any(tree["split_type"]):
+                raise UnsupportedModel("Categorical splits are not supported")
+            left = np.asarray(tree["left_children"], dtype=np.int64)
+            right = np.asarray(tree["right_children"], dtype=np.int64)
+            n = len(left)
+            leaf = left == -1
+            own = np.arange(n)
+            children.append(np.stack([np.where(leaf, own, left), np.where(leaf, own, right)], axis=1) + offset)
+            features.append(np.where(leaf, 0, tree["split_indices"]))
+            conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+            thresholds.append(conditions)
+            default_left.append(np.asarray(tree["default_left"], dtype=bool))
+            values.append(np.where(leaf, conditions, np.float32(0)))
+            roots.append(offset)
+            depth = max(depth, _tree_depth(left, right))
+            offset += n
+
+        def concat(parts, dtype, shape=(0,)):
+            return np.concatenate(parts).astype(dtype) if parts else np.empty(shape, dtype=dtype)
+
+        return cls(
+            children=concat(children, np.int32, (0, 2)),
+            features=concat(features, np.int32),
+            thresholds=concat(thresholds, np.float32),
+            default_left=concat(default_left, bool),
+            values=concat(values, np.float32),
+            roots=np.asarray(roots, dtype=np.int32),
+            depth=depth,
+            base_score=float(params["base_score"]),
+            n_features=int(params["num_feature"])
+        )
+
+    @classmethod
+    def compile(cls, model, probe_rows=512, seed=0):
+        """
+        Flat predictor for a fitted XGBRegressor, or None (with a warning) if
+        the model is unsupported or the predictor disagrees with model.predict
+        on probe rows built around the model's own split points.
+        """
+        try:
+            booster = model.get_booster()
+            predictor = cls.from_booster(booster, _iteration_trees(model, booster))
+        except UnsupportedModel as e:
+            logger.warning("Flat tree predictor unavailable: %s; using the XGBoost predictor", e)
+            return None
+        probe = predictor.probe(probe_rows, seed)
+        if not np.array_equal(predictor.predict(probe), model.predict(probe)):
+            logger.warning("Flat tree predictor disagrees with XGBoost on probe rows; using the XGBoost predictor")
+            return None
+        return predictor
+
+    # Arrays and scalars that make up a predictor, for sharing it between processes
+    ARRAYS = ("children", "features", "thresholds", "default_left", "values", "roots")
+
+    def to_arrays(self):
+        """(arrays, meta) for SharedStateStore.publish."""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        return arrays, {"depth": self.depth, "base_score": float(self.base_score), "n_features": self.n_features}
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """Rebuild from to_arrays output, e.g. memory-mapped from shared state, without copying."""
+        return cls(**{name: arrays[name] for name in cls.ARRAYS},
+                   depth=meta["depth"], base_score=meta["base_score"], n_features=meta["n_features"])
+
+    def probe(self, n, seed=0):
+        """Rows mixing split thresholds, their float32 neighbours, NaN and random values."""
+        rng = np.random.default_rng(seed)
+        X = rng.normal(0, 100, (n, self.n_features)).astype(np.float32)
+        splits = self.children[:, 0] != np.arange(len(self.children))
+        for f in range(self.n_features):
+            points = self.thresholds[splits & (self.features == f)]
+            if len(points):
+                points = np.concatenate([
+                    points, np.nextafter(points, np.float32(-np.inf)), np.nextafter(points, np.float32(np.inf))
+                ])
+                pick = rng.random(n) < 0.7
+                X[pick, f] = rng.choice(points, pick.sum())
+        X[rng.random(X.shape) < 0.05] = np.nan
+        return X
+
+    def _leaves(self, X):
+        """(rows, trees) leaf node indices for a float32 (rows, features) matrix."""
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        rows = np.arange(len(X))[:, None]
+        for _ in range(self.depth):
+            x = X[rows, self.features[nodes]]
+            go_left = (x < self.thresholds[nodes]) | (np.isnan(x) & self.default_left[nodes])
+            nodes = self._flat_children[2 * nodes + ~go_left]
+        return nodes
+
+    def _predict_row(self, x):
+        # Same steps as _leaves for one row, written into this thread's buffers
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            t = len(self.roots)
+            buffers = self._local.buffers = (
+                np.empty(t, np.int32), np.empty(t, np.int32), np.empty(t, np.float32),
+                np.empty(t, np.float32), np.empty(t, bool), np.empty(t, bool), np.empty(t + 1, np.float32)
+            )
+        nodes, index, xs, split, left, missing, sums = buffers
+        nodes[:] = self.roots
+        for _ in range(self.depth):
+            np.take(self.features, nodes, out=index)
+            np.take(x, index, out=xs)
+            np.take(self.thresholds, nodes, out=split)
+            np.less(xs, split, out=left)
+            np.isnan(xs, out=missing)
+            missing &= np.take(self.default_left, nodes)
+            left |= missing
+            np.multiply(nodes, 2, out=nodes)
+            nodes += 1
+            nodes -= left
+            np.take(self._flat_children, nodes, out=nodes)
+        sums[0] = self.base_score
+        np.take(self.values, nodes, out=sums[1:])
+        return np.add.accumulate(sums, out=sums)[-1]
+
+    def predict(self, X):
+        """float32 predictions for an (N, features) matrix, equal to Booster.inplace_predict's."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Feature shape mismatch, expected: {self.n_features}, got {X.shape[1]}")
+        if len(X) == 1:
+            return np.array([self._predict_row(X[0])], dtype=np.float32)
+        # The base score then each tree's leaf value, added left to right in float32
+        sums = np.empty((len(X), len(self.roots) + 1), dtype=np.float32)
+        sums[:, 0] = self.base_score
+        sums[:, 1:] = self.values[self._leaves(X)]
+        return np.add.accumulate(sums, axis=1)[:, -1]
+
+    def stats(self):
+        return {"trees": len(self.roots), "nodes": len(self.values), "depth": self.depth}
+
+
+def _tree_depth(left, right):
+    depth, level = 0, np.array([0])
+    while True:
+        splits = level[left[level] != -1]
+        if not len(splits):
+            return depth
+        level = np.concatenate([left[splits], right[splits]])
+        depth += 1
+
+
+def _iteration_trees(model, booster):
+    """Number of leading trees XGBRegressor.predict uses, honouring early stopping."""
+    try:
+        iterations = model.best_iteration + 1
+    except AttributeError:
+        return None
+    config = json.loads(booster.save_config())["learner"]["gradient_booster"]
+    per_iteration = int(config.get("gbtree_model_param", {}).get("num_parallel_tree", 1))
+    return iterations * per_iteration
+
+
+__all__ = ["FlatTreeEnsemble", "UnsupportedModel", "IDENTITY_OBJECTIVES"]
@@ -7,6 +7,19 @@ ROLE_TIERS = {
     "delivery_partner":[220,480,740]
 }
 
+# Ordered model inputs per role; position i is scaled by ROLE_FEATURE_WEIGHTS[role][i]
+ROLE_FEATURE_KEYS = {
+    "driver":["login_rate","streak_days","rides_30d","on_time_rate","cancellation_rate","rating",
+              "avg_ride_distance","peak_hour_rides","late_pickup_rate","customer_complaints",
+              "ratings_std","total_hours_worked"],
+    "merchant":["login_rate","streak_days","sales_30d","order_fulfillment_rate","return_rate","rating",
+                "avg_order_value","peak_hour_sales","complaints_received","new_customers_acquired",
+                "repeat_customer_rate","total_hours_operated"],
+    "delivery":["login_rate","streak_days","deliveries_30d","on_time_delivery_rate","cancellation_rate","rating",
+                "avg_delivery_distance","peak_hour_deliveries","late_delivery_rate","customer_complaints",
+                "ratings_std","total_hours_worked"]
+}
+
 ROLE_FEATURE_WEIGHTS = {
     "driver":[1.0,0.8,1.0,1.0,1.0,0.9,0.8,0.7,1.0,0.9,0.8,0.6],
     "merchant":[1.0,0.8,1.0,1.0,0.9,0.9,0.8,0.7,1.0,0.9,0.8,0.6],
@@ -43,14 +56,9 @@ def apply_fairness(score, tier, inactivity_days, inconsistent_days):
     return score_after, penalty, streak_bonus
 
 def compute_days(activity_log,max_inactivity_gap=7):
-    inconsistent_days = sum(1 for day in activity_log if not day["active"])
-    inactivity_days = 0
-    print('data isss ',activity_log)
-    for day in activity_log:
-        is_active=day.get("active",False) 
-        if not is_active:
-            inactivity_days+=1
-    return inconsistent_days,inactivity_days
+    # Both counts are inactive days; one pass instead of two
+    inactivity_days = sum(1 for day in activity_log if not day["active"])
+    return inactivity_days,inactivity_days
 
 def detailed_activity_analysis(activity_log):
     inactive_streaks=[]
@@ -0,0 +1,345 @@
+import json
+import struct
+from graphlib import CycleError, TopologicalSorter
+
+import numpy as np
+
+from feature_schema import ROLE_SCHEMAS, generic_weighted_features
+from level_score import LevelInputs, ROLE_MILESTONES, activity_summary, score_level_inputs, spam_detector
+from score_history import score_history
+
+# Content type clients send to use this format instead of JSON
+MEDIA_TYPE = "application/vnd.incentra.level-batch"
+VERSION = 1
+
+MAGIC = b"INCW"
+# magic, version, reserved, header length
+_PREFIX = struct.Struct("<4sHHI")
+_ALIGN = 8
+
+# name -> (dtype, shape given n users and k features); activity_bits is one byte string
+_BUFFERS = {
+    "features": (np.dtype("<f8"), lambda n, k: (n, k)),
+    "activity_days": (np.dtype("<u4"), lambda n, k: (n,)),
+    "activity_bits": (np.dtype("u1"), None),
+}
+
+
+class WireFormatError(ValueError):
+    """Raised for a body that is not a valid level batch frame."""
+
+
+def is_wire_format(content_type):
+    return bool(content_type) and content_type.split(";")[0].strip().lower() == MEDIA_TYPE
+
+
+class LevelBatch:
+    """A decoded frame: the scoring inputs plus what the response needs."""
+
+    __slots__ = ("inputs", "user_ids", "history_scores")
+
+    def __init__(self, inputs, user_ids, history_scores):
+        self.inputs = inputs
+        self.user_ids = user_ids
+        self.history_scores = history_scores
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+# ---------------- Encoding ---------------- #
+def _activity_bits(profile):
+    """(days, LSB-first packed bytes) for a profile's activity delta, state or log."""
+    state = profile.get("activity_state")
+    if state is not None and profile.get("activity_delta") is None:
+        return state.days, bytes(state.history)
+    days = profile.get("activity_delta")
+    if days is None:
+        days = profile.get("activity_log", [])
+    active = np.array([bool(day["active"]) for day in days], dtype=bool)
+    return len(active), np.packbits(active, bitorder="little").tobytes()
+
+
+def encode_level_batch(user_profiles, history_scores=None, feature_names=None):
+    """
+    Frame a list of level-score profiles, as the batch endpoint takes them, in
+    the binary format. feature_names fixes the feature column order; by default
+    it is every feature name in order of first appearance. Features a profile
+    does not have are sent as NaN. A profile with an activity_delta sends those
+    days (and its activity_start_day) for the service to append to its stored
+    activity state, as the JSON endpoints do, instead of its activity_log.
+    """
+    n = len(user_profiles)
+    if feature_names is None:
+        feature_names = list(dict.fromkeys(k for p in user_profiles for k in p.get("features", {})))
+    column = {name: j for j, name in enumerate(feature_names)}
+    features = np.full((n, len(feature_names)), np.nan, dtype="<f8")
+    for i, profile in enumerate(user_profiles):
+        for name, value in profile.get("features", {}).items():
+            features[i, column[name]] = float(value)
+
+    # Roles without a schema feed the model their features in dict order, so the frame records it
+    role_features = {}
+    for role in dict.fromkeys(p.get("role", "driver") for p in user_profiles):
+        if role in ROLE_SCHEMAS:
+            continue
+        # One order every profile of the role agrees with; each keeps its features' relative order
+        graph = TopologicalSorter()
+        for p in user_profiles:
+            if p.get("role", "driver") == role:
+                keys = list(p.get("features", {}))
+                for i, key in enumerate(keys):
+                    graph.add(key, *keys[:i][-1:])
+        try:
+            role_features[role] = list(graph.static_order())
+        except CycleError:
+            raise ValueError(f"Profiles with role '{role}' list their features in conflicting orders")
+
+    activity = [_activity_bits(p) for p in user_profiles]
+    buffers = {
+        "features": features.tobytes(),
+        "activity_days": np.array([days for days, _ in activity], dtype="<u4").tobytes(),
+        "activity_bits": b"".join(bits for _, bits in activity),
+    }
+
+    header = {
+        "user_ids": [str(p.get("user_id", 0)) for p in user_profiles],
+        "roles": [p.get("role", "driver") for p in user_profiles],
+        "first_time_account": [bool(p.get("first_time_account", True)) for p in user_profiles],
+        "feature_names": list(feature_names),
+        "role_features": role_features,
+        "buffers": {}
+    }
+    if history_scores is not None:
+        header["history_scores"] = [list(h) for h in history_scores]
+    if any(p.get("activity_delta") is not None for p in user_profiles):
+        header["activity_delta"] = [p.get("activity_delta") is not None for p in user_profiles]
+        header["activity_start_day"] = [p.get("activity_start_day") for p in user_profiles]
+
+    # Buffer offsets are relative to the end of the header and 8-byte aligned
+    offset = 0
+    for name, data in buffers.items():
+        header["buffers"][name] = [offset, len(data)]
+        offset += len(data) + (-len(data) % _ALIGN)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-(_PREFIX.size + len(header_bytes)) % _ALIGN)
+
+    parts = [_PREFIX.pack(MAGIC, VERSION, 0, len(header_bytes)), header_bytes]
+    for data in buffers.values():
+        parts.append(data)
+        parts.append(b"\0" * (-len(data) % _ALIGN))
+    return b"".join(parts)
+
+
+# ---------------- Decoding ---------------- #
+def _read_frame(body):
+    """(header, {name: ndarray view into body})."""
+    view = memoryview(body)
+    if len(view) < _PREFIX.size:
+        raise WireFormatError("Body is too short for a level batch frame")
+    magic, version, _, header_len = _PREFIX.unpack_from(view)
+    if magic != MAGIC:
+        raise WireFormatError("Body is not a level batch frame")
+    if version != VERSION:
+        raise WireFormatError(f"Unsupported level batch version {version}, expected {VERSION}")
+    start = _PREFIX.size + header_len
+    if start > len(view):
+        raise WireFormatError("Level batch header runs past the end of the body")
+    try:
+        header = json.loads(bytes(view[_PREFIX.size:start]))
+        user_ids, roles = header["user_ids"], header["roles"]
+        feature_names = header["feature_names"]
+        locations = header["buffers"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise WireFormatError(f"Bad level batch header: {e}")
+
+    n, k = len(user_ids), len(feature_names)
+    if len(roles) != n:
+        raise WireFormatError(f"Level batch has {n} user ids but {len(roles)} roles")
+    arrays = {}
+    for name, (dtype, shape) in _BUFFERS.items():
+        try:
+            offset, nbytes = (int(x) for x in locations[name])
+        except (KeyError, TypeError, ValueError):
+            raise WireFormatError(f"Level batch header has no valid '{name}' buffer")
+        if offset < 0 or nbytes < 0 or start + offset + nbytes > len(view):
+            raise WireFormatError(f"Level batch buffer '{name}' runs past the end of the body")
+        expected = None if shape is None else dtype.itemsize * int(np.prod(shape(n, k)))
+        if expected is not None and nbytes != expected:
+            raise WireFormatError(f"Level batch buffer '{name}' has {nbytes} bytes, expected {expected}")
+        # A view, not a copy; the frame keeps its buffers 8-byte aligned
+        array = np.frombuffer(view, dtype=dtype, count=nbytes // dtype.itemsize, offset=start + offset)
+        arrays[name] = array if shape is None else array.reshape(shape(n, k))
+    return header, arrays
+
+
+def _activity_summaries(days, packed):
+    """
+    Per-user (inconsistent_days, inactivity_days, avg_streak, max_streak) from
+    the packed bitsets, with the types activity_summary returns, without a
+    Python loop over days.
+    """
+    n = len(days)
+    days = days.astype(np.int64)
+    byte_offsets = np.concatenate([[0], np.cumsum((days + 7) // 8)])
+    if byte_offsets[-1] != len(packed):
+        raise WireFormatError(
+            f"Level batch activity_bits has {len(packed)} bytes, expected {byte_offsets[-1]}"
+        )
+    total = int(days.sum())
+    owner = np.repeat(np.arange(n), days)
+    day_starts = np.concatenate([[0], np.cumsum(days)])
+    # Bit position of every day: the user's first bit plus the day's index in their history
+    positions = byte_offsets[:-1][owner] * 8 + (np.arange(total) - day_starts[:-1][owner])
+    inactive = ~np.unpackbits(packed, bitorder="little").astype(bool)[positions]
+
+    first_day = np.zeros(total, dtype=bool)
+    last_day = np.zeros(total, dtype=bool)
+    first_day[day_starts[:-1][days > 0]] = True
+    last_day[day_starts[1:][days > 0] - 1] = True
+    before = np.concatenate([[False], inactive[:-1]]) & ~first_day
+    after = np.concatenate([inactive[1:], [False]]) & ~last_day
+    run_starts = np.flatnonzero(inactive & ~before)
+    run_lengths = np.flatnonzero(inactive & ~after) - run_starts + 1
+    run_owner = owner[run_starts]
+
+    inactivity = np.bincount(owner[inactive], minlength=n).tolist()
+    streaks = np.bincount(run_owner, minlength=n)
+    streak_totals = np.zeros(n, dtype=np.int64)
+    np.add.at(streak_totals, run_owner, run_lengths)
+    streak_max = np.zeros(n, dtype=np.int64)
+    np.maximum.at(streak_max, run_owner, run_lengths)
+    return [
+        (inactivity[i], inactivity[i], np.float64(streak_totals[i]) / streaks[i], int(streak_max[i]))
+        if streaks[i] else (inactivity[i], inactivity[i], 0, 0)
+        for i in range(n)
+    ]
+
+
+def activity_deltas(body):
+    """
+    (user_id, days, start_day) for each user whose frame activity is a delta,
+    as ActivityStore.append_many takes them. The server appends these before
+    scoring, so binary and JSON requests build on the same stored state.
+    """
+    header, arrays = _read_frame(body)
+    flags = header.get("activity_delta")
+    if not flags:
+        return []
+    n = len(header["user_ids"])
+    start_days = header.get("activity_start_day") or [None] * n
+    if len(flags) != n or len(start_days) != n:
+        raise WireFormatError("Level batch header lists do not all have one entry per user")
+    days = arrays["activity_days"].astype(np.int64)
+    byte_offsets = np.concatenate([[0], np.cumsum((days + 7) // 8)])
+    if byte_offsets[-1] != len(arrays["activity_bits"]):
+        raise WireFormatError(
+            f"Level batch activity_bits has {len(arrays['activity_bits'])} bytes, expected {byte_offsets[-1]}"
+        )
+    updates = []
+    for i in np.flatnonzero(np.asarray(flags, dtype=bool)).tolist():
+        bits = np.unpackbits(arrays["activity_bits"][byte_offsets[i]:byte_offsets[i + 1]], bitorder="little")
+        start_day = start_days[i]
+        if start_day is not None and (not isinstance(start_day, int) or start_day < 0):
+            raise WireFormatError(f"Bad level batch activity_start_day {start_day!r}")
+        updates.append((header["user_ids"][i], [{"active": bool(b)} for b in bits[:days[i]]], start_day))
+    return updates
+
+
+def decode_level_batch(body):
+    """
+    Decode a binary frame into a LevelBatch. The feature and activity buffers
+    are read in place; the only copies are the per-role model matrices and the
+    spam matrix the models consume.
+    """
+    header, arrays = _read_frame(body)
+    user_ids, feature_names = header["user_ids"], header["feature_names"]
+    n, k = len(user_ids), len(feature_names)
+    roles = np.array(header["roles"], dtype=object)
+    first_time = np.array(header.get("first_time_account", [True] * n), dtype=bool)
+    history_scores = header.get("history_scores")
+    role_features = header.get("role_features") or {}
+    if len(first_time) != n or (history_scores is not None and len(history_scores) != n):
+        raise WireFormatError("Level batch header lists do not all have one entry per user")
+    if history_scores is not None:
+        # Floats, as the JSON endpoints' List[float] field gives them
+        try:
+            history_scores = [[float(s) for s in h] for h in history_scores]
+        except (TypeError, ValueError) as e:
+            raise WireFormatError(f"Bad level batch history_scores: {e}")
+
+    raw = arrays["features"]
+    present = ~np.isnan(raw)
+    # A trailing zero column stands in for features the frame does not carry
+    filled = np.zeros((n, k + 1))
+    np.copyto(filled[:, :k], raw, where=present)
+    column = {name: j for j, name in enumerate(feature_names)}
+
+    def columns(names):
+        return [column.get(name, k) for name in names]
+
+    groups = []
+    layouts = {}
+    for i, role in enumerate(roles):
+        layouts.setdefault(role, []).append(i)
+    for role, index in layouts.items():
+        schema = ROLE_SCHEMAS.get(role)
+        if schema is not None:
+            groups.append((filled[np.ix_(index, columns(schema.keys))] * schema.weights, index))
+            continue
+        # Without a schema the model input is the user's features in the order the frame gives for the role
+        role_columns = [column[name] for name in role_features.get(role, feature_names) if name in column]
+        rows = {}
+        for i in index:
+            features = {feature_names[j]: raw[i, j] for j in role_columns if present[i, j]}
+            row = generic_weighted_features(features, role)
+            widths = rows.setdefault(row.shape[1], ([], []))
+            widths[0].append(row)
+            widths[1].append(i)
+        groups.extend((np.vstack(r), idx) for r, idx in rows.values())
+
+    milestone_counts = {}
+    for role, (feature, _) in ROLE_MILESTONES.items():
+        index = np.flatnonzero(roles == role)
+        if len(index):
+            milestone_counts[role] = filled[index, column.get(feature, k)]
+
+    inputs = LevelInputs(
+        user_ids=user_ids,
+        roles=roles,
+        groups=groups,
+        milestone_counts=milestone_counts,
+        first_time=first_time,
+        spam_matrix=filled[:, columns(spam_detector.required_features)].astype(np.float32),
+        activity=_activity_summaries(arrays["activity_days"], arrays["activity_bits"])
+    )
+    return LevelBatch(inputs, user_ids, history_scores)
+
+
+def score_level_frame(body, population_samples, month_active, users=None, columnar=False, history_window=None,
+                      activity_states=None):
+    """
+    Decode a frame and level-score it: (user_ids, results). users, if given, is the required batch size.
+    A frame without history_scores is scored with each user's stored scores of their last history_window
+    periods before the current one, if given, as the JSON endpoints read them.
+    activity_states ({user_id: ActivityState}, from appending activity_deltas) replaces those users' activity.
+    """
+    batch = decode_level_batch(body)
+    if users is not None and len(batch) != users:
+        raise WireFormatError(f"Expected a frame with {users} user(s), got {len(batch)}")
+    if activity_states:
+        for i, user_id in enumerate(batch.user_ids):
+            if user_id in activity_states:
+                batch.inputs.activity[i] = activity_summary({"activity_state": activity_states[user_id]})
+    history_scores = batch.history_scores
+    if history_scores is None and history_window is not None:
+        history_scores = score_history.closed_many(batch.user_ids, history_window)
+    return batch.user_ids, score_level_inputs(
+        batch.inputs, population_samples, month_active, history_scores, columnar
+    )
+
+
+__all__ = [
+    "MEDIA_TYPE", "VERSION", "WireFormatError", "LevelBatch",
+    "is_wire_format", "encode_level_batch", "activity_deltas", "decode_level_batch", "score_level_frame"
+]